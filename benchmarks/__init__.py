@@ -0,0 +1 @@
+"""离线性能测试工具：本地替身服务和模型，不消耗 OpenAI 配额"""
@@ -0,0 +1,134 @@
+"""本地假嵌入服务：兼容 OpenAI /v1/embeddings 接口，可配置延迟和限流，也可以让前若干个请求直接返回 429
+
+用法：
+    python -m benchmarks.fake_openai_server --port 8765 --rpm 120 --latency 0.2
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake streamlit run streamlit_app.py
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def hash_vector(value, dimensions):
+    """由输入内容确定性地生成单位向量"""
+    seed = int.from_bytes(hashlib.sha256(json.dumps(value, ensure_ascii=False).encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class RateLimiter:
+    """按每分钟请求数限流的令牌桶"""
+
+    def __init__(self, requests_per_minute):
+        self.capacity = max(1.0, requests_per_minute / 60.0)
+        self.rate = requests_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+def make_handler(dimensions, latency, limiter, stats, inject_429=0, retry_after=0.05):
+    stats_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/embeddings"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            with stats_lock:
+                stats["requests"] += 1
+                injected = stats["requests"] <= inject_429
+
+            wait = retry_after if injected else (limiter.acquire() if limiter else 0.0)
+            if wait > 0:
+                with stats_lock:
+                    stats["rate_limited"] += 1
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                headers={"retry-after": f"{wait:.3f}"})
+                return
+
+            inputs = request["input"]
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            time.sleep(latency)
+            with stats_lock:
+                stats["inputs"] += len(inputs)
+            self._send_json(200, {
+                "object": "list",
+                "model": request.get("model", "fake-embedding"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": hash_vector(value, dimensions)}
+                    for i, value in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+
+    return Handler
+
+
+def start_server(host="127.0.0.1", port=0, dimensions=1536, latency=0.0, requests_per_minute=None,
+                 inject_429=0, retry_after=0.05):
+    """在后台线程中启动假服务，返回 (server, stats)；port=0 时自动分配端口
+
+    inject_429 为开头直接返回 429（Retry-After 为 retry_after 秒）的请求数，用于测试限流退避。
+    """
+    stats = {"requests": 0, "inputs": 0, "rate_limited": 0}
+    limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+    handler = make_handler(dimensions, latency, limiter, stats, inject_429, retry_after)
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地假 OpenAI 嵌入服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--latency", type=float, default=0.1, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--rpm", type=int, default=None, help="每分钟请求数上限，超出返回 429")
+    parser.add_argument("--inject-429", type=int, default=0, help="开头直接返回 429 的请求数")
+    args = parser.parse_args(argv)
+
+    server, stats = start_server(args.host, args.port, args.dimensions, args.latency, args.rpm, args.inject_429)
+    print(f"假嵌入服务已启动：http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"requests={stats['requests']} inputs={stats['inputs']} rate_limited={stats['rate_limited']}")
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+"""确定性的本地替身模型：哈希嵌入、字面重合度重排器，以及可配置延迟、吐字速度的流式聊天模型"""
+import time
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from sklearn.feature_extraction.text import HashingVectorizer
+
+DEFAULT_ANSWER = (
+    "根据学生手册的相关规定，上课迟到或早退扣1分/次，旷课扣5分/次。"
+    "操行成绩85分及以上者方可竞聘学生干部，担任班级学生干部可以加分。"
+    "具体情况请以学校最新发布的文件为准。"
+)
+
+
+class HashingEmbeddings(Embeddings):
+    """字符 n-gram 哈希嵌入：同样的文本总得到同样的向量，字面相近的文本向量也相近"""
+
+    def __init__(self, dimensions=1536):
+        self.dimensions = dimensions
+        self.vectorizer = HashingVectorizer(
+            analyzer="char", ngram_range=(1, 2), n_features=dimensions,
+            alternate_sign=False, norm="l2", lowercase=True,
+        )
+
+    def _embed(self, texts):
+        matrix = self.vectorizer.transform(texts).toarray().astype(np.float32)
+        return matrix.tolist()
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts)) if texts else []
+
+    def embed_query(self, text):
+        return self._embed([text])[0]
+
+
+class OverlapReranker:
+    """按问题的字符二元组在片段中出现的比例打分（0~1），接口与 rag.reranker.CrossEncoderReranker 相同"""
+
+    def __init__(self, latency_per_pair=0.0):
+        self.latency_per_pair = latency_per_pair
+
+    @staticmethod
+    def _bigrams(text):
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def rerank(self, query, docs):
+        if self.latency_per_pair:
+            time.sleep(self.latency_per_pair * len(docs))
+        query_bigrams = self._bigrams(query)
+        scored = [
+            (doc, len(query_bigrams & self._bigrams(doc.page_content)) / (len(query_bigrams) or 1))
+            for doc in docs
+        ]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """按固定回答逐字输出的聊天模型
+
+    first_token_latency 为首个 token 前的等待秒数，tokens_per_second 为之后的输出速度（0 表示不限速）。
+    """
+
+    answer: str = DEFAULT_ANSWER
+    first_token_latency: float = 0.0
+    tokens_per_second: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def _tokens(self):
+        if self.first_token_latency:
+            time.sleep(self.first_token_latency)
+        for i, token in enumerate(self.answer):
+            if i and self.tokens_per_second:
+                time.sleep(1.0 / self.tokens_per_second)
+            yield token
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        content = "".join(self._tokens())
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        for token in self._tokens():
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
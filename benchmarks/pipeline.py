@@ -0,0 +1,237 @@
+"""分阶段性能基准：在测试.md 及其 10×、100× 合成语料上测量问答流程各阶段的耗时
+
+全部使用本地替身模型（benchmarks.fakes），不访问网络，结果写成 JSON 便于跨提交比较。
+
+用法：
+    python -m benchmarks.pipeline --scales 1 10 100 --latency 0.3 --tokens-per-second 40
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+
+from langchain_community.vectorstores import FAISS
+
+from benchmarks.fakes import FakeStreamingChatModel, HashingEmbeddings, OverlapReranker
+from rag.embedding_cache import embedding_model_name
+from rag.embedding_providers import DEFAULT_LOCAL_MODEL, LocalEmbeddings
+from rag.engine import EngineConfig, QAEngine
+from rag.extraction import iter_document_segments
+from rag.knowledge_base import KnowledgeBase, content_hash, make_text_splitter, split_document
+from rag.reranker import DEFAULT_RERANK_MODEL, CrossEncoderReranker
+from rag.retrieval_eval import DEFAULT_CASES
+from rag.sparse_index import SparseIndex
+
+DEFAULT_DOCUMENT = "测试.md"
+DEFAULT_OUTPUT_DIR = os.path.join(".cache", "benchmarks")
+
+
+def synthetic_corpus(text, scale):
+    """把原文复制 scale 份，每份加上不同的标题，使各份内容哈希不同"""
+    if scale == 1:
+        return text
+    return "\n\n".join(f"## 副本 {i + 1}\n\n{text}" for i in range(scale))
+
+
+def timed(func, *args, **kwargs):
+    """返回 (结果, 毫秒)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def latency_summary(values):
+    """多次测量的毫秒数汇总"""
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered),
+        "p50_ms": ordered[len(ordered) // 2],
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max_ms": ordered[-1],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def bench_corpus(name, text, embeddings, reranker, args, workdir):
+    """对一份语料逐阶段计时，返回 {阶段: 耗时}"""
+    data = text.encode("utf-8")
+    questions = [case["question"] for case in DEFAULT_CASES]
+    stages = {}
+
+    # 提取：与上传文件相同的流式提取路径
+    segments, stages["extraction_ms"] = timed(lambda: list(iter_document_segments(f"{name}.md", io.BytesIO(data))))
+    extracted = "".join(segments)
+
+    # 切分
+    source = f"base:{name}"
+    (docs, ids), stages["splitting_ms"] = timed(
+        split_document, make_text_splitter(args.chunk_size, args.chunk_overlap), source, extracted
+    )
+    stages["num_chunks"] = len(docs)
+
+    # 建索引：向量化 + FAISS + 稀疏索引
+    def build_index():
+        store = FAISS.from_documents(docs, embeddings, ids=ids)
+        return store, SparseIndex.from_vectorstore(store)
+
+    (store, sparse), stages["indexing_ms"] = timed(build_index)
+    knowledge_base = KnowledgeBase(
+        embeddings, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, retrieval_mode=args.retrieval_mode,
+        reranker=reranker, rerank_min_score=args.rerank_min_score,
+    )
+    knowledge_base.set_base(store, {source: content_hash(extracted)}, sparse)
+
+    # 检索与上下文组装
+    path = os.path.join(workdir, f"{name}.md")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(text)
+    llm = FakeStreamingChatModel(first_token_latency=args.latency, tokens_per_second=args.tokens_per_second)
+    config = EngineConfig(
+        document_file_path=path,
+        base_index_dir=os.path.join(workdir, f"{name}-index"),
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        retrieval_mode=args.retrieval_mode,
+        rerank_min_score=args.rerank_min_score,
+    )
+    # 路由到的较小模型也用同一个替身，首字和完成耗时只反映流程本身
+    engine = QAEngine(
+        config, embeddings=embeddings, llm=llm, summary_llm=FakeStreamingChatModel(), reranker=reranker, small_llm=llm,
+    )
+
+    retrieval, formatting, context_tokens = [], [], []
+    for _ in range(args.repeat):
+        for question in questions:
+            context_docs, elapsed = timed(knowledge_base.invoke, question)
+            retrieval.append(elapsed)
+            (_, _, stats), elapsed = timed(engine.budget.allocate, context_docs, [], question)
+            formatting.append(elapsed)
+            context_tokens.append(stats["context_tokens"])
+    stages["retrieval"] = latency_summary(retrieval)
+    stages["context_formatting"] = latency_summary(formatting)
+    # 每个问题放入提示词的上下文 token 数
+    stages["context_tokens_mean"] = statistics.fmean(context_tokens)
+
+    # 查询路由（规则 + 本地分类模型）的耗时，不含首次训练
+    engine.router.warm_up()
+    stages["routing"] = latency_summary([timed(engine.router.route, question)[1] for question in questions])
+
+    # 引擎：加载（必要时构建）磁盘上的内置索引，然后走完整的上传和问答路径
+    _, stages["base_index_load_ms"] = timed(engine.base_corpus)
+    session_id = uuid.uuid4().hex
+    _, stages["ingest_ms"] = timed(engine.ingest, session_id, f"upload-{name}.md", io.BytesIO(data), len(data))
+
+    first_token, completion = [], []
+    for question in questions:
+        start = time.perf_counter()
+        first = None
+        for _ in engine.stream_answer(session_id, question, use_cache=False):
+            if first is None:
+                first = (time.perf_counter() - start) * 1000
+        completion.append((time.perf_counter() - start) * 1000)
+        first_token.append(first)
+        # 每个问题单独计时，不让对话历史随问题数增长
+        engine.clear_history(session_id)
+    stages["first_token"] = latency_summary(first_token)
+    stages["completion"] = latency_summary(completion)
+    return stages
+
+
+def run(args):
+    with open(args.document, "r", encoding="utf-8") as file:
+        original = file.read()
+    if args.embeddings == "local":
+        embeddings = LocalEmbeddings(args.local_model or DEFAULT_LOCAL_MODEL, num_threads=args.threads, quantize=args.quantize)
+    else:
+        embeddings = HashingEmbeddings(args.dimensions)
+    if args.rerank == "local":
+        reranker = CrossEncoderReranker(args.rerank_model or DEFAULT_RERANK_MODEL, num_threads=args.threads)
+    elif args.rerank == "overlap":
+        reranker = OverlapReranker()
+    else:
+        reranker = None
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in args.scales:
+            name = f"{scale}x"
+            text = synthetic_corpus(original, scale)
+            stages = bench_corpus(name, text, embeddings, reranker, args, workdir)
+            results.append({"corpus": name, "scale": scale, "characters": len(text), "stages": stages})
+            print(
+                f"{name:>5}: {len(text):>9} 字符 {stages['num_chunks']:>6} 片段  "
+                f"切分 {stages['splitting_ms']:.0f}ms  建索引 {stages['indexing_ms']:.0f}ms  "
+                f"检索 p50 {stages['retrieval']['p50_ms']:.1f}ms  上下文 {stages['context_tokens_mean']:.0f} tokens  "
+                f"首字 p50 {stages['first_token']['p50_ms']:.0f}ms  完成 p50 {stages['completion']['p50_ms']:.0f}ms"
+            )
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {
+            "document": args.document,
+            "embeddings": embedding_model_name(embeddings),
+            "dimensions": args.dimensions,
+            "chunk_size": args.chunk_size,
+            "chunk_overlap": args.chunk_overlap,
+            "retrieval_mode": args.retrieval_mode,
+            "rerank": args.rerank,
+            "rerank_min_score": args.rerank_min_score,
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="问答流程分阶段性能基准（离线）")
+    parser.add_argument("--document", default=DEFAULT_DOCUMENT)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="合成语料相对原文的倍数")
+    parser.add_argument("--embeddings", choices=("hash", "local"), default="hash",
+                        help="hash 为哈希假嵌入；local 为本地 CPU 句向量模型（需要 torch 和 transformers）")
+    parser.add_argument("--dimensions", type=int, default=1536, help="假嵌入的向量维度")
+    parser.add_argument("--local-model", default="", help="本地嵌入模型名")
+    parser.add_argument("--threads", type=int, default=0, help="本地模型的 torch 线程数")
+    parser.add_argument("--quantize", action="store_true", help="本地模型做 int8 动态量化")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--retrieval-mode", default="hybrid")
+    parser.add_argument("--rerank", choices=("none", "overlap", "local"), default="none",
+                        help="overlap 为字面重合度替身；local 为本地交叉编码器（需要 torch 和 transformers）")
+    parser.add_argument("--rerank-model", default="", help="本地重排模型名")
+    parser.add_argument("--rerank-min-score", type=float, default=0.2, help="重排得分阈值")
+    parser.add_argument("--latency", type=float, default=0.0, help="假聊天模型首个 token 前的延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="假聊天模型的输出速度，0 表示不限速")
+    parser.add_argument("--repeat", type=int, default=3, help="检索阶段重复查询的轮数")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径，默认写到 .cache/benchmarks/<提交>.json")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"{report['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,26 @@
+"""智能问答系统的检索核心，不依赖 Streamlit
+
+下列名称在首次访问时才导入对应的子模块：导入 rag 包本身（例如 PDF 提取的工作进程只需要
+rag.pdf_worker）不会加载 numpy、FAISS 和 LangChain。
+"""
+import importlib
+
+_EXPORTS = {
+    "CachedEmbeddings": "rag.embedding_cache",
+    "CrossEncoderReranker": "rag.reranker",
+    "EmbeddingScheduler": "rag.embedding_scheduler",
+    "KnowledgeBase": "rag.knowledge_base",
+    "LocalEmbeddings": "rag.embedding_providers",
+    "create_embeddings": "rag.embedding_providers",
+    "fingerprint_sources": "rag.knowledge_base",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
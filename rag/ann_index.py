@@ -0,0 +1,182 @@
+"""按语料规模选择 FAISS 索引类型：小语料精确检索（Flat），中等规模 HNSW，大规模 IVF + 量化
+
+近似索引建好后用语料中的向量做一次 recall@k 和延迟检查（与精确索引比较）：
+召回不足时先加大 nprobe / efSearch，仍不足则退回更精确的索引类型，最终兜底为 Flat。
+"""
+import time
+from dataclasses import asdict, dataclass
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("auto", "flat", "hnsw", "ivfsq", "ivfpq")
+# 召回不足时依次退回的更精确的索引类型
+FALLBACKS = {"ivfpq": "ivfsq", "ivfsq": "flat", "hnsw": "flat"}
+
+
+@dataclass
+class AnnOptions:
+    """索引选择与检索参数；ef_search / nprobe 为 0 时自动调参"""
+
+    index_type: str = "auto"
+    # 片段数不超过 flat_max 用 Flat，不超过 hnsw_max 用 HNSW，不超过 ivfsq_max 用 IVF-SQ8，更多用 IVF-PQ
+    flat_max: int = 20_000
+    hnsw_max: int = 200_000
+    ivfsq_max: int = 2_000_000
+    hnsw_m: int = 32
+    ef_construction: int = 80
+    ef_search: int = 0
+    nlist: int = 0
+    nprobe: int = 0
+    # 召回检查：抽样查询数、k 和最低召回率
+    recall_k: int = 10
+    sample_queries: int = 200
+    min_recall: float = 0.95
+
+    def __post_init__(self):
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"未知的索引类型: {self.index_type}（可选：{', '.join(INDEX_TYPES)}）")
+
+    def build_key(self):
+        """影响索引构建的选项；ef_search / nprobe 只影响检索，可以在加载时覆盖"""
+        key = asdict(self)
+        key.pop("ef_search")
+        key.pop("nprobe")
+        return key
+
+
+def choose_index_type(num_vectors, options):
+    if options.index_type != "auto":
+        return options.index_type
+    if num_vectors <= options.flat_max:
+        return "flat"
+    if num_vectors <= options.hnsw_max:
+        return "hnsw"
+    if num_vectors <= options.ivfsq_max:
+        return "ivfsq"
+    return "ivfpq"
+
+
+def default_nlist(num_vectors):
+    """倒排列表数：约 4·√n，并保证每个聚类中心至少有 39 个训练样本"""
+    return max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+
+
+def pq_subquantizers(dimensions):
+    """PQ 子空间数：不超过 d/8 且能整除 d 的最大值（每个向量压缩为这么多字节）"""
+    for m in range(max(1, dimensions // 8), 0, -1):
+        if dimensions % m == 0:
+            return m
+    return 1
+
+
+def build_index(vectors, index_type, options):
+    """构建并（必要时）训练索引，向量按原顺序加入"""
+    num_vectors, dimensions = vectors.shape
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimensions)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimensions, options.hnsw_m)
+        index.hnsw.efConstruction = options.ef_construction
+    else:
+        nlist = options.nlist or default_nlist(num_vectors)
+        quantizer = faiss.IndexFlatL2(dimensions)
+        if index_type == "ivfsq":
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimensions, nlist, faiss.ScalarQuantizer.QT_8bit)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dimensions, nlist, pq_subquantizers(dimensions), 8)
+        # 训练样本最多取每个聚类中心 256 个
+        sample = vectors
+        if num_vectors > nlist * 256:
+            rows = np.random.default_rng(0).choice(num_vectors, nlist * 256, replace=False)
+            sample = vectors[rows]
+        index.train(sample)
+    index.add(vectors)
+    return index
+
+
+def search_params(index):
+    """读取索引当前的检索参数"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return {"ef_search": index.hnsw.efSearch}
+    if isinstance(index, faiss.IndexIVF):
+        return {"nprobe": index.nprobe}
+    return {}
+
+
+def set_search_params(index, ef_search=0, nprobe=0):
+    """设置 HNSW 的 efSearch 或 IVF 的 nprobe；0 表示保持不变"""
+    index = faiss.downcast_index(index)
+    if ef_search and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+    if nprobe and isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(nprobe, index.nlist)
+
+
+def evaluate_index(index, vectors, k=10, sample_queries=200, exact=None):
+    """用语料中抽样的向量做查询，比较近似索引与精确索引的 recall@k 和单次查询延迟"""
+    num_vectors = vectors.shape[0]
+    k = min(k, num_vectors)
+    rows = np.random.default_rng(1).choice(num_vectors, min(sample_queries, num_vectors), replace=False)
+    queries = vectors[rows]
+    if exact is None:
+        exact = faiss.IndexFlatL2(vectors.shape[1])
+        exact.add(vectors)
+
+    start = time.perf_counter()
+    _, expected = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(found.tolist(), expected.tolist())])
+    return {"recall_at_k": float(recall), "k": k, "latency_ms": approx_ms, "exact_latency_ms": exact_ms}
+
+
+def _tune(index, index_type, vectors, options, exact):
+    """逐步加大 efSearch / nprobe 直到召回达标，返回最后一次检查的结果"""
+    if index_type == "hnsw":
+        candidates = [options.ef_search] if options.ef_search else [16, 32, 64, 128, 256, 512]
+        param = "ef_search"
+    else:
+        nlist = faiss.extract_index_ivf(index).nlist
+        candidates = [options.nprobe] if options.nprobe else [n for n in (1, 2, 4, 8, 16, 32, 64, 128, 256) if n <= nlist]
+        param = "nprobe"
+    check = None
+    for value in candidates:
+        set_search_params(index, **{param: value})
+        check = evaluate_index(index, vectors, options.recall_k, options.sample_queries, exact)
+        if check["recall_at_k"] >= options.min_recall:
+            break
+    return check
+
+
+def build_adaptive_index(vectors, options=None):
+    """按规模选择索引类型并构建；返回 (索引, 报告)
+
+    报告记录请求与实际使用的索引类型、检索参数和召回检查结果，会写入索引清单。
+    """
+    options = options or AnnOptions()
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    chosen = choose_index_type(vectors.shape[0], options)
+    report = {"requested": options.index_type, "build_key": options.build_key(), "attempts": []}
+
+    index_type = chosen
+    exact = None
+    while index_type != "flat":
+        index = build_index(vectors, index_type, options)
+        if exact is None:
+            exact = faiss.IndexFlatL2(vectors.shape[1])
+            exact.add(vectors)
+        check = _tune(index, index_type, vectors, options, exact)
+        report["attempts"].append({"index_type": index_type, **search_params(index), **check})
+        if check["recall_at_k"] >= options.min_recall:
+            report.update(index_type=index_type, params=search_params(index), check=check)
+            return index, report
+        index_type = FALLBACKS[index_type]
+
+    index = exact if exact is not None else build_index(vectors, "flat", options)
+    report.update(index_type="flat", params={}, check=None)
+    return index, report
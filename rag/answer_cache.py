@@ -0,0 +1,135 @@
+"""语义回答缓存：按问题向量的相似度查找历史回答，按知识库版本和对话历史隔离"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from rag.singleflight import normalize_question
+
+
+def history_key(chat_history):
+    """对话历史的指纹；空历史统一为空字符串，这样不同会话的首个问题可以共享缓存"""
+    if not chat_history:
+        return ""
+    digest = hashlib.sha256()
+    for message in chat_history:
+        digest.update(f"{message.type}\0{message.content}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SemanticAnswerCache:
+    """进程内的语义回答缓存
+
+    缓存条目的作用域为 (知识库版本, 对话历史指纹)。先按规范化后的问题原文精确匹配（不需要向量化），
+    未命中时再按问题向量的余弦相似度查找，不低于 threshold 才算命中。semantic=False 时只做精确匹配，
+    写入的条目也不带向量，整个过程不调用嵌入接口。条目超过 ttl 秒过期，总数超过 max_entries 时按 LRU 淘汰。
+    """
+
+    def __init__(self, embeddings, threshold=0.95, ttl=6 * 3600, max_entries=2000):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _expire(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def _exact_match(self, normalized, scope):
+        """作用域内规范化问题相同的条目ID"""
+        for key, entry in self._entries.items():
+            if entry["scope"] == scope and entry["normalized"] == normalized:
+                return key
+        return None
+
+    def _best_match(self, vector, scope):
+        """返回作用域内相似度最高的条目 (条目ID, 相似度)；只写入了原文的条目不参与"""
+        candidates = [
+            (key, entry) for key, entry in self._entries.items()
+            if entry["scope"] == scope and entry["vector"] is not None
+        ]
+        if not candidates:
+            return None, 0.0
+        similarities = np.stack([entry["vector"] for _, entry in candidates]) @ vector
+        best = int(np.argmax(similarities))
+        return candidates[best][0], float(similarities[best])
+
+    def _hit(self, key):
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key]["answer"]
+
+    def lookup(self, question, kb_version, chat_history, semantic=True):
+        """查找缓存的回答，未命中返回 None；semantic=False 时只做精确匹配"""
+        scope = (kb_version, history_key(chat_history))
+        normalized = normalize_question(question)
+        with self._lock:
+            self._expire(time.time())
+            key = self._exact_match(normalized, scope)
+            if key is not None:
+                return self._hit(key)
+            if not semantic:
+                self.misses += 1
+                return None
+        vector = self._embed(question)
+        with self._lock:
+            key, similarity = self._best_match(vector, scope)
+            if key is None or similarity < self.threshold:
+                self.misses += 1
+                return None
+            return self._hit(key)
+
+    def store(self, question, answer, kb_version, chat_history, semantic=True):
+        """写入回答；作用域内已有相同或足够相似的问题时覆盖该条目（例如重新生成的回答）"""
+        scope = (kb_version, history_key(chat_history))
+        normalized = normalize_question(question)
+        vector = self._embed(question) if semantic else None
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            key = self._exact_match(normalized, scope)
+            if key is None and vector is not None:
+                key, similarity = self._best_match(vector, scope)
+                if similarity < self.threshold:
+                    key = None
+            if key is None:
+                key = self._next_id
+                self._next_id += 1
+            self._entries[key] = {
+                "question": question,
+                "normalized": normalized,
+                "answer": answer,
+                "vector": vector,
+                "scope": scope,
+                "created": now,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+def iter_cached_answer(answer, chunk_size=16):
+    """把缓存的回答按小段产出，供 st.write_stream 立即输出"""
+    for start in range(0, len(answer), chunk_size):
+        yield answer[start:start + chunk_size]
@@ -0,0 +1,237 @@
+"""内置语料（测试.md）的离线索引：构建一次并保存到磁盘，启动时以内存映射方式加载
+
+命令行用法：
+    python -m rag.base_index --document 测试.md --index-dir .cache/base_index
+    python -m rag.base_index --provider local --quantize     # 使用本地 CPU 嵌入模型
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from rag.ann_index import INDEX_TYPES, AnnOptions, build_adaptive_index, set_search_params
+from rag.embedding_cache import embedding_model_name
+from rag.knowledge_base import make_text_splitter, split_document
+
+DEFAULT_INDEX_DIR = os.path.join(".cache", "base_index")
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.json"
+MANIFEST_FILE = "manifest.json"
+# 索引格式版本：片段元数据的结构变化时递增，旧索引自动重建（2：片段带有文件、页码和章节；3：识别纯文本规章的章节标题）
+FORMAT_VERSION = 3
+
+
+def file_sha256(path):
+    """计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(index_dir):
+    """读取索引清单，不存在或损坏时返回 None"""
+    try:
+        with open(os.path.join(index_dir, MANIFEST_FILE), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomically(path, write):
+    """write(临时路径) 写入同目录下的唯一临时文件，再原子地替换 path
+
+    临时文件名各不相同，多个进程（多个 Streamlit 进程、服务和命令行）同时重建索引时不会互相覆盖。
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp",
+    )
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_json(path, data):
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False)
+
+    _write_atomically(path, write)
+
+
+def check_base_index(document_path, embeddings, index_dir=DEFAULT_INDEX_DIR,
+                     chunk_size=1000, chunk_overlap=100, ann_options=None):
+    """判断磁盘上的索引是否仍然有效
+
+    mtime 和大小未变时直接认为有效；mtime 变了但内容哈希相同，则只刷新清单中的 mtime。
+    """
+    manifest = read_manifest(index_dir)
+    if manifest is None or not os.path.exists(os.path.join(index_dir, INDEX_FILE)):
+        return False
+    if (manifest.get("format_version") != FORMAT_VERSION
+            or manifest.get("embedding_model") != embedding_model_name(embeddings)
+            or manifest.get("chunk_size") != chunk_size
+            or manifest.get("chunk_overlap") != chunk_overlap
+            or manifest.get("ann", {}).get("build_key") != (ann_options or AnnOptions()).build_key()):
+        return False
+
+    stat = os.stat(document_path)
+    if manifest.get("mtime") == stat.st_mtime and manifest.get("size") == stat.st_size:
+        return True
+    if manifest.get("sha256") != file_sha256(document_path):
+        return False
+
+    manifest.update(mtime=stat.st_mtime, size=stat.st_size)
+    _write_json(os.path.join(index_dir, MANIFEST_FILE), manifest)
+    return True
+
+
+def build_base_index(document_path, embeddings, index_dir=DEFAULT_INDEX_DIR,
+                     chunk_size=1000, chunk_overlap=100, source=None, ann_options=None):
+    """切分并向量化内置文档，把 FAISS 索引、文档库和清单写入 index_dir
+
+    索引类型按片段数自动选择（见 rag.ann_index），选择结果和召回检查记录在清单的 ann 字段中。
+    """
+    source = source or f"base:{document_path}"
+    with open(document_path, "r", encoding="utf-8") as file:
+        text = file.read()
+    stat = os.stat(document_path)
+
+    docs, ids = split_document(make_text_splitter(chunk_size, chunk_overlap), source, text)
+    vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in docs]), dtype=np.float32)
+    index, ann_report = build_adaptive_index(vectors, ann_options)
+
+    os.makedirs(index_dir, exist_ok=True)
+    _write_atomically(os.path.join(index_dir, INDEX_FILE), lambda tmp_path: faiss.write_index(index, tmp_path))
+    _write_json(os.path.join(index_dir, DOCSTORE_FILE), [
+        {"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata}
+        for doc_id, doc in zip(ids, docs)
+    ])
+    # 清单最后写入，保证清单存在时索引文件一定是完整的
+    _write_json(os.path.join(index_dir, MANIFEST_FILE), {
+        "format_version": FORMAT_VERSION,
+        "document": document_path,
+        "source": source,
+        "sha256": file_sha256(document_path),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "embedding_model": embedding_model_name(embeddings),
+        "dimensions": int(vectors.shape[1]),
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "num_chunks": len(docs),
+        "ann": ann_report,
+        "built_at": time.time(),
+    })
+    return read_manifest(index_dir)
+
+
+def load_base_index(embeddings, index_dir=DEFAULT_INDEX_DIR, ann_options=None):
+    """以只读内存映射方式加载索引，多个进程共享同一份页缓存
+
+    索引必须由同一个嵌入模型构建，否则抛出 ValueError，避免查询向量和索引向量来自不同的模型。
+    """
+    manifest = read_manifest(index_dir)
+    model = embedding_model_name(embeddings)
+    if manifest is None or manifest.get("embedding_model") != model:
+        built_by = manifest.get("embedding_model") if manifest else None
+        raise ValueError(f"索引 {index_dir} 由 {built_by} 构建，与当前嵌入模型 {model} 不一致")
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    index = faiss.read_index(os.path.join(index_dir, INDEX_FILE), flags)
+    # 构建时调好的 efSearch / nprobe 随索引保存；配置中显式指定时覆盖
+    if ann_options is not None:
+        set_search_params(index, ann_options.ef_search, ann_options.nprobe)
+    with open(os.path.join(index_dir, DOCSTORE_FILE), "r", encoding="utf-8") as file:
+        records = json.load(file)
+
+    docstore = InMemoryDocstore({
+        record["id"]: Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"])
+        for record in records
+    })
+    index_to_docstore_id = {i: record["id"] for i, record in enumerate(records)}
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def load_or_build_base_index(document_path, embeddings, index_dir=DEFAULT_INDEX_DIR,
+                             chunk_size=1000, chunk_overlap=100, ann_options=None):
+    """加载内置文档的索引；文件哈希或 mtime 变化时先重建。返回 (向量库, 清单)"""
+    if not check_base_index(document_path, embeddings, index_dir, chunk_size, chunk_overlap, ann_options):
+        build_base_index(document_path, embeddings, index_dir, chunk_size, chunk_overlap, ann_options=ann_options)
+    return load_base_index(embeddings, index_dir, ann_options), read_manifest(index_dir)
+
+
+def main(argv=None):
+    from contextlib import nullcontext
+
+    from rag.embedding_cache import DEFAULT_CACHE_PATH, CachedEmbeddings
+    from rag.embedding_providers import EMBEDDING_PROVIDERS, create_embeddings
+    from rag.embedding_scheduler import EmbeddingScheduler
+
+    parser = argparse.ArgumentParser(description="离线构建内置文档的 FAISS 索引")
+    parser.add_argument("--document", default="测试.md", help="内置文档路径")
+    parser.add_argument("--index-dir", default=os.getenv("BASE_INDEX_DIR", DEFAULT_INDEX_DIR), help="索引输出目录")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--cache-path", default=os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH), help="嵌入缓存路径")
+    parser.add_argument("--provider", default=os.getenv("EMBEDDING_PROVIDER", "openai"),
+                        choices=EMBEDDING_PROVIDERS, help="嵌入模型提供方")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", ""), help="嵌入模型名，默认使用提供方的默认模型")
+    parser.add_argument("--workers", type=int, default=4, help="并发嵌入请求数上限（openai）")
+    parser.add_argument("--threads", type=int, default=0, help="本地模型的 torch 线程数，0 为默认（local）")
+    parser.add_argument("--quantize", action="store_true", help="本地模型做 int8 动态量化（local）")
+    parser.add_argument("--index-type", default=os.getenv("ANN_INDEX_TYPE", "auto"), choices=INDEX_TYPES,
+                        help="FAISS 索引类型，auto 按片段数选择")
+    parser.add_argument("--ef-search", type=int, default=0, help="HNSW 的 efSearch，0 为按召回自动调参")
+    parser.add_argument("--nprobe", type=int, default=0, help="IVF 的 nprobe，0 为按召回自动调参")
+    parser.add_argument("--min-recall", type=float, default=0.95, help="近似索引相对精确检索的最低 recall@10")
+    parser.add_argument("--force", action="store_true", help="忽略变更检测，强制重建")
+    args = parser.parse_args(argv)
+    ann_options = AnnOptions(index_type=args.index_type, ef_search=args.ef_search,
+                             nprobe=args.nprobe, min_recall=args.min_recall)
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if args.provider == "openai" and not api_key:
+        parser.error("请先设置环境变量 OPENAI_API_KEY")
+    provider = create_embeddings(args.provider, args.model, api_key=api_key, max_workers=args.workers,
+                                 num_threads=args.threads, quantize=args.quantize)
+    embeddings = CachedEmbeddings(provider, path=args.cache_path)
+
+    if not args.force and check_base_index(args.document, embeddings, args.index_dir,
+                                           args.chunk_size, args.chunk_overlap, ann_options):
+        print(f"索引已是最新：{args.index_dir}")
+        return 0
+
+    start = time.perf_counter()
+    progress = (
+        provider.report_progress(lambda done, total: print(f"\r向量化 {done}/{total}", end="", flush=True))
+        if isinstance(provider, EmbeddingScheduler) else nullcontext()
+    )
+    with progress:
+        manifest = build_base_index(args.document, embeddings, args.index_dir,
+                                    args.chunk_size, args.chunk_overlap, ann_options=ann_options)
+    print()
+    print(f"已构建 {manifest['num_chunks']} 个片段 -> {args.index_dir}（{time.perf_counter() - start:.2f}s）")
+    ann = manifest["ann"]
+    print(f"索引类型：{ann['index_type']} {ann['params']}")
+    for attempt in ann["attempts"]:
+        print(f"  {attempt['index_type']}: recall@{attempt['k']} {attempt['recall_at_k']:.3f}，"
+              f"{attempt['latency_ms']:.3f}ms/查询（精确检索 {attempt['exact_latency_ms']:.3f}ms）")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,134 @@
+"""问答引擎的 HTTP 客户端，接口与 QAEngine 一致，Streamlit 页面可以透明切换本地/远程引擎"""
+import itertools
+import json
+from urllib.parse import quote
+
+import requests
+
+
+class RemoteAnswerStream:
+    """远程回答的流式输出
+
+    read_start() 之后 cached / route 可用（与本地的 AnswerStream 一致）；迭代结束后 answer / citations 可用。
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self._events = self._iter_events()
+        self._pending = []
+        self.answer = None
+        self.cached = False
+        self.route = None
+        self.citations = []
+
+    def _iter_events(self):
+        with self._response:
+            for line in self._response.iter_lines(decode_unicode=True):
+                if line and line.startswith("data: "):
+                    yield json.loads(line[len("data: "):])
+
+    def read_start(self):
+        """读到回答开始的事件为止，之前读到的事件暂存，迭代时再输出"""
+        for event in self._events:
+            self._pending.append(event)
+            if event["type"] == "start":
+                self.cached = event.get("cached", False)
+                self.route = event.get("route")
+            if event["type"] != "token":
+                break
+        return self
+
+    def __iter__(self):
+        parts = []
+        pending, self._pending = self._pending, []
+        for event in itertools.chain(pending, self._events):
+            if event["type"] == "token":
+                parts.append(event["text"])
+                yield event["text"]
+            elif event["type"] == "error":
+                raise RuntimeError(event["message"])
+            elif event["type"] == "done":
+                self.cached = event.get("cached", False)
+                self.route = event.get("route")
+                self.citations = event.get("citations", [])
+        self.answer = "".join(parts)
+
+
+class RemoteEngine:
+    """通过 HTTP 调用独立部署的问答引擎（rag.server）"""
+
+    def __init__(self, base_url, timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.http = requests.Session()
+
+    def _url(self, session_id, path=""):
+        return f"{self.base_url}/sessions/{quote(session_id, safe='')}{path}"
+
+    def _request(self, method, url, **kwargs):
+        response = self.http.request(method, url, timeout=self.timeout, **kwargs)
+        if response.status_code == 400:
+            raise ValueError(response.json().get("detail", response.text))
+        response.raise_for_status()
+        return response.json()
+
+    def stream_answer(self, session_id, question, use_cache=True, reuse_context=False, sources=None):
+        response = self.http.post(
+            self._url(session_id, "/ask"),
+            json={"question": question, "use_cache": use_cache, "reuse_context": reuse_context, "sources": sources},
+            stream=True,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        # 等到回答开始的事件，返回时 cached / route 已经可用（需要等检索和首个 token）
+        return RemoteAnswerStream(response).read_start()
+
+    def truncate_history(self, session_id, length):
+        self._request("POST", self._url(session_id, "/history/truncate"), json={"length": length})
+
+    def clear_history(self, session_id):
+        self._request("DELETE", self._url(session_id, "/history"))
+
+    def history(self, session_id):
+        return self._request("GET", self._url(session_id, "/history"))
+
+    def ingest(self, session_id, filename, stream, size=None, on_progress=None):
+        # 远程上传不支持逐批进度回调
+        return self._request("POST", self._url(session_id, "/files"), files={"file": (filename, stream)})
+
+    def submit_ingest(self, session_id, filename, data, size=None):
+        return self._request("POST", self._url(session_id, "/jobs"), files={"file": (filename, data)})
+
+    def ingest_jobs(self, session_id):
+        return self._request("GET", self._url(session_id, "/jobs"))
+
+    def cancel_ingest(self, session_id, job_id):
+        response = self.http.delete(self._url(session_id, f"/jobs/{quote(job_id, safe='')}"), timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def clear_ingest_jobs(self, session_id):
+        self._request("DELETE", self._url(session_id, "/jobs"))
+
+    def remove_file(self, session_id, filename):
+        self._request("DELETE", self._url(session_id, f"/files/{quote(filename, safe='')}"))
+
+    def clear_files(self, session_id):
+        self._request("DELETE", self._url(session_id, "/files"))
+
+    def files(self, session_id):
+        return self._request("GET", self._url(session_id, "/files"))
+
+    def sources(self, session_id):
+        return self._request("GET", self._url(session_id, "/sources"))
+
+    def stats(self, session_id=None):
+        url = self._url(session_id, "/stats") if session_id is not None else f"{self.base_url}/stats"
+        return self._request("GET", url)
+
+    def metrics_text(self):
+        response = self.http.get(f"{self.base_url}/metrics", timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
@@ -0,0 +1,117 @@
+"""按 token 预算组装提示词：合并相邻/重叠的片段、去掉重复内容，并在上下文和对话历史之间分配预算"""
+import re
+
+from rag.tokens import count_tokens, truncate_to_tokens
+
+CHUNK_ID_PATTERN = re.compile(r"^(?P<source>.*)#(?P<index>\d+)$")
+# 重叠部分至少这么长才认为两个片段首尾相接
+MIN_OVERLAP_CHARS = 20
+# 剩余预算不足该值时不再截断放入下一段
+MIN_PASSAGE_TOKENS = 50
+
+
+def chunk_position(doc):
+    """从片段ID（来源#序号）中解析出 (来源, 序号)，无法解析时返回 None"""
+    match = CHUNK_ID_PATTERN.match(doc.id or "")
+    if not match:
+        return None
+    return match.group("source"), int(match.group("index"))
+
+
+def overlap_length(left, right, max_overlap=400):
+    """left 的后缀与 right 的前缀最长的重合长度"""
+    for length in range(min(len(left), len(right), max_overlap), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def merge_passages(docs):
+    """把检索结果合并成不重复的段落，返回按最佳排名排序的 [(排名, 文本)]
+
+    同一来源中相邻的片段（切分时带有重叠）按文档顺序拼接成一段，去掉重叠部分；
+    被其它片段完全包含的片段直接丢弃。
+    """
+    items = []
+    for rank, doc in enumerate(docs):
+        text = doc.page_content.strip()
+        if text and not any(text in other for _, _, other in items):
+            items = [(r, pos, t) for r, pos, t in items if t not in text]
+            items.append((rank, chunk_position(doc), text))
+
+    # 按 (来源, 序号) 排序后合并首尾相接的相邻片段
+    positioned = sorted((item for item in items if item[1] is not None), key=lambda item: item[1])
+    passages = [(rank, text) for rank, position, text in items if position is None]
+    current = None
+    for rank, (source, index), text in positioned:
+        if current and current["source"] == source and index == current["last_index"] + 1:
+            overlap = overlap_length(current["text"], text)
+            current["text"] += text[overlap:] if overlap else "\n" + text
+            current["rank"] = min(current["rank"], rank)
+            current["last_index"] = index
+            continue
+        if current:
+            passages.append((current["rank"], current["text"]))
+        current = {"source": source, "last_index": index, "rank": rank, "text": text}
+    if current:
+        passages.append((current["rank"], current["text"]))
+
+    passages.sort(key=lambda item: item[0])
+    return passages
+
+
+def pack_context(docs, max_tokens):
+    """在 max_tokens 内按相关度装入段落，返回 (上下文文本, 实际使用的 token 数)"""
+    parts, used = [], 0
+    for _, text in merge_passages(docs):
+        tokens = count_tokens(text)
+        if used + tokens <= max_tokens:
+            parts.append(text)
+            used += tokens
+            continue
+        remaining = max_tokens - used
+        if remaining >= MIN_PASSAGE_TOKENS:
+            parts.append(truncate_to_tokens(text, remaining))
+            used = max_tokens
+        break
+    return "\n\n".join(parts), used
+
+
+def trim_history(messages, max_tokens):
+    """从最近的消息往前保留，总 token 数不超过 max_tokens；问答成对保留"""
+    kept, used = [], 0
+    i = len(messages)
+    while i > 0:
+        # 以 (用户问题, AI回答) 为单位取最后一组，落单的消息单独一组
+        start = i - 2 if i >= 2 and messages[i - 2].type == "human" and messages[i - 1].type == "ai" else i - 1
+        group = messages[start:i]
+        tokens = sum(count_tokens(message.content) for message in group)
+        if used + tokens > max_tokens:
+            break
+        kept[:0] = group
+        used += tokens
+        i = start
+    return kept, used
+
+
+class PromptBudget:
+    """提示词的 token 预算：context_share 的部分留给检索上下文，其余（加上上下文没用完的部分）留给对话历史"""
+
+    def __init__(self, total_tokens=4000, context_share=0.6, reserved_tokens=0):
+        self.total_tokens = total_tokens
+        self.context_share = context_share
+        self.reserved_tokens = reserved_tokens
+
+    def allocate(self, docs, chat_history, question):
+        """返回 (上下文文本, 裁剪后的对话历史, 统计信息)"""
+        available = max(0, self.total_tokens - self.reserved_tokens - count_tokens(question))
+        context, context_tokens = pack_context(docs, int(available * self.context_share))
+        history, history_tokens = trim_history(chat_history, available - context_tokens)
+        stats = {
+            "context_tokens": context_tokens,
+            "history_tokens": history_tokens,
+            "history_messages": len(history),
+            "dropped_messages": len(chat_history) - len(history),
+            "budget_tokens": self.total_tokens,
+        }
+        return context, history, stats
@@ -0,0 +1,143 @@
+"""基于 SQLite 的持久化嵌入缓存：以 (文本, 嵌入模型) 的哈希为键，超出容量时按 LRU 淘汰"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "embeddings.sqlite3")
+DEFAULT_MAX_ENTRIES = 200_000
+
+
+def embedding_model_name(embeddings):
+    """取出嵌入对象的模型名，作为缓存键的一部分；包装类（缓存、调度器）取内层对象的模型名"""
+    inner = getattr(embeddings, "embeddings", None)
+    if isinstance(inner, Embeddings):
+        return embedding_model_name(inner)
+    for attr in ("model", "model_name"):
+        name = getattr(embeddings, attr, None)
+        if name:
+            return f"{type(embeddings).__name__}:{name}"
+    return type(embeddings).__name__
+
+
+def cache_key(text, model):
+    """缓存键：文本与模型名共同决定"""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """包装任意 Embeddings，相同文本在同一模型下只会请求一次嵌入接口"""
+
+    def __init__(self, embeddings, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model = embedding_model_name(embeddings)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    def _lookup(self, keys):
+        """批量查询缓存，命中的条目同时刷新最近使用时间"""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+                        [now, *batch],
+                    )
+            self._conn.commit()
+        return found
+
+    def _count(self, hits, misses):
+        """累加命中/未命中计数；多个会话并发调用，计数与 SQLite 访问共用一把锁"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def _store(self, items):
+        """写入新向量，并在超过容量上限时淘汰最久未使用的条目"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items],
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def embed_documents(self, texts):
+        keys = [cache_key(text, self.model) for text in texts]
+        found = self._lookup(list(set(keys)))
+
+        # 只把未命中的文本（去重后）发送给嵌入接口
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        self._count(len(texts) - len(missing), len(missing))
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self._store(new_items)
+            found.update({key: np.asarray(vector, dtype=np.float32).tolist() for key, vector in new_items})
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        key = cache_key(f"query\0{text}", self.model)
+        found = self._lookup([key])
+        if key in found:
+            self._count(1, 0)
+            return found[key]
+        self._count(0, 1)
+        vector = self.embeddings.embed_query(text)
+        self._store([(key, vector)])
+        return np.asarray(vector, dtype=np.float32).tolist()
+
+    def stats(self):
+        """返回命中/未命中计数和当前缓存条目数"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
@@ -0,0 +1,122 @@
+"""嵌入模型提供方：OpenAI 接口，或在本进程 CPU 上运行的本地句向量模型，按配置选择
+
+不同提供方（或同一提供方的不同模型、是否量化）产生的向量互不兼容，
+索引清单和缓存键都以 embedding_model_name() 区分，不会混用。
+"""
+import threading
+
+from langchain_core.embeddings import Embeddings
+
+from rag.embedding_scheduler import EmbeddingScheduler
+
+EMBEDDING_PROVIDERS = ("openai", "local")
+DEFAULT_LOCAL_MODEL = "BAAI/bge-small-zh-v1.5"
+# bge 中文模型建议给检索查询加上的前缀（文档不加）
+BGE_ZH_QUERY_INSTRUCTION = "为这个句子生成表示以用于检索相关文章："
+
+
+class LocalEmbeddings(Embeddings):
+    """在本地 CPU 上运行 transformers 格式的句向量模型（bge、m3e 等），查询向量化不访问网络
+
+    文本按 token 长度排序后动态组批，每批补齐后的 token 总数不超过 max_batch_tokens，
+    减少 padding 的浪费；quantize=True 时把线性层动态量化为 int8；num_threads 控制 torch 的线程数。
+    """
+
+    def __init__(self, model_name=DEFAULT_LOCAL_MODEL, num_threads=0, quantize=False,
+                 max_batch_tokens=8192, max_batch_size=64, max_length=512,
+                 pooling=None, normalize=True, query_instruction=None):
+        try:
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+        except ImportError as e:
+            raise ImportError("本地嵌入模型需要安装 torch 和 transformers") from e
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        model = AutoModel.from_pretrained(model_name).eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        self._torch = torch
+        self._model = model
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model_name = model_name
+        # 量化后的向量与原模型不完全相同，作为不同的模型对待
+        self.model = f"{model_name}:int8" if quantize else model_name
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_length = max_length
+        self.normalize = normalize
+        is_bge = "bge" in model_name.lower()
+        # bge 使用 [CLS] 向量，其余模型默认对所有 token 取平均
+        self.pooling = pooling or ("cls" if is_bge else "mean")
+        if query_instruction is None and is_bge and "zh" in model_name.lower():
+            query_instruction = BGE_ZH_QUERY_INSTRUCTION
+        self.query_instruction = query_instruction or ""
+        # 同一时刻只做一次前向计算，并行度交给 torch 的线程池
+        self._lock = threading.Lock()
+
+    def _forward(self, texts):
+        torch = self._torch
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="pt")
+        with self._lock, torch.inference_mode():
+            hidden = self._model(**inputs).last_hidden_state
+            if self.pooling == "cls":
+                vectors = hidden[:, 0]
+            else:
+                mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                vectors = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            if self.normalize:
+                vectors = torch.nn.functional.normalize(vectors, p=2, dim=1)
+        return vectors.float().tolist()
+
+    def _batches(self, texts):
+        """按长度升序动态组批，返回下标列表的列表"""
+        lengths = [
+            len(ids) for ids in
+            self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+        ]
+        batches, batch = [], []
+        for i in sorted(range(len(texts)), key=lambda i: lengths[i]):
+            # 升序排列时，加入第 i 条后整批都补齐到 lengths[i]
+            if batch and ((len(batch) + 1) * lengths[i] > self.max_batch_tokens or len(batch) >= self.max_batch_size):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = [None] * len(texts)
+        for batch in self._batches(texts):
+            for i, vector in zip(batch, self._forward([texts[i] for i in batch])):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text):
+        return self._forward([self.query_instruction + text])[0]
+
+
+def create_embeddings(provider="openai", model="", api_key=None, max_workers=4, max_batch_tokens=8000,
+                      num_threads=0, quantize=False):
+    """按提供方创建嵌入对象（不含缓存）
+
+    openai 经过批量并发调度器（由调度器负责限流重试，因此关闭客户端自身的重试）；
+    local 在本进程内推理，不需要调度器。
+    """
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        options = {"model": model} if model else {}
+        return EmbeddingScheduler(
+            OpenAIEmbeddings(openai_api_key=api_key, max_retries=0, **options),
+            max_workers=max_workers,
+            max_batch_tokens=max_batch_tokens,
+        )
+    if provider == "local":
+        return LocalEmbeddings(model or DEFAULT_LOCAL_MODEL, num_threads=num_threads, quantize=quantize)
+    raise ValueError(f"未知的嵌入提供方: {provider}（可选：{', '.join(EMBEDDING_PROVIDERS)}）")
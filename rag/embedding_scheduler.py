@@ -0,0 +1,155 @@
+"""批量并发嵌入调度器：按 token 数分批，在有界线程池中并发请求，遇到限流时自适应退避"""
+import contextlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from langchain_core.embeddings import Embeddings
+
+from rag.tokens import count_tokens
+
+
+def make_batches(texts, max_batch_tokens=8000, max_batch_size=256):
+    """按 token 数把文本分成若干批，返回每批的下标列表"""
+    batches = []
+    current, current_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if current and (current_tokens + tokens > max_batch_tokens or len(current) >= max_batch_size):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def is_rate_limit_error(error):
+    """判断异常是否为限流（HTTP 429）"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    return "rate limit" in str(error).lower() or "429" in str(error)
+
+
+def retry_after_seconds(error):
+    """从限流响应的 Retry-After 头中读取建议等待时间"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingScheduler(Embeddings):
+    """包装任意 Embeddings 的批量并发调度器
+
+    并发上限采用加性增、乘性减：收到限流响应时减半并退避重试，连续成功后逐步恢复。
+    并发上限在同一个调度器的所有调用之间共享，多个会话同时上传时整体不会超过接口限额。
+    """
+
+    def __init__(self, embeddings, max_workers=4, max_batch_tokens=8000, max_batch_size=256,
+                 max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.embeddings = embeddings
+        self.max_workers = max_workers
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.concurrency = max_workers
+        self._active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+        self._local = threading.local()
+        self.stats = {"batches": 0, "texts": 0, "rate_limited": 0, "retries": 0}
+
+    @contextlib.contextmanager
+    def report_progress(self, callback):
+        """在当前线程内注册进度回调 callback(已完成数, 总数)，回调总在调用线程中执行"""
+        previous = getattr(self._local, "callback", None)
+        self._local.callback = callback
+        try:
+            yield
+        finally:
+            self._local.callback = previous
+
+    @contextlib.contextmanager
+    def _slot(self):
+        with self._condition:
+            while self._active >= self.concurrency:
+                self._condition.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._condition.notify_all()
+
+    def _on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self.concurrency < self.max_workers and self._successes >= self.concurrency:
+                self.concurrency += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def _on_rate_limit(self, error, attempt):
+        with self._condition:
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+            self.stats["rate_limited"] += 1
+            self.stats["retries"] += 1
+        delay = retry_after_seconds(error)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (1 + random.random() * 0.25)
+
+    def _with_retries(self, func, *args):
+        for attempt in range(self.max_retries + 1):
+            with self._slot():
+                try:
+                    result = func(*args)
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt == self.max_retries:
+                        raise
+                    delay = self._on_rate_limit(e, attempt)
+                else:
+                    self._on_success()
+                    return result
+            # 退避等待时不占用并发名额
+            time.sleep(delay)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        batches = make_batches(texts, self.max_batch_tokens, self.max_batch_size)
+        callback = getattr(self._local, "callback", None)
+        results = [None] * len(texts)
+        done = 0
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+            futures = {
+                pool.submit(self._with_retries, self.embeddings.embed_documents, [texts[i] for i in batch]): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                for i, vector in zip(batch, future.result()):
+                    results[i] = vector
+                done += len(batch)
+                self.stats["batches"] += 1
+                self.stats["texts"] += len(batch)
+                if callback:
+                    callback(done, len(texts))
+        return results
+
+    def embed_query(self, text):
+        return self._with_retries(self.embeddings.embed_query, text)
@@ -0,0 +1,889 @@
+"""问答引擎：检索、问答链和会话状态的核心逻辑，不依赖 Streamlit
+
+同一进程内的所有会话共享内置语料索引、嵌入缓存和回答缓存；每个会话只持有自己上传文档的
+小索引、对话历史和对话摘要。Streamlit 页面和 HTTP 服务（rag.server）都是它的客户端。
+"""
+import asyncio
+import io
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field, fields
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from rag.ann_index import AnnOptions
+from rag.answer_cache import SemanticAnswerCache, history_key, iter_cached_answer
+from rag.base_index import load_or_build_base_index
+from rag.context_packing import PromptBudget
+from rag.embedding_cache import CachedEmbeddings
+from rag.embedding_providers import create_embeddings
+from rag.extraction import file_extension, iter_document_segments
+from rag.ingestion import IngestJob, IngestQueue
+from rag.knowledge_base import (
+    KnowledgeBase, content_hash, doc_citation, make_text_splitter, source_file, split_document,
+)
+from rag.memory import ConversationSummarizer
+from rag.reranker import CrossEncoderReranker
+from rag.router import CHITCHAT, COMPLEX, LOOKUP, ROUTES, QueryRouter
+from rag.rule_table import RuleTable
+from rag.singleflight import StreamCoalescer, normalize_question
+from rag.sparse_index import SparseIndex
+from rag.tokens import count_tokens
+from rag.tracing import Tracer, activate, span
+
+logger = logging.getLogger(__name__)
+
+# 改进的系统提示，允许模型在找不到相关信息时使用自身知识
+SYSTEM_PROMPT = (
+    "你是一个乐于助人的 AI 助手。\n"
+    "请首先基于下面提供的上下文信息回答问题。如果上下文中包含相关信息，请优先使用这些信息。"
+    "如果上下文中没有相关信息，请使用你的知识和经验来回答问题，并在回答开头说明'基于我的一般知识'。\n"
+    "请保持回答的准确性和有用性。\n\n"
+    "上下文信息:\n{context}\n\n"
+    "请结合对话历史和上下文信息来回答用户的问题。"
+)
+# 闲聊不检索，只带对话历史
+CHAT_PROMPT = (
+    "你是一个乐于助人的 AI 助手，主要负责回答用户关于文档和资料的问题。\n"
+    "用户现在是在寒暄或闲聊，请简短、友好地回应。"
+)
+NO_CONTEXT = "没有找到相关的上下文信息。"
+RETRIEVAL_ERROR_CONTEXT = "检索出错，没有找到相关的上下文信息。"
+PREVIEW_LENGTH = 200
+
+
+@dataclass
+class EngineConfig:
+    """引擎配置；每一项都可以用同名的大写环境变量覆盖"""
+
+    document_file_path: str = "测试.md"
+    base_index_dir: str = os.path.join(".cache", "base_index")
+    # 嵌入模型提供方：openai 或 local（本地 CPU 模型）；embedding_model 为空时使用提供方的默认模型
+    embedding_provider: str = "openai"
+    embedding_model: str = ""
+    # 本地模型的 torch 线程数（0 为默认）和是否做 int8 动态量化
+    local_embedding_threads: int = 0
+    local_embedding_quantize: bool = False
+    embedding_cache_path: str = os.path.join(".cache", "embeddings.sqlite3")
+    embedding_cache_max_entries: int = 200_000
+    embedding_max_workers: int = 4
+    embedding_batch_tokens: int = 8000
+    # 后台导入上传文件的工作线程数
+    ingest_workers: int = 2
+    # 内置语料的 FAISS 索引类型（auto 按片段数选择 Flat / HNSW / IVF），以及检索参数和最低召回率
+    ann_index_type: str = "auto"
+    ann_ef_search: int = 0
+    ann_nprobe: int = 0
+    ann_min_recall: float = 0.95
+    chunk_size: int = 1000
+    chunk_overlap: int = 100
+    retrieval_k: int = 4
+    # 检索模式：hybrid（向量 + 本地稀疏检索融合）、dense、sparse
+    retrieval_mode: str = "hybrid"
+    # 本地交叉编码器重排（需要 torch 和 transformers）：为空时不重排；否则多取 rerank_fetch_k 个候选，
+    # 在 rerank_budget_ms 内打分，只保留得分不低于 rerank_min_score 的片段
+    rerank_model: str = ""
+    rerank_fetch_k: int = 30
+    rerank_min_score: float = 0.2
+    rerank_budget_ms: int = 300
+    rerank_threads: int = 0
+    rerank_quantize: bool = False
+    answer_cache_threshold: float = 0.95
+    answer_cache_ttl: int = 6 * 3600
+    answer_cache_max_entries: int = 2000
+    # 提示词 token 预算（不含模型输出），按比例分给检索上下文和对话历史
+    prompt_token_budget: int = 4000
+    context_token_share: float = 0.6
+    chat_model: str = "gpt-4o"
+    # 查询路由：检索前在本地判断问题类型。寒暄不检索（问候、感谢等用固定回复，其余用 routing_model），
+    # 简单的事实查询检索后用 routing_model，复杂问题才用 chat_model；
+    # 分类模型的置信度低于 routing_min_confidence 时按复杂问题处理
+    query_routing: bool = True
+    routing_model: str = "gpt-4o-mini"
+    routing_min_confidence: float = 0.5
+    # 对话摘要：较早的对话由较小的模型在后台压缩，提示词中只保留摘要和最近几条消息
+    summary_model: str = "gpt-4o-mini"
+    summary_keep_messages: int = 6
+    # 会话空闲超过该秒数后被回收
+    session_ttl: int = 6 * 3600
+    # 相同的并发问题（规范化后的问题、知识库版本和对话历史都相同）共享一次检索和生成
+    coalesce_requests: bool = True
+    # 简短的追问（如"那研究生呢？"）直接复用上一轮的检索结果，不再向量化和检索
+    followup_context_reuse: bool = False
+    followup_max_chars: int = 15
+    # 内置语料中记分条款的分值、门槛和简单计分问题由规则表直接回答，不检索、不调用大模型
+    rule_answers: bool = True
+    # 每条请求追踪追加写入的 JSONL 文件，为空时不写
+    trace_log_path: str = ""
+    openai_api_key: str = field(default=None, repr=False)
+
+    @classmethod
+    def from_env(cls, **overrides):
+        values = {}
+        for item in fields(cls):
+            raw = os.getenv(item.name.upper())
+            if raw is None:
+                continue
+            if isinstance(item.default, bool):
+                values[item.name] = raw.strip().lower() in ("1", "true", "yes", "on")
+            elif item.default is not None:
+                values[item.name] = type(item.default)(raw)
+            else:
+                values[item.name] = raw
+        values.update(overrides)
+        return cls(**values)
+
+
+# 追问中常见的指代词和承接词
+FOLLOWUP_MARKERS = (
+    "它", "他", "她", "这", "那", "其", "上述", "刚才", "以上", "前面",
+    "呢", "还有", "具体", "详细", "为什么", "举例", "展开",
+)
+
+
+def is_followup_question(question, max_chars=15):
+    """简短且带有指代或承接词的问题视为对上一轮的追问"""
+    question = question.strip()
+    return 0 < len(question) <= max_chars and any(marker in question for marker in FOLLOWUP_MARKERS)
+
+
+@dataclass
+class TurnContext:
+    """一轮问答使用的检索结果；按轮次保存在会话中，重新生成或追问时可以直接复用"""
+
+    question: str
+    kb_version: str
+    index: int
+    # 问答链运行后写入：检索到的片段和组装好的上下文文本；检索失败时 docs 为 None
+    docs: list = None
+    context: str = ""
+    reused_from: str = None
+    # 由规则表直接回答时的出处
+    citations: list = None
+    # 查询路由的结论
+    route: str = None
+
+
+class QASession:
+    """单个会话的状态：上传文档的索引、对话历史、对话摘要"""
+
+    def __init__(self, session_id, knowledge_base, summarizer, chains):
+        self.session_id = session_id
+        self.knowledge_base = knowledge_base
+        self.summarizer = summarizer
+        # 路由 -> 问答链
+        self.chains = chains
+        self.chat_history = []
+        self.files = []
+        # 轮次 -> TurnContext（按一问一答计数）
+        self.turn_contexts = {}
+        self.last_trace = None
+        self.last_active = time.time()
+        self.lock = threading.Lock()
+
+
+def record_first_token(trace):
+    """首个 token 到达：记录用户感知的首字延迟，以及提示词组装完成后模型本身的首字延迟"""
+    first_token_ms = trace.mark("first_token")
+    trace.add_span("first_token", first_token_ms, start_ms=0)
+    if "prompt_ready" in trace.marks:
+        trace.add_span("llm_first_token", first_token_ms - trace.marks["prompt_ready"], start_ms=trace.marks["prompt_ready"])
+
+
+def record_generation(trace, answer, cached):
+    """回答输出完毕：记录首字之后的输出耗时和速度（tokens/s），并结束追踪"""
+    tokens = count_tokens(answer)
+    first_token_ms = trace.marks.get("first_token")
+    if first_token_ms is not None:
+        generation_ms = trace.elapsed_ms() - first_token_ms
+        tokens_per_second = tokens / (generation_ms / 1000) if generation_ms > 0 else 0.0
+        trace.add_span("generation", generation_ms, start_ms=first_token_ms,
+                       tokens=tokens, tokens_per_second=tokens_per_second)
+        # 缓存回放的速度没有参考意义，不计入输出速度分布
+        if not cached and tokens_per_second:
+            trace.tracer.metrics.observe_throughput(tokens_per_second)
+    trace.finish(cached=cached, tokens=tokens)
+
+
+def citations_for(docs):
+    """检索片段的出处列表（按相关度顺序，去重），直接取自片段元数据"""
+    citations = []
+    for doc in docs or []:
+        citation = doc_citation(doc)
+        if citation not in citations:
+            citations.append(citation)
+    return citations
+
+
+class AnswerStream:
+    """一次回答的流式输出；迭代结束后 answer / cached / route / citations 等属性可用"""
+
+    def __init__(self, tokens, on_complete=None, trace=None):
+        self._tokens = tokens
+        self._on_complete = on_complete
+        self.trace = trace
+        self.answer = None
+        self.cached = False
+        self.route = None
+        self.citations = []
+
+    def __iter__(self):
+        parts = []
+        try:
+            for token in self._tokens:
+                if not parts and self.trace is not None:
+                    record_first_token(self.trace)
+                parts.append(token)
+                yield token
+        except Exception as e:
+            if self.trace is not None:
+                self.trace.finish(error=str(e))
+            raise
+        self.answer = "".join(parts)
+        if self._on_complete:
+            self._on_complete(self)
+
+
+def build_qa_chain(knowledge_base, llm, budget):
+    """构建问答链：检索 → 按 token 预算组装上下文和历史 → 提示词 → 模型"""
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{question}")
+    ])
+
+    def get_context_and_question(inputs):
+        context_docs = []
+        retrieval_failed = False
+        trace = inputs.get("trace")
+        turn = inputs.get("turn")
+        with activate(trace):
+            if turn is not None and turn.docs is not None:
+                # 复用之前一轮的检索结果，跳过向量化和检索
+                context_docs = turn.docs
+            elif not knowledge_base.is_empty:
+                try:
+                    with span("retrieval") as attributes:
+                        context_docs = knowledge_base.invoke(inputs["question"], sources=inputs.get("sources"))
+                        attributes["hits"] = len(context_docs)
+                except Exception:
+                    logger.exception("检索时出错")
+                    retrieval_failed = True
+
+            # 检索上下文（合并重叠片段、去重）和对话历史共同受 token 预算约束
+            with span("context_packing") as attributes:
+                packed_context, chat_history, stats = budget.allocate(
+                    context_docs, inputs["chat_history"], inputs["question"]
+                )
+                attributes.update(stats)
+        if trace is not None:
+            trace.mark("prompt_ready")
+        if retrieval_failed:
+            context = RETRIEVAL_ERROR_CONTEXT
+        else:
+            context = packed_context or NO_CONTEXT
+        if turn is not None:
+            turn.docs = None if retrieval_failed else context_docs
+            turn.context = context
+
+        return {
+            "context": context,
+            "question": inputs["question"],
+            "chat_history": chat_history
+        }
+
+    return get_context_and_question | prompt | llm | StrOutputParser()
+
+
+def build_chat_chain(llm, budget):
+    """闲聊链：不检索，只按 token 预算带上对话历史"""
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", CHAT_PROMPT),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{question}")
+    ])
+
+    def get_history_and_question(inputs):
+        trace = inputs.get("trace")
+        with activate(trace), span("context_packing") as attributes:
+            _, chat_history, stats = budget.allocate([], inputs["chat_history"], inputs["question"])
+            attributes.update(stats)
+        if trace is not None:
+            trace.mark("prompt_ready")
+        return {"question": inputs["question"], "chat_history": chat_history}
+
+    return get_history_and_question | prompt | llm | StrOutputParser()
+
+
+class QAEngine:
+    """问答引擎
+
+    embeddings / llm / summary_llm / small_llm / reranker 可以注入（例如离线评测用的替身），否则按配置创建。
+    small_llm 用于路由到闲聊和简单查询的问题，routing_model 与 summary_model 相同时直接使用 summary_llm。
+    """
+
+    def __init__(self, config=None, embeddings=None, llm=None, summary_llm=None, reranker=None, small_llm=None):
+        self.config = config or EngineConfig.from_env()
+        api_key = self.config.openai_api_key or os.getenv("OPENAI_API_KEY")
+        needs_api_key = (
+            (embeddings is None and self.config.embedding_provider == "openai")
+            or llm is None or summary_llm is None
+        )
+        if needs_api_key and not api_key:
+            raise RuntimeError("请先设置环境变量 OPENAI_API_KEY")
+
+        if embeddings is None:
+            embeddings = CachedEmbeddings(
+                create_embeddings(
+                    self.config.embedding_provider,
+                    self.config.embedding_model,
+                    api_key=api_key,
+                    max_workers=self.config.embedding_max_workers,
+                    max_batch_tokens=self.config.embedding_batch_tokens,
+                    num_threads=self.config.local_embedding_threads,
+                    quantize=self.config.local_embedding_quantize,
+                ),
+                path=self.config.embedding_cache_path,
+                max_entries=self.config.embedding_cache_max_entries,
+            )
+        if llm is None or summary_llm is None:
+            from langchain_openai import ChatOpenAI
+
+            llm = llm or ChatOpenAI(model_name=self.config.chat_model, temperature=0, openai_api_key=api_key)
+            summary_llm = summary_llm or ChatOpenAI(model_name=self.config.summary_model, temperature=0, openai_api_key=api_key)
+        if small_llm is None:
+            if self.config.routing_model == self.config.summary_model:
+                small_llm = summary_llm
+            else:
+                from langchain_openai import ChatOpenAI
+
+                small_llm = ChatOpenAI(model_name=self.config.routing_model, temperature=0, openai_api_key=api_key)
+
+        if reranker is None and self.config.rerank_model:
+            reranker = CrossEncoderReranker(
+                self.config.rerank_model,
+                num_threads=self.config.rerank_threads,
+                quantize=self.config.rerank_quantize,
+                time_budget_ms=self.config.rerank_budget_ms,
+            )
+
+        self.embeddings = embeddings
+        self.reranker = reranker
+        self.llm = llm
+        self.summary_llm = summary_llm
+        self.small_llm = small_llm
+        self.answer_cache = SemanticAnswerCache(
+            embeddings,
+            threshold=self.config.answer_cache_threshold,
+            ttl=self.config.answer_cache_ttl,
+            max_entries=self.config.answer_cache_max_entries,
+        )
+        self.budget = PromptBudget(
+            self.config.prompt_token_budget,
+            self.config.context_token_share,
+            reserved_tokens=count_tokens(SYSTEM_PROMPT),
+        )
+
+        self._base = (None, {}, None)
+        self._base_mtime = None
+        self._rules = None
+        self._base_lock = threading.Lock()
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self.ingest_queue = IngestQueue(self.config.ingest_workers)
+        self.coalescer = StreamCoalescer()
+        self.router = None
+        self.route_counts = dict.fromkeys(ROUTES, 0)
+        self._route_lock = threading.Lock()
+        if self.config.query_routing:
+            self.router = QueryRouter(min_confidence=self.config.routing_min_confidence)
+            # 在后台训练分类模型，不让第一个请求承担训练耗时
+            threading.Thread(target=self.router.warm_up, daemon=True).start()
+        self.tracer = Tracer(self.config.trace_log_path or None)
+
+    # ---------- 内置语料 ----------
+    def _load_base(self):
+        """加载内置语料索引，返回 (向量库, {来源: 内容哈希}, 稀疏索引)
+
+        优先以内存映射方式加载磁盘索引（文件内容变化时自动重建），失败时在内存中构建一次。
+        """
+        path = self.config.document_file_path
+        try:
+            ann_options = AnnOptions(
+                index_type=self.config.ann_index_type,
+                ef_search=self.config.ann_ef_search,
+                nprobe=self.config.ann_nprobe,
+                min_recall=self.config.ann_min_recall,
+            )
+            store, manifest = load_or_build_base_index(
+                path, self.embeddings, self.config.base_index_dir,
+                self.config.chunk_size, self.config.chunk_overlap, ann_options,
+            )
+            sources = {manifest["source"]: manifest["sha256"]}
+        except Exception:
+            # 磁盘索引不可用时退回到在内存中构建
+            logger.exception("加载内置文档索引失败，将在内存中构建")
+            with open(path, "r", encoding="utf-8") as file:
+                raw_docs = file.read()
+            if not raw_docs:
+                return None, {}, None
+            source = f"base:{path}"
+            docs, ids = split_document(make_text_splitter(self.config.chunk_size, self.config.chunk_overlap), source, raw_docs)
+            store, sources = FAISS.from_documents(docs, self.embeddings, ids=ids), {source: content_hash(raw_docs)}
+        return store, sources, SparseIndex.from_vectorstore(store)
+
+    def _load_rules(self):
+        """从内置语料中解析记分条款和分数门槛；解析失败时不启用规则表"""
+        try:
+            table = RuleTable.from_file(self.config.document_file_path)
+        except Exception:
+            logger.exception("解析内置文档的规则表失败")
+            return None
+        return table if len(table) else None
+
+    def base_corpus(self):
+        """进程内共享的内置语料；文件被修改后，之后新建的会话使用重新加载的索引"""
+        path = self.config.document_file_path
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        with self._base_lock:
+            if mtime != self._base_mtime:
+                self._base = self._load_base() if mtime is not None else (None, {}, None)
+                self._rules = self._load_rules() if mtime is not None and self.config.rule_answers else None
+                self._base_mtime = mtime
+            return self._base
+
+    def rule_table(self):
+        """内置语料的规则表，与内置索引一起加载；没有可用的条款时为 None"""
+        self.base_corpus()
+        return self._rules
+
+    # ---------- 会话 ----------
+    def _create_session(self, session_id):
+        knowledge_base = KnowledgeBase(
+            self.embeddings,
+            chunk_size=self.config.chunk_size,
+            chunk_overlap=self.config.chunk_overlap,
+            k=self.config.retrieval_k,
+            retrieval_mode=self.config.retrieval_mode,
+            reranker=self.reranker,
+            rerank_fetch_k=self.config.rerank_fetch_k,
+            rerank_min_score=self.config.rerank_min_score,
+        )
+        base_store, base_sources, base_sparse = self.base_corpus()
+        if base_store is not None:
+            knowledge_base.set_base(base_store, base_sources, base_sparse)
+        summarizer = ConversationSummarizer(self.summary_llm, keep_last_messages=self.config.summary_keep_messages)
+        chains = {
+            COMPLEX: build_qa_chain(knowledge_base, self.llm, self.budget),
+            LOOKUP: build_qa_chain(knowledge_base, self.small_llm, self.budget),
+            CHITCHAT: build_chat_chain(self.small_llm, self.budget),
+        }
+        return QASession(session_id, knowledge_base, summarizer, chains)
+
+    def get_session(self, session_id):
+        """获取会话，不存在时创建；顺便回收空闲超时的会话"""
+        now = time.time()
+        with self._sessions_lock:
+            expired = [sid for sid, s in self._sessions.items() if now - s.last_active > self.config.session_ttl]
+            for sid in expired:
+                del self._sessions[sid]
+                self.ingest_queue.forget(sid)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = self._create_session(session_id)
+            session.last_active = now
+            return session
+
+    def drop_session(self, session_id):
+        with self._sessions_lock:
+            self._sessions.pop(session_id, None)
+        self.ingest_queue.forget(session_id)
+
+    # ---------- 问答 ----------
+    def _reusable_context(self, session, question, kb_version, reuse_context):
+        """找出可以复用的检索结果：重新生成时复用同一轮的，简短追问复用上一轮的；知识库变化后都不复用"""
+        index = len(session.chat_history) // 2
+        if reuse_context:
+            stored = session.turn_contexts.get(index)
+            if stored is not None and stored.docs is not None and stored.question == question and stored.kb_version == kb_version:
+                return stored, "regenerate"
+        if self.config.followup_context_reuse and is_followup_question(question, self.config.followup_max_chars):
+            stored = session.turn_contexts.get(index - 1)
+            if stored is not None and stored.docs is not None and stored.kb_version == kb_version:
+                return stored, "followup"
+        return None, None
+
+    def _route(self, question, trace, turn):
+        """选择处理路径，记录路由结论和耗时；复用了检索结果的请求不走闲聊"""
+        if self.router is None:
+            return None
+        with activate(trace), span("routing") as attributes:
+            decision = self.router.route(question)
+            if decision.route == CHITCHAT and turn.docs is not None:
+                decision.route, decision.reply = LOOKUP, None
+            attributes.update(decision.to_dict())
+        trace.attributes["route"] = decision.route
+        with self._route_lock:
+            self.route_counts[decision.route] += 1
+        logger.info(
+            "查询路由：%s（%s，置信度 %.2f，%.2fms）%s",
+            decision.route, decision.reason, decision.confidence, decision.latency_ms, question[:PREVIEW_LENGTH],
+        )
+        return decision
+
+    @staticmethod
+    def _chain(session, chain_input):
+        return session.chains[chain_input["route"]]
+
+    def _rule_answer(self, question, sources, trace, turn):
+        """规则表能直接回答时返回回答文本，出处写入 turn.citations；否则返回 None"""
+        table = self.rule_table() if self.config.rule_answers else None
+        if table is None or (sources is not None and table.source not in sources):
+            return None
+        try:
+            with activate(trace), span("rule_lookup") as attributes:
+                result = table.answer(question)
+                attributes["hit"] = result is not None
+        except Exception:
+            logger.exception("规则表查询失败")
+            return None
+        if result is None:
+            return None
+        trace.attributes["rule_answer"] = True
+        answer, turn.citations = result
+        return answer
+
+    def _prepare(self, session, question, use_cache, trace, reuse_context=False, sources=None):
+        # 限定检索范围时使用只包含这些文档的版本号，缓存和检索结果的复用都不会跨范围
+        kb_version = session.knowledge_base.scoped_version(sources)
+        history = list(session.chat_history)
+        turn = TurnContext(question, kb_version, len(history) // 2)
+        stored, reason = self._reusable_context(session, question, kb_version, reuse_context)
+        if stored is not None:
+            turn.docs = stored.docs
+            turn.reused_from = reason
+            trace.attributes["context_reused"] = reason
+        chain_input = {
+            "question": question,
+            # 较早的对话以摘要形式出现，只保留最近几条原始消息
+            "chat_history": session.summarizer.prompt_messages(session.chat_history),
+            "trace": trace,
+            "turn": turn,
+            "sources": sources,
+        }
+        decision = self._route(question, trace, turn)
+        route = chain_input["route"] = turn.route = decision.route if decision is not None else COMPLEX
+        # 固定回复和规则表的回答与缓存的回答一样直接输出；重新生成时交给问答链
+        cached_answer = decision.reply if use_cache and decision is not None else None
+        # 规则表只回答简单的事实查询；关闭路由时由规则表自己判断能否回答
+        if use_cache and cached_answer is None and (route == LOOKUP or decision is None):
+            cached_answer = self._rule_answer(question, sources, trace, turn)
+        # 闲聊和复用了检索结果的请求不查回答缓存，省去一次问题向量化
+        if use_cache and cached_answer is None and route != CHITCHAT and turn.reused_from is None:
+            try:
+                with activate(trace), span("answer_cache_lookup") as attributes:
+                    # 只走稀疏检索的关键词查询只做精确匹配，不为查缓存向量化问题
+                    semantic = not session.knowledge_base.is_sparse_only(question)
+                    cached_answer = self.answer_cache.lookup(question, kb_version, history, semantic=semantic)
+                    attributes.update(hit=cached_answer is not None, semantic=semantic)
+            except Exception:
+                logger.exception("查询回答缓存失败")
+        if cached_answer is None:
+            trace.attributes["model"] = self.config.chat_model if route == COMPLEX else self.config.routing_model
+        return chain_input, kb_version, history, cached_answer
+
+    def _shared_stream(self, session, chain_input, use_cache):
+        """相同的并发请求合并为一个共享流，返回 SharedStream；不参与合并时返回 None
+
+        重新生成（use_cache=False）和复用了检索结果的请求不参与合并。
+        """
+        turn = chain_input["turn"]
+        if not self.config.coalesce_requests or not use_cache or turn.docs is not None:
+            return None
+        key = (normalize_question(chain_input["question"]), turn.kb_version, history_key(chain_input["chat_history"]))
+        chain = self._chain(session, chain_input)
+        shared, leader = self.coalescer.join(key, lambda: chain.stream(chain_input), state=turn)
+        if not leader:
+            chain_input["trace"].attributes["coalesced"] = True
+        return shared
+
+    @staticmethod
+    def _adopt_turn(turn, shared):
+        """共享流结束后，跟随者沿用发起者的检索结果（用于引用出处和之后的复用）"""
+        if shared.state is not turn:
+            turn.docs = shared.state.docs
+            turn.context = shared.state.context
+
+    def _finish(self, session, question, answer, cached, kb_version, history, trace, turn):
+        """记录本轮问答，返回回答引用的出处（命中回答缓存时为空，规则表回答时为规则表的出处）"""
+        record_generation(trace, answer, cached)
+        session.last_trace = trace
+        with session.lock:
+            # 命中回答缓存时没有运行检索，这一轮没有可复用的上下文
+            if cached or turn.docs is None:
+                session.turn_contexts.pop(turn.index, None)
+            else:
+                session.turn_contexts[turn.index] = turn
+        # 闲聊不查回答缓存，回答也不写入，省去一次问题向量化
+        if not cached and turn.route != CHITCHAT:
+            try:
+                self.answer_cache.store(question, answer, kb_version, history,
+                                        semantic=not session.knowledge_base.is_sparse_only(question))
+            except Exception:
+                logger.exception("写入回答缓存失败")
+        with session.lock:
+            session.chat_history.extend([
+                HumanMessage(content=question),
+                AIMessage(content=answer)
+            ])
+        # 回答输出完成后在后台把较早的对话并入摘要
+        session.summarizer.compact_in_background(session.chat_history)
+        if cached:
+            return turn.citations or []
+        return citations_for(turn.docs)
+
+    def stream_answer(self, session_id, question, use_cache=True, reuse_context=False, sources=None):
+        """流式生成回答，返回 AnswerStream
+
+        use_cache=False 时（重新生成）跳过语义缓存的查找；reuse_context=True 时（重新生成）
+        如果这一轮之前回答过同一个问题且知识库未变，直接复用当时的检索结果。
+        sources 为来源列表时只在这些文档中检索（见 sources()），None 为全部文档。
+        """
+        session = self.get_session(session_id)
+        trace = self.tracer.start("answer", session_id=session_id, use_cache=use_cache)
+        chain_input, kb_version, history, cached_answer = self._prepare(
+            session, question, use_cache, trace, reuse_context, sources
+        )
+        shared = None
+        if cached_answer is not None:
+            tokens = iter_cached_answer(cached_answer)
+        else:
+            shared = self._shared_stream(session, chain_input, use_cache)
+            tokens = shared.subscribe() if shared is not None else self._chain(session, chain_input).stream(chain_input)
+        cached = cached_answer is not None
+
+        def complete(stream):
+            if shared is not None:
+                self._adopt_turn(chain_input["turn"], shared)
+            stream.citations = self._finish(
+                session, question, stream.answer, cached, kb_version, history, trace, chain_input["turn"]
+            )
+
+        stream = AnswerStream(tokens, complete, trace=trace)
+        stream.cached = cached
+        stream.route = chain_input["route"]
+        return stream
+
+    async def astream_answer(self, session_id, question, use_cache=True, info=None, reuse_context=False,
+                             sources=None):
+        """stream_answer 的异步版本，依次产出 token；阻塞的缓存查询放到线程池中执行
+
+        info 为可选的字典，会写入 cached、route 等本次回答的信息，回答结束后写入 citations。
+        """
+        session = self.get_session(session_id)
+        trace = self.tracer.start("answer", session_id=session_id, use_cache=use_cache)
+        chain_input, kb_version, history, cached_answer = await asyncio.to_thread(
+            self._prepare, session, question, use_cache, trace, reuse_context, sources
+        )
+        if info is not None:
+            info["cached"] = cached_answer is not None
+            info["route"] = chain_input["route"]
+            info["trace_id"] = trace.trace_id
+        parts = []
+        try:
+            if cached_answer is not None:
+                for token in iter_cached_answer(cached_answer):
+                    if not parts:
+                        record_first_token(trace)
+                    parts.append(token)
+                    yield token
+            else:
+                shared = self._shared_stream(session, chain_input, use_cache)
+                tokens = (
+                    shared.asubscribe() if shared is not None else self._chain(session, chain_input).astream(chain_input)
+                )
+                async for token in tokens:
+                    if not parts:
+                        record_first_token(trace)
+                    parts.append(token)
+                    yield token
+                if shared is not None:
+                    self._adopt_turn(chain_input["turn"], shared)
+        except Exception as e:
+            trace.finish(error=str(e))
+            raise
+        citations = await asyncio.to_thread(
+            self._finish, session, question, "".join(parts), cached_answer is not None, kb_version, history, trace,
+            chain_input["turn"],
+        )
+        if info is not None:
+            info["citations"] = citations
+
+    def truncate_history(self, session_id, length):
+        """把对话历史截断到 length 条消息（重新生成回答时使用），摘要同步回退"""
+        session = self.get_session(session_id)
+        with session.lock:
+            del session.chat_history[length:]
+            # 保留被截断的第一轮的检索结果，重新生成这一轮时可以复用
+            for index in [i for i in session.turn_contexts if i > length // 2]:
+                del session.turn_contexts[index]
+        session.summarizer.truncate(length)
+
+    def clear_history(self, session_id):
+        self.truncate_history(session_id, 0)
+
+    def history(self, session_id):
+        session = self.get_session(session_id)
+        return [{"role": message.type, "content": message.content} for message in session.chat_history]
+
+    # ---------- 文档 ----------
+    def ingest(self, session_id, filename, stream, size=None, on_progress=None, job=None):
+        """流式提取上传文件并向量化，完成后一次性并入会话的索引，返回文件信息
+
+        文件为空时抛出 ValueError，格式不支持时抛出 UnsupportedFormatError。
+        job 为后台导入任务时，在各步骤之间更新任务进度并检查是否已取消（取消时抛出 IngestCancelled）。
+        """
+        session = self.get_session(session_id)
+        source = f"upload:{filename}"
+        preview_parts = []
+        trace = self.tracer.start("ingest", session_id=session_id, filename=filename)
+
+        def page_progress(pages_done, num_pages):
+            if job is not None:
+                job.progress = min(pages_done / num_pages, 0.99)
+
+        def segments():
+            # 只保留预览所需的开头部分，不在内存中拼接全文
+            preview_length = 0
+            by_page = file_extension(filename) == "pdf"
+            for segment in iter_document_segments(filename, stream, on_page=page_progress):
+                if preview_length <= PREVIEW_LENGTH:
+                    preview_parts.append(segment[:PREVIEW_LENGTH + 1])
+                    preview_length += len(preview_parts[-1])
+                if job is not None:
+                    job.check_cancelled()
+                    # PDF 一次读入全部字节后逐页提取，进度按已提取的页数；文本按已读取的字节数
+                    if size and not by_page:
+                        job.progress = min(stream.tell() / size, 0.99)
+                yield segment
+
+        def progress(num_chunks):
+            if job is not None:
+                job.chunks = num_chunks
+                job.check_cancelled()
+            if on_progress:
+                on_progress(num_chunks)
+
+        try:
+            with activate(trace):
+                content_length, num_chunks = session.knowledge_base.add_document_stream(
+                    source, segments(), on_progress=progress,
+                    before_commit=job.check_cancelled if job is not None else None,
+                )
+        except Exception as e:
+            trace.finish(error=str(e))
+            raise
+        trace.finish(characters=content_length, chunks=num_chunks)
+        if num_chunks == 0:
+            session.knowledge_base.remove_document(source)
+            raise ValueError(f"文件 {filename} 内容为空或无法提取")
+
+        preview = "".join(preview_parts)
+        file_info = {
+            'name': filename,
+            'size': size,
+            'content_length': content_length,
+            'num_chunks': num_chunks,
+            'preview': preview[:PREVIEW_LENGTH] + "..." if len(preview) > PREVIEW_LENGTH else preview
+        }
+        with session.lock:
+            # 写入索引后、登记文件前被取消（例如 clear_files）时撤回刚写入的片段，避免清空的文件又出现
+            if job is not None and job.cancel_event.is_set():
+                session.knowledge_base.remove_document(source)
+                job.check_cancelled()
+            session.files = [info for info in session.files if info['name'] != filename] + [file_info]
+        return file_info
+
+    def submit_ingest(self, session_id, filename, data, size=None):
+        """把上传文件交给后台导入任务，立即返回任务信息；data 为文件的字节内容"""
+        self.get_session(session_id)
+        job = IngestJob(session_id, filename, size if size is not None else len(data))
+        self.ingest_queue.submit(
+            job, lambda job: self.ingest(session_id, filename, io.BytesIO(data), job.size, job=job)
+        )
+        return job.to_dict()
+
+    def ingest_jobs(self, session_id):
+        """会话的导入任务列表（状态、进度、错误、完成后的文件信息）"""
+        return [job.to_dict() for job in self.ingest_queue.jobs(session_id)]
+
+    def cancel_ingest(self, session_id, job_id):
+        """取消排队中或运行中的导入任务；任务不存在时返回 None"""
+        job = self.ingest_queue.cancel(session_id, job_id)
+        return job.to_dict() if job is not None else None
+
+    def clear_ingest_jobs(self, session_id):
+        """丢弃已结束的导入任务记录"""
+        self.ingest_queue.clear_finished(session_id)
+
+    def remove_file(self, session_id, filename):
+        """移除一个上传文件，并从索引中删除它的向量"""
+        session = self.get_session(session_id)
+        session.knowledge_base.remove_document(f"upload:{filename}")
+        with session.lock:
+            session.files = [info for info in session.files if info['name'] != filename]
+
+    def clear_files(self, session_id):
+        """取消未完成的导入任务，只删除上传文件对应的向量，内置语料不受影响"""
+        self.ingest_queue.cancel_all(session_id)
+        session = self.get_session(session_id)
+        with session.lock:
+            files = list(session.files)
+        for file_info in files:
+            self.remove_file(session_id, file_info['name'])
+
+    def files(self, session_id):
+        return list(self.get_session(session_id).files)
+
+    def sources(self, session_id):
+        """可以作为检索范围的来源：内置语料和已上传的文件"""
+        return [
+            {"source": source, "file": source_file(source), "kind": source.split(":", 1)[0]}
+            for source in self.get_session(session_id).knowledge_base.sources
+        ]
+
+    # ---------- 状态 ----------
+    def stats(self, session_id=None):
+        stats = {
+            "sessions": len(self._sessions),
+            "answer_cache": self.answer_cache.stats(),
+            "coalescer": self.coalescer.stats(),
+        }
+        with self._route_lock:
+            stats["routes"] = dict(self.route_counts)
+        if callable(getattr(self.embeddings, "stats", None)):
+            stats["embedding_cache"] = self.embeddings.stats()
+        if session_id is not None:
+            knowledge_base = self.get_session(session_id).knowledge_base
+            stats["kb_version"] = knowledge_base.version
+            stats["num_chunks"] = knowledge_base.num_chunks
+            stats["last_retrieval"] = knowledge_base.last_trace
+            last_trace = self.get_session(session_id).last_trace
+            stats["last_trace"] = last_trace.to_dict() if last_trace is not None else None
+        stats["stages"] = self.tracer.metrics.summary()
+        return stats
+
+    def metrics_text(self):
+        """Prometheus 文本格式的指标：各阶段延迟直方图与分位数、输出速度、缓存命中次数"""
+        caches = {"answer": self.answer_cache.stats()}
+        if callable(getattr(self.embeddings, "stats", None)):
+            caches["embedding"] = self.embeddings.stats()
+        return self.tracer.metrics.prometheus({
+            "rag_cache_hits_total": {name: stats["hits"] for name, stats in caches.items()},
+            "rag_cache_misses_total": {name: stats["misses"] for name, stats in caches.items()},
+        })
@@ -0,0 +1,126 @@
+"""流式文档提取：逐页/逐段产出文本，直接送入切分和向量化，不在内存中拼接全文"""
+import codecs
+import io
+import multiprocessing
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import docx2txt
+import PyPDF2
+
+from rag import pdf_worker
+from rag.pdf_worker import format_pdf_page
+
+SUPPORTED_EXTENSIONS = ("txt", "md", "pdf", "docx", "doc")
+PDF_PAGES_PER_TASK = 8
+# 页数少于该值的 PDF 直接在当前进程中提取，避免进程池的启动开销
+PDF_PARALLEL_MIN_PAGES = 32
+TEXT_BLOCK_SIZE = 64 * 1024
+
+_pool_context = None
+
+
+class UnsupportedFormatError(ValueError):
+    """不支持的文件格式"""
+
+
+def file_extension(filename):
+    return filename.split(".")[-1].lower()
+
+
+def _process_context():
+    """进程池的启动方式：forkserver（不可用时 spawn），不直接 fork 调用方的进程
+
+    调用方是导入线程，fork 一个已加载 FAISS、torch 和 HTTP 客户端的多线程进程可能死锁。
+    forkserver 进程只启动一次并预先导入轻量的 rag.pdf_worker，之后每个工作进程都从它 fork。
+    """
+    global _pool_context
+    if _pool_context is None:
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([pdf_worker.__name__])
+        else:
+            context = multiprocessing.get_context("spawn")
+        _pool_context = context
+    return _pool_context
+
+
+def can_use_process_pool():
+    """工作进程启动时会重新导入调用方的 __main__（作为 __mp_main__），只有这一步没有代价时才用进程池
+
+    python -m pytest、uvicorn 等以包的 __main__ 启动时会跳过这一步；streamlit run 时 __main__ 是页面脚本，
+    python -m rag.server 时是 rag.server，重新导入会在每个工作进程中执行页面脚本或加载 LangChain、FAISS
+    （每个进程数秒），这些情况下在当前进程中逐页提取。
+    """
+    main = sys.modules.get("__main__")
+    name = getattr(getattr(main, "__spec__", None), "name", None)
+    if name is not None:
+        return name == "__main__" or name.endswith(".__main__")
+    return getattr(main, "__file__", None) is None
+
+
+def iter_pdf_pages(data, workers=None, on_page=None):
+    """按页顺序产出 PDF 文本；on_page(已提取页数, 总页数) 在产出每一页之前调用
+
+    大文件在进程池中并行提取；同时在途的任务数有上限，内存占用与总页数无关，
+    前面的页提取完成后即可开始切分和向量化，不必等最后一页。
+    """
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    num_pages = len(reader.pages)
+    workers = workers or min(4, os.cpu_count() or 1)
+
+    if num_pages < PDF_PARALLEL_MIN_PAGES or workers <= 1 or not can_use_process_pool():
+        for i, page in enumerate(reader.pages):
+            text = format_pdf_page(i, page.extract_text() or "")
+            if on_page:
+                on_page(i + 1, num_pages)
+            yield text
+        return
+    del reader
+
+    ranges = deque((start, min(start + PDF_PAGES_PER_TASK, num_pages))
+                   for start in range(0, num_pages, PDF_PAGES_PER_TASK))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_process_context(),
+                             initializer=pdf_worker.init_worker, initargs=(data,)) as pool:
+        in_flight = deque()
+        pages_done = 0
+        while ranges or in_flight:
+            while ranges and len(in_flight) < workers * 2:
+                in_flight.append(pool.submit(pdf_worker.extract_pages, *ranges.popleft()))
+            for text in in_flight.popleft().result():
+                pages_done += 1
+                if on_page:
+                    on_page(pages_done, num_pages)
+                yield text
+
+
+def iter_text_blocks(stream, block_size=TEXT_BLOCK_SIZE):
+    """按块增量解码 UTF-8 文本"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        text = decoder.decode(block)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_document_segments(filename, stream, on_page=None):
+    """根据扩展名流式提取文档文本，产出若干文本段（PDF 为逐页，on_page 见 iter_pdf_pages）"""
+    extension = file_extension(filename)
+    if extension in ("txt", "md"):
+        yield from iter_text_blocks(stream)
+    elif extension == "pdf":
+        data = stream.getvalue() if hasattr(stream, "getvalue") else stream.read()
+        yield from iter_pdf_pages(data, on_page=on_page)
+    elif extension in ("docx", "doc"):
+        # 直接从内存缓冲区解析，不再写临时文件
+        yield docx2txt.process(stream)
+    else:
+        raise UnsupportedFormatError(f"不支持的文件格式: {extension}")
@@ -0,0 +1,141 @@
+"""后台导入任务：上传文件的提取 → 切分 → 向量化 → 写索引在工作线程池中执行
+
+每个文件是一个任务，带有状态、进度、错误信息，排队或运行中的任务可以取消。
+任务完成时新文档的片段一次性并入会话的索引，检索不会等待导入，也不会看到写了一半的文档。
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class IngestCancelled(Exception):
+    """导入任务被取消"""
+
+
+class IngestJob:
+    """一个文件的导入任务"""
+
+    def __init__(self, session_id, filename, size=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.filename = filename
+        self.size = size
+        self.status = QUEUED
+        # 已读取的字节比例（0~1）和已向量化的片段数
+        self.progress = 0.0
+        self.chunks = 0
+        self.error = None
+        self.file_info = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def check_cancelled(self):
+        """在导入的各个步骤之间调用；已请求取消时抛出 IngestCancelled"""
+        if self.cancel_event.is_set():
+            raise IngestCancelled(f"已取消导入 {self.filename}")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "size": self.size,
+            "status": self.status,
+            "progress": self.progress,
+            "chunks": self.chunks,
+            "error": self.error,
+            "file_info": self.file_info,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestQueue:
+    """按会话记录导入任务，在有界线程池中执行
+
+    每个会话最多保留 max_finished 个已结束的任务，更早的自动丢弃。
+    """
+
+    def __init__(self, max_workers=2, max_finished=50):
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job, run):
+        """把任务加入队列；run(job) 在工作线程中执行并返回文件信息"""
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune(job.session_id)
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def _run(self, job, run):
+        try:
+            job.check_cancelled()
+            job.status = RUNNING
+            job.file_info = run(job)
+            job.progress = 1.0
+            job.status = DONE
+        except IngestCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self, session_id):
+        finished = [job for job in self._jobs.values() if job.session_id == session_id and job.finished]
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.job_id]
+
+    def jobs(self, session_id):
+        """会话的全部任务，按提交顺序"""
+        with self._lock:
+            return [job for job in self._jobs.values() if job.session_id == session_id]
+
+    def get(self, session_id, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.session_id == session_id else None
+
+    def cancel(self, session_id, job_id):
+        """请求取消任务；运行中的任务在下一个检查点停止，已写入的部分不会并入索引"""
+        job = self.get(session_id, job_id)
+        if job is not None and not job.finished:
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+        return job
+
+    def cancel_all(self, session_id):
+        for job in self.jobs(session_id):
+            self.cancel(session_id, job.job_id)
+
+    def clear_finished(self, session_id):
+        """丢弃会话中已结束的任务记录"""
+        with self._lock:
+            for job in [job for job in self._jobs.values() if job.session_id == session_id and job.finished]:
+                del self._jobs[job.job_id]
+
+    def forget(self, session_id):
+        """取消并丢弃会话的全部任务（会话被删除时调用）"""
+        self.cancel_all(session_id)
+        with self._lock:
+            for job in [job for job in self._jobs.values() if job.session_id == session_id]:
+                del self._jobs[job.job_id]
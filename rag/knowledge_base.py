@@ -0,0 +1,468 @@
+"""版本化知识库：只读的内置语料索引 + 按文档来源增量维护的上传文档索引"""
+import hashlib
+import logging
+import re
+import threading
+import time
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+
+from rag.embedding_cache import embedding_model_name
+from rag.sparse_index import SparseIndex, is_keyword_query, reciprocal_rank_fusion
+from rag.tracing import span
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_MODES = ("hybrid", "dense", "sparse")
+# 提取 PDF 时写入的页码标记（见 rag.pdf_worker.format_pdf_page）
+PAGE_MARKER_PATTERN = re.compile(r"\[第(\d+)页\]")
+# 章节标题：Markdown 标题；纯文本规章中独占一行的“第X章 ……”、以“办法/规定/细则/标准”结尾的标题，
+# 以及“政治思想”“学习情况”这样的短类别行（与 rag.rule_table 解析的结构一致）
+HEADING_PATTERN = re.compile(
+    r"^(?:#{1,6}[ \t]+(?P<markdown>.+?)[ \t#]*"
+    r"|(?P<title>第[一二三四五六七八九十百]+[章节][ \t]*[^\n。；，,]{1,30}|[^\n。；，,：:（(]{2,40}(?:办法|规定|细则|标准))"
+    r"|(?P<category>[\u4e00-\u9fff]{2,8}))[ \t]*$",
+    re.MULTILINE,
+)
+
+
+def content_hash(text):
+    """文档内容哈希"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def fingerprint_sources(sources):
+    """计算文档集合的指纹：由 (来源, 内容哈希) 集合决定，与添加顺序无关"""
+    digest = hashlib.sha256()
+    for source, text_hash in sorted(sources.items()):
+        digest.update(f"{source}\0{text_hash}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def make_text_splitter(chunk_size=1000, chunk_overlap=100):
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def source_file(source):
+    """来源中的文件名部分，例如 upload:手册.pdf → 手册.pdf"""
+    return source.split(":", 1)[-1]
+
+
+class ChunkLocator:
+    """按文档顺序为片段推断文件名、页码和所在章节，生成片段的元数据
+
+    页码来自 [第N页] 标记，章节来自 HEADING_PATTERN 识别的标题：片段以标记或标题开头时取它，
+    否则沿用前文中最后出现的一个。
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.file = source_file(source)
+        self.page = None
+        self.section = None
+
+    @staticmethod
+    def _locate(pattern, chunk, current):
+        """返回 (片段开头处的值, 片段结尾处的值)"""
+        matches = list(pattern.finditer(chunk))
+        if not matches:
+            return current, current
+        first, last = matches[0], matches[-1]
+        # 开头处只有空白或页码标记时，认为片段从这个标记或标题开始
+        start = first.group(first.lastgroup or 1) if not PAGE_MARKER_PATTERN.sub("", chunk[:first.start()]).strip() else current
+        return start, last.group(last.lastgroup or 1)
+
+    def metadata(self, chunk):
+        page, self.page = self._locate(PAGE_MARKER_PATTERN, chunk, self.page)
+        section, self.section = self._locate(HEADING_PATTERN, chunk, self.section)
+        if section is not None:
+            # 规章标题中常用全角空格或 em 空格隔开（“第一章\u2003总\u2003则”），统一为一个空格
+            section = " ".join(section.split())
+        return {
+            "source": self.source,
+            "file": self.file,
+            "page": int(page) if page is not None else None,
+            "section": section,
+        }
+
+
+def split_document(text_splitter, source, text):
+    """把一篇文档切分成带来源、页码、章节信息和稳定ID的片段"""
+    chunks = text_splitter.split_text(text)
+    ids = [f"{source}#{i}" for i in range(len(chunks))]
+    locator = ChunkLocator(source)
+    docs = [
+        Document(id=doc_id, page_content=chunk, metadata=locator.metadata(chunk))
+        for doc_id, chunk in zip(ids, chunks)
+    ]
+    return docs, ids
+
+
+def doc_citation(doc):
+    """片段的出处：{file, page, section}，直接取自片段元数据"""
+    metadata = doc.metadata
+    return {
+        "file": metadata.get("file") or source_file(metadata.get("source", "")),
+        "page": metadata.get("page"),
+        "section": metadata.get("section"),
+    }
+
+
+def search_store(store, query_vector, k, positions=None):
+    """在 FAISS 向量库中检索，返回 [(文档, 距离)]
+
+    positions 为允许的向量位置（预过滤）：只对这些向量计算距离，而不是检索后再过滤。
+    """
+    vector = np.asarray([query_vector], dtype=np.float32)
+    if store._normalize_L2:
+        faiss.normalize_L2(vector)
+    if positions is None:
+        distances, indices = store.index.search(vector, k)
+    else:
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.asarray(positions, dtype=np.int64)))
+        distances, indices = store.index.search(vector, min(k, len(positions)), params=params)
+    return [
+        (store.docstore.search(store.index_to_docstore_id[i]), float(distance))
+        for distance, i in zip(distances[0], indices[0]) if i != -1
+    ]
+
+
+class KnowledgeBase:
+    """知识库对象
+
+    内置语料放在只读的 base 索引中（可以是磁盘上内存映射的索引），上传文档放在可变的
+    overlay 索引中：新增文档只向量化该文档，删除文档只删除该文档的向量。
+    每层索引都同时维护一个本地的稀疏（BM25）索引，检索时与向量检索结果做 RRF 融合。
+    设置了 reranker 时融合后多取 rerank_fetch_k 个候选，由交叉编码器重排，
+    只保留得分不低于 rerank_min_score 的前 k 个（可能一个都不保留）。
+    """
+
+    def __init__(self, embeddings, chunk_size=1000, chunk_overlap=100, k=4,
+                 retrieval_mode="hybrid", candidate_k=None,
+                 reranker=None, rerank_fetch_k=30, rerank_min_score=0.2):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"未知的检索模式: {retrieval_mode}")
+        self.embeddings = embeddings
+        self.k = k
+        self.retrieval_mode = retrieval_mode
+        self.reranker = reranker
+        self.rerank_fetch_k = rerank_fetch_k
+        self.rerank_min_score = rerank_min_score
+        # 融合前每一路检索的候选数
+        self.candidate_k = candidate_k or max(k * 3, rerank_fetch_k if reranker is not None else 0)
+        self.last_trace = None
+        self.chunk_size = chunk_size
+        self.text_splitter = make_text_splitter(chunk_size, chunk_overlap)
+        self.base_store = None
+        self.base_sparse = None
+        self.base_sources = {}
+        self.vectorstore = None
+        self.sparse = SparseIndex()
+        # 检索与写入索引互斥（引擎中多个请求可能同时访问同一个知识库）
+        self._lock = threading.RLock()
+        # 来源 -> 内容哈希 / 片段ID列表（仅 overlay 中的文档）
+        self.source_hashes = {}
+        self.source_ids = {}
+        # 片段ID -> overlay 向量库中的位置，用于按文件预过滤；索引变化时失效
+        self._overlay_positions = None
+
+    @property
+    def fingerprint(self):
+        sources = {**self.base_sources, **self.source_hashes}
+        return fingerprint_sources(sources) if sources else None
+
+    @property
+    def version(self):
+        """知识库版本号，用于缓存等场景区分不同的文档集合"""
+        fingerprint = self.fingerprint
+        return fingerprint[:16] if fingerprint else "empty"
+
+    @property
+    def sources(self):
+        """全部来源：内置语料在前，上传文档按添加顺序"""
+        return list(self.base_sources) + list(self.source_ids)
+
+    def scoped_version(self, sources=None):
+        """只包含 sources 中文档的版本号；sources 为 None 时与 version 相同"""
+        if sources is None:
+            return self.version
+        all_sources = {**self.base_sources, **self.source_hashes}
+        selected = {source: all_sources[source] for source in sources if source in all_sources}
+        return fingerprint_sources(selected)[:16] if selected else "empty"
+
+    @property
+    def num_chunks(self):
+        base_chunks = self.base_store.index.ntotal if self.base_store is not None else 0
+        return base_chunks + sum(len(ids) for ids in self.source_ids.values())
+
+    @property
+    def is_empty(self):
+        return self.base_store is None and self.vectorstore is None
+
+    def set_base(self, store, sources, sparse_index=None):
+        """设置只读的内置语料索引；sources 为 {来源: 内容哈希}
+
+        sparse_index 为对应的稀疏索引，未提供时从向量库的文档库构建。
+        向量库必须由与本知识库相同的嵌入模型构建，否则抛出 ValueError。
+        """
+        store_model = embedding_model_name(store.embeddings)
+        if store_model != embedding_model_name(self.embeddings):
+            raise ValueError(f"内置索引由 {store_model} 构建，与知识库的嵌入模型 {embedding_model_name(self.embeddings)} 不一致")
+        self.base_store = store
+        self.base_sparse = sparse_index if sparse_index is not None else SparseIndex.from_vectorstore(store)
+        self.base_sources = dict(sources)
+
+    def split(self, source, text):
+        return split_document(self.text_splitter, source, text)
+
+    def _embed_chunks(self, docs):
+        with span("embed_documents", chunks=len(docs)):
+            return self.embeddings.embed_documents([doc.page_content for doc in docs])
+
+    def _add_chunks(self, docs, ids):
+        if not docs:
+            return
+        # 先在锁外向量化，写入索引时才加锁，避免长时间阻塞检索
+        vectors = self._embed_chunks(docs)
+        with self._lock:
+            self._write_chunks(docs, ids, vectors)
+
+    def _write_chunks(self, docs, ids, vectors):
+        """把已向量化的片段写入 overlay 索引；调用方持有 self._lock"""
+        with span("index_write", chunks=len(docs)):
+            if self.vectorstore is None:
+                self.vectorstore = FAISS.from_embeddings(
+                    list(zip([doc.page_content for doc in docs], vectors)),
+                    self.embeddings,
+                    metadatas=[doc.metadata for doc in docs],
+                    ids=ids,
+                )
+            else:
+                self.vectorstore.add_embeddings(
+                    list(zip([doc.page_content for doc in docs], vectors)),
+                    metadatas=[doc.metadata for doc in docs],
+                    ids=ids,
+                )
+            self.sparse.add_documents(docs, ids)
+            self._overlay_positions = None
+
+    def add_document(self, source, text):
+        """向 overlay 索引追加一篇文档；同一来源内容变化时先删除旧向量"""
+        text_hash = content_hash(text)
+        if self.source_hashes.get(source) == text_hash:
+            return False
+        if source in self.source_ids:
+            self.remove_document(source)
+
+        docs, ids = self.split(source, text)
+        self._add_chunks(docs, ids)
+        self.source_hashes[source] = text_hash
+        self.source_ids[source] = ids
+        return True
+
+    def add_document_stream(self, source, segments, batch_chunks=64, on_progress=None, before_commit=None):
+        """边提取边向量化：逐段切分，每凑满 batch_chunks 个片段就向量化一批
+
+        全部片段向量化完成后才一次性写入索引（同一来源的旧版本在同一步中替换），
+        检索在此之前看到的始终是旧的索引。on_progress(已向量化片段数) 在每批之后调用。
+        before_commit() 在持有索引锁、写入之前调用，抛出异常即放弃写入（用于最后一次检查是否已取消）。
+        返回 (文本总长度, 片段数)；中途出错（包括被取消）时索引保持不变。
+        """
+        digest = hashlib.sha256()
+        ids, pending_docs = [], []
+        staged_docs, staged_vectors = [], []
+        locator = ChunkLocator(source)
+        total_length = 0
+        # 跨段缓冲少量文本，使片段可以跨页，同时内存占用只与缓冲区大小有关
+        buffer = ""
+        buffer_limit = self.chunk_size * 8
+
+        def emit(chunks):
+            for chunk in chunks:
+                chunk_id = f"{source}#{len(ids)}"
+                ids.append(chunk_id)
+                pending_docs.append(Document(id=chunk_id, page_content=chunk, metadata=locator.metadata(chunk)))
+                if len(pending_docs) >= batch_chunks:
+                    flush()
+
+        def flush():
+            if pending_docs:
+                staged_vectors.extend(self._embed_chunks(pending_docs))
+                staged_docs.extend(pending_docs)
+                pending_docs.clear()
+            if on_progress:
+                on_progress(len(staged_docs))
+
+        for segment in segments:
+            digest.update(segment.encode("utf-8"))
+            total_length += len(segment)
+            buffer += segment
+            if len(buffer) >= buffer_limit:
+                chunks = self.text_splitter.split_text(buffer)
+                # 最后一个片段可能不完整，留在缓冲区与后续文本一起切分
+                emit(chunks[:-1])
+                buffer = chunks[-1] if chunks else ""
+        emit(self.text_splitter.split_text(buffer))
+        flush()
+
+        with self._lock:
+            if before_commit:
+                before_commit()
+            if source in self.source_ids:
+                self.remove_document(source)
+            if staged_docs:
+                self._write_chunks(staged_docs, ids, staged_vectors)
+            self.source_hashes[source] = digest.hexdigest()
+            self.source_ids[source] = ids
+        return total_length, len(ids)
+
+    def remove_document(self, source):
+        """按ID删除某个来源的全部向量"""
+        with self._lock:
+            if source not in self.source_ids:
+                return False
+            ids = self.source_ids.pop(source)
+            del self.source_hashes[source]
+            self._overlay_positions = None
+            if not self.source_ids:
+                self.vectorstore = None
+                self.sparse = SparseIndex()
+            elif ids:
+                self.vectorstore.delete(ids)
+                self.sparse.delete(ids)
+            return True
+
+    def sync(self, documents):
+        """把 overlay 同步到给定的 {来源: 文本} 集合，只处理增删改的部分；返回是否有变化"""
+        changed = False
+        for source in [s for s in self.source_ids if s not in documents]:
+            changed |= self.remove_document(source)
+        for source, text in documents.items():
+            changed |= self.add_document(source, text)
+        return changed
+
+    def _scope(self, sources):
+        """按检索范围决定要检索的索引层，返回 [(向量库, 稀疏索引, 允许的片段ID)]
+
+        允许的片段ID为 None 表示整层都在范围内；范围只覆盖部分上传文档时给出这些文档的片段ID。
+        调用方持有 self._lock。
+        """
+        layers = []
+        if self.base_store is not None and (sources is None or any(s in self.base_sources for s in sources)):
+            layers.append((self.base_store, self.base_sparse, None))
+        if self.vectorstore is not None:
+            selected = list(self.source_ids) if sources is None else [s for s in sources if s in self.source_ids]
+            if len(selected) == len(self.source_ids):
+                layers.append((self.vectorstore, self.sparse, None))
+            elif selected:
+                layers.append((self.vectorstore, self.sparse, [i for s in selected for i in self.source_ids[s]]))
+        return layers
+
+    def _positions(self, ids):
+        if self._overlay_positions is None:
+            self._overlay_positions = {
+                doc_id: position for position, doc_id in self.vectorstore.index_to_docstore_id.items()
+            }
+        return [self._overlay_positions[doc_id] for doc_id in ids if doc_id in self._overlay_positions]
+
+    def dense_search(self, question, sources=None):
+        """向量检索：问题只向量化一次，再分别检索各层索引并按距离合并
+
+        sources 限定检索范围（来源列表），在向量检索之前过滤，范围外的向量不参与距离计算。
+        """
+        with self._lock:
+            if not self._scope(sources):
+                return []
+        with span("embed_query"):
+            query_vector = self.embeddings.embed_query(question)
+        scored = []
+        with self._lock, span("vector_search") as attributes:
+            searched = 0
+            for store, _, ids in self._scope(sources):
+                positions = self._positions(ids) if ids is not None else None
+                searched += len(positions) if positions is not None else store.index.ntotal
+                if positions is None or positions:
+                    scored.extend(search_store(store, query_vector, self.candidate_k, positions))
+            attributes["vectors"] = searched
+        scored.sort(key=lambda item: item[1])
+        return [doc for doc, _ in scored[:self.candidate_k]]
+
+    def sparse_search(self, question, sources=None):
+        """稀疏检索：每层索引各返回一个排序列表，完全在本地计算；sources 同 dense_search"""
+        with self._lock, span("sparse_search"):
+            return [
+                index.search(question, k=self.candidate_k, ids=ids)
+                for _, index, ids in self._scope(sources) if index is not None and len(index)
+            ]
+
+    def rerank(self, question, candidates, trace):
+        """交叉编码器重排，只保留得分不低于阈值的前 k 个；重排失败时退回初检的前 k 个"""
+        if not candidates:
+            return []
+        start = time.perf_counter()
+        with span("rerank", candidates=len(candidates)) as attributes:
+            try:
+                scored = self.reranker.rerank(question, candidates)
+            except Exception:
+                logger.exception("重排失败，使用初检结果")
+                scored = None
+            if scored is None:
+                docs = candidates[:self.k]
+            else:
+                docs = [doc for doc, score in scored if score >= self.rerank_min_score][:self.k]
+                attributes.update(scored=len(scored), top_score=scored[0][1] if scored else None)
+            attributes["kept"] = len(docs)
+        trace.update(rerank_ms=(time.perf_counter() - start) * 1000, rerank_candidates=len(candidates),
+                     rerank_kept=len(docs))
+        return docs
+
+    def is_sparse_only(self, question):
+        """该问题是否只走稀疏检索（不请求嵌入接口；稀疏检索无结果时仍会退回向量检索）"""
+        return self.retrieval_mode == "sparse" or (self.retrieval_mode == "hybrid" and is_keyword_query(question))
+
+    def invoke(self, question, mode=None, sources=None):
+        """检索与问题相关的文档片段
+
+        hybrid 模式下关键词式的短查询只走稀疏检索（不请求嵌入接口），稀疏检索无结果时
+        再退回向量检索；其余查询同时做向量和稀疏检索并用 RRF 融合。
+        sources 为来源列表时只检索这些文档（例如选中的上传文件或内置语料），None 为全部。
+        设置了重排模型时结果可能少于 k 个，没有足够相关的片段时为空。
+        每次检索的耗时和各路命中数记录在 last_trace 中。
+        """
+        mode = mode or self.retrieval_mode
+        if mode == "hybrid" and is_keyword_query(question):
+            mode = "sparse"
+        trace = {
+            "mode": mode, "scope": None if sources is None else list(sources),
+            "dense_ms": 0.0, "sparse_ms": 0.0, "dense_hits": 0, "sparse_hits": 0,
+        }
+
+        ranked_lists = []
+        if mode in ("hybrid", "sparse"):
+            start = time.perf_counter()
+            sparse_lists = self.sparse_search(question, sources)
+            trace["sparse_ms"] = (time.perf_counter() - start) * 1000
+            trace["sparse_hits"] = sum(len(ranked) for ranked in sparse_lists)
+            ranked_lists.extend(sparse_lists)
+            if mode == "sparse" and trace["sparse_hits"] == 0:
+                mode = trace["mode"] = "dense"
+
+        if mode in ("hybrid", "dense"):
+            start = time.perf_counter()
+            dense = self.dense_search(question, sources)
+            trace["dense_ms"] = (time.perf_counter() - start) * 1000
+            trace["dense_hits"] = len(dense)
+            ranked_lists.append(dense)
+
+        if self.reranker is None:
+            docs = reciprocal_rank_fusion(ranked_lists, k=self.k)
+        else:
+            docs = self.rerank(question, reciprocal_rank_fusion(ranked_lists, k=self.rerank_fetch_k), trace)
+        trace["total_ms"] = trace["dense_ms"] + trace["sparse_ms"] + trace.get("rerank_ms", 0.0)
+        trace["results"] = [doc.id for doc in docs]
+        self.last_trace = trace
+        return docs
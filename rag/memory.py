@@ -0,0 +1,101 @@
+"""对话记忆压缩：把较早的对话在后台折叠成滚动摘要，提示词中只保留摘要和最近几轮"""
+import threading
+
+from langchain_core.messages import SystemMessage
+
+SUMMARY_PROMPT = (
+    "请把下面的对话内容合并进已有摘要，生成一份新的简洁摘要。\n"
+    "保留用户的身份信息、提到的具体事实、数字、结论和尚未解决的问题，省略寒暄。\n"
+    "直接输出摘要正文，不要添加说明。\n\n"
+    "已有摘要：\n{summary}\n\n"
+    "新增对话：\n{conversation}"
+)
+
+
+def format_conversation(messages):
+    lines = []
+    for message in messages:
+        role = "用户" if message.type == "human" else "助手"
+        lines.append(f"{role}：{message.content}")
+    return "\n".join(lines)
+
+
+class ConversationSummarizer:
+    """维护完整对话历史之上的滚动摘要
+
+    摘要覆盖 chat_history[:summarized_upto]；提示词使用 “摘要 + 之后的消息”。
+    压缩在回答输出完成后于后台线程中进行，不在提问的关键路径上。每次压缩都记录一个
+    检查点，重新生成回答截断历史时回退到不超过截断位置的最近检查点。
+    """
+
+    def __init__(self, llm, keep_last_messages=6, compact_after_messages=4):
+        self.llm = llm
+        self.keep_last_messages = keep_last_messages
+        self.compact_after_messages = compact_after_messages
+        self.summary = ""
+        self.summarized_upto = 0
+        self._checkpoints = [(0, "")]
+        self._generation = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def prompt_messages(self, chat_history):
+        """返回发送给模型的历史：摘要（作为系统消息）加上未被摘要覆盖的最近消息"""
+        with self._lock:
+            upto = min(self.summarized_upto, len(chat_history))
+            summary = self.summary
+        recent = list(chat_history[upto:])
+        if summary:
+            return [SystemMessage(content=f"此前对话的摘要：\n{summary}")] + recent
+        return recent
+
+    def compact_in_background(self, chat_history):
+        """未被摘要覆盖的消息过多时，启动后台线程把较早的部分并入摘要"""
+        with self._lock:
+            target = len(chat_history) - self.keep_last_messages
+            target -= target % 2  # 按问答对对齐
+            if target - self.summarized_upto < self.compact_after_messages:
+                return False
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            start, summary, generation = self.summarized_upto, self.summary, self._generation
+            messages = list(chat_history[start:target])
+            self._thread = threading.Thread(
+                target=self._compact,
+                args=(messages, summary, start, target, generation),
+                daemon=True,
+            )
+            self._thread.start()
+        return True
+
+    def _compact(self, messages, summary, start, target, generation):
+        try:
+            prompt = SUMMARY_PROMPT.format(summary=summary or "（无）", conversation=format_conversation(messages))
+            new_summary = self.llm.invoke(prompt).content.strip()
+        except Exception:
+            # 摘要失败不影响对话，下次回答完成后会再次尝试
+            return
+        with self._lock:
+            # 期间历史被截断或已有其它压缩结果时丢弃本次结果
+            if generation != self._generation or self.summarized_upto != start:
+                return
+            self.summary = new_summary
+            self.summarized_upto = target
+            self._checkpoints.append((target, new_summary))
+
+    def truncate(self, length):
+        """对话历史被截断到 length 条消息后调用，摘要回退到仍然有效的检查点"""
+        with self._lock:
+            self._generation += 1
+            while self._checkpoints[-1][0] > length:
+                self._checkpoints.pop()
+            self.summarized_upto, self.summary = self._checkpoints[-1]
+
+    def reset(self):
+        self.truncate(0)
+
+    def wait(self, timeout=None):
+        """等待正在进行的后台压缩完成（测试和离线评测使用）"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
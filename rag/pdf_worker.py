@@ -0,0 +1,20 @@
+"""PDF 提取工作进程的入口：只依赖 PyPDF2，工作进程导入它时不会加载检索相关的重型依赖"""
+import io
+
+import PyPDF2
+
+_worker_reader = None
+
+
+def format_pdf_page(page_num, page_text):
+    """与原有格式保持一致的页码标记"""
+    return f"\n[第{page_num + 1}页]\n{page_text}"
+
+
+def init_worker(data):
+    global _worker_reader
+    _worker_reader = PyPDF2.PdfReader(io.BytesIO(data))
+
+
+def extract_pages(start, stop):
+    return [format_pdf_page(i, _worker_reader.pages[i].extract_text() or "") for i in range(start, stop)]
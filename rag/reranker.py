@@ -0,0 +1,65 @@
+"""本地交叉编码器重排：对多取回的候选片段逐一与问题打分，只保留相关度足够高的片段
+
+交叉编码器同时读入问题和片段，比向量相似度更准确，但每个候选都要做一次前向计算，
+因此按初检排名分批打分，并受单次延迟预算约束：超出预算后排名靠后、尚未打分的候选直接丢弃。
+"""
+import threading
+import time
+
+DEFAULT_RERANK_MODEL = "BAAI/bge-reranker-base"
+
+
+class CrossEncoderReranker:
+    """在本地 CPU 上运行 transformers 格式的交叉编码器（bge-reranker 等）
+
+    得分为 sigmoid 后的相关度（0~1）；quantize=True 时把线性层动态量化为 int8。
+    """
+
+    def __init__(self, model_name=DEFAULT_RERANK_MODEL, num_threads=0, quantize=False,
+                 max_batch_size=8, max_length=512, time_budget_ms=300):
+        try:
+            import torch
+            from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        except ImportError as e:
+            raise ImportError("本地重排模型需要安装 torch 和 transformers") from e
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        self._torch = torch
+        self._model = model
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model_name = f"{model_name}:int8" if quantize else model_name
+        self.max_batch_size = max_batch_size
+        self.max_length = max_length
+        self.time_budget_ms = time_budget_ms
+        self._lock = threading.Lock()
+
+    def score(self, query, texts):
+        """一批 (问题, 片段) 的相关度"""
+        torch = self._torch
+        inputs = self.tokenizer(
+            [query] * len(texts), texts, padding=True, truncation="only_second",
+            max_length=self.max_length, return_tensors="pt",
+        )
+        with self._lock, torch.inference_mode():
+            logits = self._model(**inputs).logits.view(-1).float()
+        return torch.sigmoid(logits).tolist()
+
+    def rerank(self, query, docs):
+        """按初检排名分批打分，返回按相关度降序的 [(文档, 得分)]
+
+        第一批之后如果已超出延迟预算，剩余候选不再打分，也不出现在结果中。
+        """
+        start = time.perf_counter()
+        scored = []
+        for begin in range(0, len(docs), self.max_batch_size):
+            if scored and (time.perf_counter() - start) * 1000 > self.time_budget_ms:
+                break
+            batch = docs[begin:begin + self.max_batch_size]
+            scored.extend(zip(batch, self.score(query, [doc.page_content for doc in batch])))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored
@@ -0,0 +1,55 @@
+"""检索效果评估：逐条查询统计召回率和耗时，用于比较 dense / sparse / hybrid 三种模式"""
+import time
+
+# 基于测试.md 的示例查询；expected 为应出现在检索结果中的原文片段
+DEFAULT_CASES = [
+    {"question": "旷课", "expected": ["旷课扣5分/次"]},
+    {"question": "记过", "expected": ["记过"]},
+    {"question": "操行成绩85分", "expected": ["操行成绩85分及以上者，方可竞聘学生干部"]},
+    {"question": "上课迟到会扣几分？", "expected": ["上课迟到或早退扣1分/次"]},
+    {"question": "校长奖学金的奖励金额是多少？", "expected": ["奖励金额为每人10000元"]},
+    {"question": "担任班级学生干部能加多少分？", "expected": ["担任班级学生干部（包括寝室长），加6分"]},
+]
+
+
+def recall_at_k(docs, expected):
+    """expected 中有多少比例的片段出现在检索结果里"""
+    if not expected:
+        return 1.0
+    text = "\n".join(doc.page_content for doc in docs)
+    return sum(1 for snippet in expected if snippet in text) / len(expected)
+
+
+def evaluate(knowledge_base, cases=DEFAULT_CASES, modes=("dense", "sparse", "hybrid")):
+    """对每条查询、每种模式检索一次，返回逐条结果列表"""
+    rows = []
+    for case in cases:
+        for mode in modes:
+            start = time.perf_counter()
+            docs = knowledge_base.invoke(case["question"], mode=mode)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            trace = knowledge_base.last_trace or {}
+            rows.append({
+                "question": case["question"],
+                "mode": mode,
+                "effective_mode": trace.get("mode", mode),
+                "recall": recall_at_k(docs, case["expected"]),
+                "latency_ms": elapsed_ms,
+                "dense_ms": trace.get("dense_ms", 0.0),
+                "sparse_ms": trace.get("sparse_ms", 0.0),
+            })
+    return rows
+
+
+def summarize(rows):
+    """按模式汇总平均召回率和平均耗时"""
+    summary = {}
+    for row in rows:
+        item = summary.setdefault(row["mode"], {"queries": 0, "recall": 0.0, "latency_ms": 0.0})
+        item["queries"] += 1
+        item["recall"] += row["recall"]
+        item["latency_ms"] += row["latency_ms"]
+    for item in summary.values():
+        item["recall"] /= item["queries"]
+        item["latency_ms"] /= item["queries"]
+    return summary
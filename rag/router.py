@@ -0,0 +1,155 @@
+"""查询路由：在检索之前用本地规则和一个小型分类模型判断问题类型，决定走哪条处理路径
+
+- chitchat：寒暄闲聊，不检索；问候、感谢、告别等直接用固定回复，其余交给较小的模型
+- lookup：简单的事实查询，检索后交给较小的模型
+- complex：复杂问题，检索后交给主模型
+
+分类模型为字符 n-gram 的 TF-IDF + 逻辑回归，用内置的少量样例在首次使用时训练（毫秒级）。
+模型没有把握时一律按复杂问题处理，保证难题的回答质量不受影响；未安装 scikit-learn 时只用规则。
+"""
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+CHITCHAT = "chitchat"
+LOOKUP = "lookup"
+COMPLEX = "complex"
+ROUTES = (CHITCHAT, LOOKUP, COMPLEX)
+
+_TAIL = r"[呀啊哈呢吧～~！!。.，,\s]*$"
+# 可以直接用固定回复的寒暄：(规则, 回复)
+CANNED_REPLIES = (
+    (re.compile(r"^(你好|您好|嗨|哈喽|hi|hello|hey|早上好|上午好|下午好|晚上好|在吗|在不在)" + _TAIL, re.I),
+     "你好！我可以回答关于已上传文档和内置资料的问题，请直接提问。"),
+    (re.compile(r"^(谢谢|多谢|感谢|谢啦|谢了|thanks|thank you|thx)(你|您|啦|了)?" + _TAIL, re.I),
+     "不客气！还有其他问题随时问我。"),
+    (re.compile(r"^(再见|拜拜|回头见|bye|goodbye)" + _TAIL, re.I),
+     "再见！有问题随时回来问我。"),
+    (re.compile(r"^(好的|好|嗯|嗯嗯|哦|ok|okay|明白了|知道了|收到|了解)" + _TAIL, re.I),
+     "好的，还有其他问题吗？"),
+)
+# 明显需要综合分析的问题
+COMPLEX_CUE_PATTERN = re.compile(r"为什么|为何|区别|比较|对比|分析|总结|概括|解释|建议|优缺点|利弊|影响|关系|原因|步骤|流程")
+
+# 分类模型的训练样例
+TRAINING_EXAMPLES = {
+    CHITCHAT: [
+        "你好", "您好呀", "谢谢你", "太感谢了", "再见", "拜拜", "早上好", "晚安",
+        "你是谁", "你叫什么名字", "你能做什么", "你好厉害", "哈哈哈", "讲个笑话",
+        "今天心情不错", "你是机器人吗", "辛苦了", "好的明白了", "在吗", "你好，请问你能帮我什么",
+    ],
+    LOOKUP: [
+        "旷课扣几分", "迟到一次扣多少分", "操行基本分是多少", "学生干部加几分",
+        "获国家级荣誉加多少分", "校长奖学金的金额是多少", "一等奖学金要求绩点多少",
+        "操行满分多少", "寝室检查不合格扣几分", "奖学金什么时候评定", "抄袭作业扣几分",
+        "警告处分扣多少分", "献血加几分", "创新奖学金奖励多少钱", "学业奖学金分几等",
+        "参加集体活动加几分", "评奖学金需要操行多少分", "见义勇为加几分",
+        "竞聘学生干部的操行要求", "那研究生呢", "宿舍几点熄灯", "补考在什么时候",
+        "教务处在哪里", "夜不归宿会受什么处分", "申请助学金需要什么条件",
+    ],
+    COMPLEX: [
+        "为什么要实行操行考评制度", "校长奖学金和学业奖学金有什么区别",
+        "如何提高自己的操行成绩", "请总结一下操行考评的主要内容", "分析一下奖学金评定的流程",
+        "比较各类荣誉表彰的加分标准", "如果我旷课又获得了荣誉，应该怎么计算最终的操行成绩",
+        "请解释一下一票否决的含义和适用情况", "操行成绩对评优有哪些影响",
+        "给我一些提高绩点和操行分的建议", "申请校长奖学金需要准备哪些材料，流程是怎样的",
+        "学生违纪处分和操行扣分之间是什么关系", "帮我写一份奖学金申请书",
+        "这些规定对大一新生有什么意义", "概括一下文档中关于学习情况的所有规定",
+        "上传的文件主要讲了什么", "对比文档里的两种评定办法", "这份文件的要点有哪些",
+        "怎样才能同时拿到学业奖学金和创新奖学金", "评奖学金时操行和绩点哪个更重要，为什么",
+    ],
+}
+
+
+@dataclass
+class RouteDecision:
+    """一次路由的结果；reply 不为空时直接用作回答"""
+
+    route: str
+    confidence: float
+    reason: str
+    reply: str = None
+    latency_ms: float = 0.0
+
+    def to_dict(self):
+        return {
+            "route": self.route,
+            "confidence": round(self.confidence, 3),
+            "reason": self.reason,
+            "canned": self.reply is not None,
+            "latency_ms": round(self.latency_ms, 3),
+        }
+
+
+class QueryRouter:
+    """规则 + 小型分类模型的查询路由
+
+    min_confidence 为采用模型结论的最低概率；闲聊不做检索，判错的代价更大，要求不低于
+    chitchat_min_confidence。complex_min_chars 以上的长问题直接按复杂问题处理。
+    """
+
+    def __init__(self, min_confidence=0.5, chitchat_min_confidence=0.75, complex_min_chars=60, examples=None):
+        self.min_confidence = min_confidence
+        self.chitchat_min_confidence = chitchat_min_confidence
+        self.complex_min_chars = complex_min_chars
+        self.examples = examples or TRAINING_EXAMPLES
+        self._model = None
+        self._model_ready = False
+        self._lock = threading.Lock()
+
+    def _classifier(self):
+        """首次使用时训练分类模型；未安装 scikit-learn 时返回 None"""
+        with self._lock:
+            if not self._model_ready:
+                self._model_ready = True
+                try:
+                    from sklearn.feature_extraction.text import TfidfVectorizer
+                    from sklearn.linear_model import LogisticRegression
+                    from sklearn.pipeline import make_pipeline
+                except ImportError:
+                    logger.warning("未安装 scikit-learn，查询路由只使用规则")
+                    return None
+                texts = [text for route in ROUTES for text in self.examples.get(route, [])]
+                labels = [route for route in ROUTES for _ in self.examples.get(route, [])]
+                model = make_pipeline(
+                    TfidfVectorizer(analyzer="char_wb", ngram_range=(1, 3), sublinear_tf=True),
+                    LogisticRegression(C=10, max_iter=1000),
+                )
+                self._model = model.fit(texts, labels)
+            return self._model
+
+    def warm_up(self):
+        """提前训练分类模型，避免第一个请求承担训练耗时"""
+        self._classifier()
+        return self
+
+    def _classify(self, question):
+        """返回 (路由, 置信度, 依据, 固定回复)"""
+        for pattern, reply in CANNED_REPLIES:
+            if pattern.match(question):
+                return CHITCHAT, 1.0, "rule", reply
+        if len(question) >= self.complex_min_chars or len(re.findall(r"[？?]", question)) > 1:
+            return COMPLEX, 1.0, "rule", None
+        if COMPLEX_CUE_PATTERN.search(question):
+            return COMPLEX, 1.0, "rule", None
+        model = self._classifier()
+        if model is None:
+            return COMPLEX, 0.0, "fallback", None
+        probabilities = model.predict_proba([question])[0]
+        best = probabilities.argmax()
+        route, confidence = str(model.classes_[best]), float(probabilities[best])
+        threshold = self.chitchat_min_confidence if route == CHITCHAT else self.min_confidence
+        if confidence < threshold:
+            # 没有把握时按复杂问题处理
+            return COMPLEX, confidence, "fallback", None
+        return route, confidence, "model", None
+
+    def route(self, question):
+        start = time.perf_counter()
+        decision = RouteDecision(*self._classify(question.strip()))
+        decision.latency_ms = (time.perf_counter() - start) * 1000
+        return decision
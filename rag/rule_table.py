@@ -0,0 +1,412 @@
+"""操行考评细则的规则表：从文档中解析记分条款和分数门槛，直接回答分值、门槛和简单的计分问题
+
+规则表在加载内置语料时构建（毫秒级），回答时只做本地的字符串匹配，不调用嵌入接口和大模型。
+只回答有把握的问题；匹配不到条款、匹配有歧义或无法计算时返回 None，由问答链处理。
+
+命令行用法（查看解析结果）：
+    python -m rag.rule_table 测试.md
+"""
+import argparse
+import json
+import re
+from dataclasses import asdict, dataclass
+
+# 折行的长度下限：较长且没有以句末标点结尾的行与下一行拼接（从 PDF 转换来的文本常在句中折行）
+WRAP_MIN_LENGTH = 30
+SENTENCE_END = ("。", "；", ";", "：", ":", "！", "？")
+NUMBERED_PATTERN = re.compile(r"^(\d+)[.、．]\s*")
+CLAUSE_PATTERN = re.compile(r"^（[一二三四五六七八九十]+）")
+CHAPTER_PATTERN = re.compile(r"^第[一二三四五六七八九十]+章\s*(.+)$")
+ARTICLE_PATTERN = re.compile(r"^第[一二三四五六七八九十]+条\s*(.+)$")
+# 记分条款：加/扣 N 分（可带 /次、/项），分值可以是范围（30～60）或与“分别”搭配的列表（20、30、40）
+POINTS_PATTERN = re.compile(
+    r"(?P<veto>一票否决)"
+    r"|(?P<each>分别)?(?P<direction>加|扣)(?P<points>\d+(?:[、，,]\d+)+|\d+(?:[～~－-]\d+)?)分(?:/(?P<unit>次|项))?"
+)
+THRESHOLD_PATTERN = re.compile(
+    r"(?P<subject>操行(?:考评)?成绩|平均绩点)(?:达到)?\s*(?P<sign>≥|>=)?\s*(?P<value>\d+(?:\.\d+)?)分?(?P<comparison>及以上|以上)?"
+)
+BASE_SCORE_PATTERN = re.compile(r"基本分(\d+)分")
+MAX_ADJUSTMENT_PATTERN = re.compile(r"总和不超过(\d+)分")
+FULL_SCORE_PATTERN = re.compile(r"满分为(\d+)分")
+
+# 问题中的次数（“旷课2次”“获校级学习类荣誉一项”）和与条款内容无关的提问用语
+COUNT_PATTERN = re.compile(r"(\d+|[一二两三四五六七八九十]+)\s*(?:次|项|回)")
+QUESTION_FILLER_PATTERN = re.compile(
+    r"操行(?:考评)?成绩|操行分?|(?:扣|加)(?:几|多少)分|几分|多少分?|一共|总共|合计|总分|最后|"
+    r"怎么算|怎么|如何|会被|会|被|要|了|的|吗|呢|我|如果|那么|每次|扣分|加分|请问|是|得|算"
+)
+QUESTION_SPLIT_PATTERN = re.compile(r"[，,。；;？?！!、\s]|以及|和|还有|另外|并且")
+# 问题涉及分数时才尝试规则表
+SCORE_CUE_PATTERN = re.compile(r"分|绩点|扣|加|操行|次|项|一票否决|门槛|条件|竞聘|参评")
+THRESHOLD_CUE_PATTERN = re.compile(r"多少分|几分|绩点|条件|要求|门槛|才能|方可|可以")
+# 比较和资格判断（“有什么区别”“哪个扣分更多”“还能评奖学金吗”）需要综合多条规定，不由规则表回答
+COMPARISON_CUE_PATTERN = re.compile(r"区别|不同|哪(?:个|种|项)?.*更|能不能|能否|还能|可不可以|可以.*吗")
+TOTAL_CUE_PATTERN = re.compile(r"操行|总|成绩|最后|合计|一共")
+# 问题问的是哪一类门槛：绩点或操行成绩
+GPA_CUE_PATTERN = re.compile(r"绩点|GPA", re.I)
+CONDUCT_CUE_PATTERN = re.compile(r"操行")
+CHINESE_DIGITS = {"一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+
+MIN_MATCH_SCORE = 0.6
+MAX_THRESHOLD_ANSWERS = 3
+
+
+@dataclass
+class ScoreRule:
+    """一条记分条款；points 为带符号的分值（扣分为负），范围分值的另一端为 points_max"""
+
+    category: str
+    behavior: str
+    points: int = None
+    points_max: int = None
+    unit: str = None
+    veto: bool = False
+    text: str = ""
+
+    def describe(self):
+        if self.veto:
+            return f"{self.behavior}：一票否决，操行基本分为0分"
+        direction = "加" if self.points > 0 else "扣"
+        points = f"{abs(self.points)}～{abs(self.points_max)}" if self.points_max is not None else f"{abs(self.points)}"
+        unit = f"/{self.unit}" if self.unit else ""
+        return f"{self.behavior}：{direction}{points}分{unit}"
+
+
+@dataclass
+class ScoreThreshold:
+    """分数门槛，例如 操行成绩 85 分及以上方可竞聘学生干部"""
+
+    subject: str
+    value: float
+    purpose: str
+    condition: str = ""
+    text: str = ""
+
+    def describe(self):
+        value = f"{self.value:g}分" if self.subject.startswith("操行") else f"{self.value:.1f}"
+        condition = f"（{self.condition}）" if self.condition else ""
+        return f"{self.purpose}：{self.subject}{value}及以上{condition}"
+
+
+def logical_lines(text):
+    """去掉空行，并把折行拼回完整的句子"""
+    lines = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if (lines and len(lines[-1]) >= WRAP_MIN_LENGTH and not lines[-1].endswith(SENTENCE_END)
+                and not NUMBERED_PATTERN.match(line) and not CLAUSE_PATTERN.match(line)):
+            lines[-1] += line
+        else:
+            lines.append(line)
+    return lines
+
+
+def is_category_heading(line):
+    """记分标准中的类别标题，例如“政治思想”“学习情况”"""
+    return len(line) <= 8 and not re.search(r"[\d，。；：:、\s]", line)
+
+
+def clean_behavior(text):
+    return text.strip("，,。；;：: ").removeprefix("的").removesuffix("的").strip()
+
+
+def split_lead_in(behavior, following):
+    """从“说明文字 + 第一条条款”中取出条款部分，无法定位时返回空字符串
+
+    同一行的条款通常并列书写（“参加学院组织的……；参加学校组织的……”），按下一条条款的开头定位。
+    """
+    prefix = following[:2]
+    position = behavior.rfind(prefix) if len(prefix) == 2 else -1
+    return behavior[position:] if position > 0 else ""
+
+
+def parse_rules(line, category, lead_in=False):
+    """解析一行中的全部记分条款
+
+    lead_in 为 True 时行首是类别名和说明文字（“集体活动积极参加……参加学院组织的集体活动，加1分/次”），
+    说明文字与第一条条款之间没有标点，用 split_lead_in 切分；切分不出来时跳过这一条。
+    """
+    body = NUMBERED_PATTERN.sub("", line)
+    segments, start = [], 0
+    for match in POINTS_PATTERN.finditer(body):
+        segments.append((clean_behavior(body[start:match.start()]), match))
+        start = match.end()
+    if lead_in and segments:
+        following = segments[1][0] if len(segments) > 1 else ""
+        segments[0] = (split_lead_in(segments[0][0], following), segments[0][1])
+
+    rules = []
+    for behavior, match in segments:
+        if match.group("veto"):
+            rules.append(ScoreRule(category, behavior, veto=True, text=body))
+            continue
+        sign = 1 if match.group("direction") == "加" else -1
+        points, unit = match.group("points"), match.group("unit")
+        values = re.split(r"[、，,]", points)
+        if len(values) > 1:
+            # “警告、严重警告、记过、留校察看处分，分别扣20、30、40、50分/次”
+            suffix = "处分" if behavior.endswith("处分") else ""
+            items = behavior.removesuffix(suffix).split("、")
+            if len(items) == len(values):
+                rules.extend(
+                    ScoreRule(category, item + suffix, sign * int(value), unit=unit, text=body)
+                    for item, value in zip(items, values)
+                )
+            continue
+        low, high = (re.split(r"[～~－-]", points) + [""])[:2]
+        rules.append(ScoreRule(
+            category, behavior, sign * int(low), sign * int(high) if high else None, unit=unit, text=body,
+        ))
+    return [rule for rule in rules if rule.behavior]
+
+
+def section_of_title(line):
+    """从“XX学院校长奖学金评定办法”这样的标题中取出“校长奖学金”"""
+    return re.sub(r"(评定|管理)?办法$", "", re.sub(r"^.*?(学院|大学)", "", line)).removeprefix("普通本科学生")
+
+
+def parse_thresholds(line, section, condition):
+    thresholds = []
+    for match in THRESHOLD_PATTERN.finditer(line):
+        if not match.group("sign") and not match.group("comparison"):
+            continue
+        if "方可" in line:
+            purpose = line.split("方可", 1)[1].strip("。；; ")
+        else:
+            label = re.match(r"^（[一二三四五六七八九十]+）([^：:，,]{2,12})[：:]", line)
+            purpose = f"{label.group(1)}（{section}）" if label and section else (label.group(1) if label else section)
+        if purpose:
+            thresholds.append(ScoreThreshold(match.group("subject"), float(match.group("value")), purpose, condition, line))
+    return thresholds
+
+
+def bigrams(text):
+    text = re.sub(r"[\W_]+", "", text)
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def parse_count(text):
+    if text.isdigit():
+        return int(text)
+    if text == "十":
+        return 10
+    if text.startswith("十"):
+        return 10 + CHINESE_DIGITS.get(text[1:], 0)
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        return CHINESE_DIGITS.get(tens, 1) * 10 + CHINESE_DIGITS.get(ones, 0)
+    return CHINESE_DIGITS.get(text, 1)
+
+
+class RuleTable:
+    """记分条款和分数门槛的索引表"""
+
+    def __init__(self, rules, thresholds, base_score=None, max_adjustment=None, full_score=None, source=""):
+        self.rules = rules
+        self.thresholds = thresholds
+        self.base_score = base_score
+        self.max_adjustment = max_adjustment
+        self.full_score = full_score
+        self.source = source
+        # 预先计算条款和门槛的字符二元组，查询时只做集合运算
+        self._rule_bigrams = [bigrams(rule.behavior) for rule in rules]
+        self._threshold_bigrams = [bigrams(threshold.purpose) for threshold in thresholds]
+
+    def __len__(self):
+        return len(self.rules) + len(self.thresholds)
+
+    @classmethod
+    def from_text(cls, text, source=""):
+        rules, thresholds = [], []
+        category, section, condition = "", "", ""
+        after_numbered = False
+        for line in logical_lines(text):
+            chapter = CHAPTER_PATTERN.match(line)
+            article = ARTICLE_PATTERN.match(line)
+            numbered = NUMBERED_PATTERN.match(line)
+            lead_in = False
+            if chapter:
+                section, condition = re.sub(r"\s+", "", chapter.group(1)), ""
+            elif line.endswith("办法"):
+                section, condition = section_of_title(line), ""
+            elif article:
+                condition = article.group(1)[:30] if "条件" in article.group(1) else ""
+            elif is_category_heading(line):
+                category = line
+            elif not numbered and after_numbered:
+                # 类别名与说明文字合在一行（“生活习惯艰苦朴素……”），取开头的四个字作为类别
+                category, lead_in = line[:4], True
+            after_numbered = bool(numbered)
+            rules.extend(parse_rules(line, category, lead_in))
+            thresholds.extend(parse_thresholds(line, section, condition))
+
+        def first_int(pattern):
+            match = pattern.search(text)
+            return int(match.group(1)) if match else None
+
+        return cls(rules, thresholds, first_int(BASE_SCORE_PATTERN), first_int(MAX_ADJUSTMENT_PATTERN),
+                   first_int(FULL_SCORE_PATTERN), source)
+
+    @classmethod
+    def from_file(cls, path, source=None):
+        with open(path, "r", encoding="utf-8") as file:
+            return cls.from_text(file.read(), source or f"base:{path}")
+
+    def to_dict(self):
+        return {
+            "source": self.source,
+            "base_score": self.base_score,
+            "max_adjustment": self.max_adjustment,
+            "full_score": self.full_score,
+            "rules": [asdict(rule) for rule in self.rules],
+            "thresholds": [asdict(threshold) for threshold in self.thresholds],
+        }
+
+    # ---------- 查询 ----------
+    def match_rules(self, clause):
+        """与问题片段最匹配的条款（可能有多条并列，已去重）；没有足够匹配时返回空列表"""
+        query = bigrams(QUESTION_FILLER_PATTERN.sub("", COUNT_PATTERN.sub("", clause)))
+        if not query:
+            return []
+        best, matches = MIN_MATCH_SCORE, []
+        for rule, rule_bigrams in zip(self.rules, self._rule_bigrams):
+            # 问题片段被条款覆盖的比例；并列的条款全部返回，由调用方判断是否有歧义
+            score = len(query & rule_bigrams) / len(query)
+            if score > best:
+                best, matches = score, [rule]
+            elif score == best and matches:
+                matches.append(rule)
+        unique = {}
+        for rule in matches:
+            unique.setdefault((rule.behavior, rule.points, rule.points_max, rule.unit, rule.veto), rule)
+        return list(unique.values())
+
+    def match_thresholds(self, question):
+        """与问题最匹配的用途下的门槛；匹配不到或有多个用途并列时返回空列表
+
+        问题提到绩点或操行时只看对应的门槛。用途按与问题共有的二元组数排序，越具体的用途
+        （“一等奖学金（学业奖学金）”）排在越笼统的（“学业奖学金”）前面。
+        """
+        gpa, conduct = GPA_CUE_PATTERN.search(question), CONDUCT_CUE_PATTERN.search(question)
+        query = bigrams(question)
+        scored = []
+        for threshold, purpose in zip(self.thresholds, self._threshold_bigrams):
+            is_gpa = threshold.subject == "平均绩点"
+            if (gpa and not conduct and not is_gpa) or (conduct and not gpa and is_gpa):
+                continue
+            scored.append((len(query & purpose), len(purpose), threshold))
+        best = max((shared for shared, _, _ in scored), default=0)
+        matches = [(size, threshold) for shared, size, threshold in scored if shared == best]
+        if not best or len({threshold.purpose for _, threshold in matches}) > 1:
+            return []
+        size, _ = matches[0]
+        if best / (size or 1) < MIN_MATCH_SCORE:
+            return []
+        return [threshold for _, threshold in matches]
+
+    def citations(self, sections):
+        """回答的出处：规则所在的类别或门槛的用途，去重后保持顺序"""
+        return [
+            {"file": self.source.split(":", 1)[-1], "page": None, "section": section or None}
+            for section in dict.fromkeys(sections)
+        ]
+
+    def answer(self, question):
+        """返回 (回答文本, 出处列表)；没有把握时返回 None"""
+        if not SCORE_CUE_PATTERN.search(question) or COMPARISON_CUE_PATTERN.search(question):
+            return None
+        clauses, unmatched = [], False
+        for part in QUESTION_SPLIT_PATTERN.split(question):
+            if not part:
+                continue
+            count = COUNT_PATTERN.search(part)
+            rules = self.match_rules(part)
+            if rules:
+                clauses.append((rules, parse_count(count.group(1)) if count else None))
+            elif count:
+                # 问到了次数却匹配不到条款，无法准确计分
+                return None
+            elif bigrams(QUESTION_FILLER_PATTERN.sub("", part)):
+                # 去掉提问用语后还有内容却匹配不到条款，问题不只是问分值
+                unmatched = True
+
+        if clauses and unmatched:
+            return None
+        if not clauses:
+            if not THRESHOLD_CUE_PATTERN.search(question):
+                return None
+            thresholds = self.match_thresholds(question)
+            if not thresholds or len(thresholds) > MAX_THRESHOLD_ANSWERS:
+                return None
+            lines = [threshold.describe() for threshold in thresholds]
+            text = "根据规定：\n" + "\n".join(f"- {line}" for line in lines)
+            return text, self.citations(threshold.purpose for threshold in thresholds)
+
+        if all(count is None for _, count in clauses) and (len(clauses) == 1 or not TOTAL_CUE_PATTERN.search(question)):
+            # 只问分值（可以同时问几条）：直接列出条款
+            rules = []
+            for clause_rules, _ in clauses:
+                rules.extend(rule for rule in clause_rules if rule not in rules)
+            text = "根据操行考评记分标准：\n" + "\n".join(f"- {rule.describe()}（{rule.category}）" for rule in rules)
+            if any(len(clause_rules) > 1 for clause_rules, _ in clauses):
+                # 多条并列时附上原文，便于区分（例如不同级别的“担任干事”）
+                text += "\n\n原文：\n" + "\n".join(f"- {line}" for line in dict.fromkeys(rule.text for rule in rules))
+            return text, self.citations(rule.category for rule in rules)
+        return self._calculate(question, clauses)
+
+    def _calculate(self, question, clauses):
+        """按次数计分；条款有歧义或分值为范围时无法计算，返回 None"""
+        lines, total, veto = [], 0, False
+        for rules, count in clauses:
+            if len(rules) > 1 or rules[0].points_max is not None:
+                return None
+            rule = rules[0]
+            if rule.veto:
+                veto = True
+                lines.append(f"- {rule.describe()}")
+                continue
+            count = count or 1
+            subtotal = rule.points * count
+            total += subtotal
+            direction = "加" if subtotal > 0 else "扣"
+            lines.append(f"- {rule.behavior} ×{count}：{direction}{abs(subtotal)}分（{rule.describe().split('：')[-1]}）")
+
+        # 只有问到总分或操行成绩时才计算合计，分别查询几条条款时只列出分值
+        show_total = TOTAL_CUE_PATTERN.search(question)
+        citations = self.citations(rules[0].category for rules, _ in clauses)
+        if not show_total or self.base_score is None:
+            return "根据操行考评记分标准：\n" + "\n".join(lines), citations
+        if veto:
+            summary = "存在一票否决的情形，操行基本分为0分。"
+        else:
+            adjustment = total
+            if self.max_adjustment is not None:
+                adjustment = max(-self.max_adjustment, min(self.max_adjustment, total))
+            score = max(0, self.base_score + adjustment)
+            if self.full_score is not None:
+                score = min(score, self.full_score)
+            capped = f"（每学年加分和扣分总和不超过{self.max_adjustment}分）" if adjustment != total else ""
+            summary = f"加减分合计 {total:+d} 分{capped}，操行成绩为 {score} 分。"
+        text = f"按操行基本分{self.base_score}分计算：\n" + "\n".join(lines) + "\n\n" + summary
+        return text, citations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="解析文档中的操行记分条款和分数门槛")
+    parser.add_argument("document", nargs="?", default="测试.md")
+    parser.add_argument("--ask", default=None, help="用规则表回答一个问题")
+    args = parser.parse_args(argv)
+    table = RuleTable.from_file(args.document)
+    if args.ask:
+        result = table.answer(args.ask)
+        print(result[0] if result else "（规则表无法回答，将交给问答链）")
+    else:
+        print(json.dumps(table.to_dict(), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+"""问答引擎的 HTTP 服务：asyncio + SSE 流式输出，可独立部署和直接压测
+
+会话（对话历史、上传文件的索引、导入任务）保存在进程内存中。多进程（uvicorn --workers）或多实例部署时，
+同一会话的请求必须落到同一个进程：只用一个 worker，或在负载均衡上按路径中的 session_id 做粘性路由，
+否则请求会落到没有该会话的进程，丢失对话历史和已上传的文件。
+
+用法：
+    python -m rag.server --host 0.0.0.0 --port 8000
+    QA_ENGINE_URL=http://127.0.0.1:8000 streamlit run streamlit_app.py
+"""
+import argparse
+import json
+from typing import List, Optional
+
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from rag.engine import QAEngine
+from rag.extraction import UnsupportedFormatError
+
+
+class AskRequest(BaseModel):
+    question: str
+    use_cache: bool = True
+    reuse_context: bool = False
+    # 检索范围（来源列表），为空时检索全部文档
+    sources: Optional[List[str]] = None
+
+
+class TruncateRequest(BaseModel):
+    length: int
+
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def create_app(engine=None):
+    """创建 FastAPI 应用；engine 默认按环境变量配置创建"""
+    app = FastAPI(title="智能问答引擎")
+    app.state.engine = engine or QAEngine()
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics():
+        # Prometheus 文本格式
+        return PlainTextResponse(app.state.engine.metrics_text(), media_type="text/plain; version=0.0.4")
+
+    @app.post("/sessions/{session_id}/ask")
+    async def ask(session_id: str, request: AskRequest):
+        engine = app.state.engine
+
+        def start_event(info):
+            # 回答开始：客户端读到这个事件后即可知道是否命中缓存、走了哪条路由
+            return sse_event({
+                "type": "start", "cached": info.get("cached", False), "route": info.get("route"),
+                "trace_id": info.get("trace_id"),
+            })
+
+        async def events():
+            parts, info = [], {}
+            try:
+                async for token in engine.astream_answer(
+                        session_id, request.question, request.use_cache, info,
+                        reuse_context=request.reuse_context, sources=request.sources,
+                ):
+                    if not parts:
+                        yield start_event(info)
+                    parts.append(token)
+                    yield sse_event({"type": "token", "text": token})
+            except Exception as e:
+                yield sse_event({"type": "error", "message": str(e)})
+                return
+            if not parts:
+                yield start_event(info)
+            yield sse_event({
+                "type": "done", "answer": "".join(parts), "cached": info.get("cached", False),
+                "route": info.get("route"), "citations": info.get("citations", []),
+            })
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.get("/sessions/{session_id}/history")
+    def history(session_id: str):
+        return app.state.engine.history(session_id)
+
+    @app.post("/sessions/{session_id}/history/truncate")
+    def truncate_history(session_id: str, request: TruncateRequest):
+        app.state.engine.truncate_history(session_id, request.length)
+        return {"length": request.length}
+
+    @app.delete("/sessions/{session_id}/history")
+    def clear_history(session_id: str):
+        app.state.engine.clear_history(session_id)
+        return {"length": 0}
+
+    # 上传处理是阻塞的（提取 + 向量化），使用普通函数让 FastAPI 放到线程池中执行
+    @app.post("/sessions/{session_id}/files")
+    def upload(session_id: str, file: UploadFile = File(...)):
+        try:
+            return app.state.engine.ingest(session_id, file.filename, file.file, size=file.size)
+        except (UnsupportedFormatError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # 后台导入：上传后立即返回任务，之后轮询任务状态
+    @app.post("/sessions/{session_id}/jobs", status_code=202)
+    def submit_ingest(session_id: str, file: UploadFile = File(...)):
+        return app.state.engine.submit_ingest(session_id, file.filename, file.file.read(), size=file.size)
+
+    @app.get("/sessions/{session_id}/jobs")
+    def ingest_jobs(session_id: str):
+        return app.state.engine.ingest_jobs(session_id)
+
+    @app.delete("/sessions/{session_id}/jobs/{job_id}")
+    def cancel_ingest(session_id: str, job_id: str):
+        job = app.state.engine.cancel_ingest(session_id, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+        return job
+
+    @app.delete("/sessions/{session_id}/jobs")
+    def clear_ingest_jobs(session_id: str):
+        app.state.engine.clear_ingest_jobs(session_id)
+        return {"removed": "finished"}
+
+    @app.get("/sessions/{session_id}/files")
+    def list_files(session_id: str):
+        return app.state.engine.files(session_id)
+
+    @app.get("/sessions/{session_id}/sources")
+    def list_sources(session_id: str):
+        return app.state.engine.sources(session_id)
+
+    @app.delete("/sessions/{session_id}/files/{filename}")
+    def remove_file(session_id: str, filename: str):
+        app.state.engine.remove_file(session_id, filename)
+        return {"removed": filename}
+
+    @app.delete("/sessions/{session_id}/files")
+    def clear_files(session_id: str):
+        app.state.engine.clear_files(session_id)
+        return {"removed": "all"}
+
+    @app.get("/stats")
+    def stats():
+        return app.state.engine.stats()
+
+    @app.get("/sessions/{session_id}/stats")
+    def session_stats(session_id: str):
+        return app.state.engine.stats(session_id)
+
+    @app.delete("/sessions/{session_id}")
+    def drop_session(session_id: str):
+        app.state.engine.drop_session(session_id)
+        return {"dropped": session_id}
+
+    return app
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="启动问答引擎 HTTP 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    uvicorn.run(create_app(), host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
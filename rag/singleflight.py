@@ -0,0 +1,146 @@
+"""进程内的请求合并（singleflight）：相同的并发问题只做一次检索和一次生成，token 流分发给所有等待者
+
+第一个请求启动共享流，由后台线程拉取底层 token 流并缓存全部已产出的 token；之后到达的相同请求
+订阅同一个共享流，先回放已缓存的 token，再随生成进度继续输出。共享流结束后即从表中移除，
+之后的相同问题走正常流程（通常会命中回答缓存）。
+"""
+import asyncio
+import re
+import threading
+
+_SPACES = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?？。.!！~～"
+
+
+def normalize_question(question):
+    """用于合并请求的问题规范化：去掉空白和结尾的标点，英文统一小写"""
+    return _SPACES.sub("", question).rstrip(_TRAILING_PUNCTUATION).lower()
+
+
+class SharedStream:
+    """被多个订阅者共享的 token 流
+
+    后台线程拉取 source 直到结束，与订阅者的消费速度无关：某个订阅者中途离开不影响其他订阅者。
+    state 为发起者附带的任意对象（例如记录检索结果的 TurnContext），供订阅者在流结束后读取。
+    """
+
+    def __init__(self, source, state=None, on_done=None):
+        self.state = state
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self._listeners = []
+        self._condition = threading.Condition()
+        self._on_done = on_done
+        self._thread = threading.Thread(target=self._pump, args=(source,), daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _pump(self, source):
+        try:
+            for token in source:
+                with self._condition:
+                    self.tokens.append(token)
+                    listeners = list(self._listeners)
+                    self._condition.notify_all()
+                for listener in listeners:
+                    listener()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._condition:
+                self.done = True
+                listeners = list(self._listeners)
+                self._condition.notify_all()
+            for listener in listeners:
+                listener()
+            if self._on_done:
+                self._on_done(self)
+
+    def subscribe(self):
+        """同步订阅：先回放已产出的 token，再等待后续 token；底层流出错时抛出同样的异常"""
+        with self._condition:
+            self.subscribers += 1
+        position = 0
+        while True:
+            with self._condition:
+                while position >= len(self.tokens) and not self.done:
+                    self._condition.wait()
+                pending = self.tokens[position:]
+                position = len(self.tokens)
+                finished = self.done and not pending
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield from pending
+
+    async def asubscribe(self):
+        """异步订阅：与 subscribe 相同，但等待时不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def listener():
+            loop.call_soon_threadsafe(wakeup.set)
+
+        with self._condition:
+            self.subscribers += 1
+            self._listeners.append(listener)
+        position = 0
+        try:
+            while True:
+                with self._condition:
+                    pending = self.tokens[position:]
+                    position = len(self.tokens)
+                    finished = self.done and not pending
+                    if not pending and not finished:
+                        wakeup.clear()
+                if finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                if not pending:
+                    await wakeup.wait()
+                    continue
+                for token in pending:
+                    yield token
+        finally:
+            with self._condition:
+                self._listeners.remove(listener)
+
+
+class StreamCoalescer:
+    """按键合并正在进行的流式请求"""
+
+    def __init__(self):
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def join(self, key, source_factory, state=None):
+        """返回 (共享流, 是否为发起者)
+
+        键相同的共享流正在进行时直接加入；否则调用 source_factory() 创建底层 token 流并启动共享流。
+        """
+        with self._lock:
+            shared = self._in_flight.get(key)
+            if shared is not None:
+                self.followers += 1
+                return shared, False
+            shared = SharedStream(source_factory(), state, on_done=lambda s: self._finish(key, s))
+            self._in_flight[key] = shared
+            self.leaders += 1
+        return shared.start(), True
+
+    def _finish(self, key, shared):
+        with self._lock:
+            if self._in_flight.get(key) is shared:
+                del self._in_flight[key]
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._in_flight), "leaders": self.leaders, "followers": self.followers}
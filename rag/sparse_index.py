@@ -0,0 +1,147 @@
+"""本地稀疏检索：基于字符 n-gram 的 BM25 索引，以及与向量检索结果的倒数排名融合（RRF）"""
+import re
+import threading
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+
+# 疑问词或较长的自然语言问题走混合检索；短的关键词查询只走稀疏检索，不需要向量化问题
+QUESTION_PATTERN = re.compile(r"[?？吗呢么]|什么|怎么|如何|为什么|为何|哪些|哪个|是否|能否|可以|请问|多少")
+KEYWORD_QUERY_MAX_LENGTH = 12
+
+
+def is_keyword_query(question):
+    """判断是否为关键词式查询，例如“旷课”“操行成绩85分”“记过”"""
+    text = re.sub(r"\s+", "", question)
+    return 0 < len(text) <= KEYWORD_QUERY_MAX_LENGTH and not QUESTION_PATTERN.search(text)
+
+
+def reciprocal_rank_fusion(ranked_lists, k=4, rrf_k=60):
+    """倒数排名融合：每个列表中排名 r 的文档得分 1/(rrf_k + r)，按总分取前 k 个"""
+    scores, docs = {}, {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked):
+            key = doc.id or (doc.metadata.get("source"), doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered[:k]]
+
+
+class SparseIndex:
+    """字符 n-gram 的 BM25 索引
+
+    用 HashingVectorizer 把文本映射到固定维度，不需要事先拟合词表，因此可以像向量索引一样
+    按ID增量添加和删除文档；查询完全在本地计算，不产生网络请求。
+    """
+
+    def __init__(self, ngram_range=(1, 3), n_features=2 ** 20, k1=1.5, b=0.75):
+        self.vectorizer = HashingVectorizer(
+            analyzer="char",
+            ngram_range=ngram_range,
+            n_features=n_features,
+            alternate_sign=False,
+            norm=None,
+            lowercase=True,
+        )
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.docs = []
+        self._rows = []
+        self._id_positions = {}
+        # 打分用的矩阵和统计量，按需构建后整体替换：(矩阵, 文档长度, 平均长度, 文档频率, 文档, ID位置)；
+        # 内置语料的索引被所有会话共享，构建和增删都在索引自己的锁内进行
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add_documents(self, docs, ids):
+        if not docs:
+            return
+        rows = self.vectorizer.transform([doc.page_content for doc in docs]).tocsr()
+        with self._lock:
+            self._rows.append(rows)
+            for doc, doc_id in zip(docs, ids):
+                self._id_positions[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+                self.docs.append(doc)
+            self._snapshot = None
+
+    def delete(self, ids):
+        with self._lock:
+            remove = {self._id_positions[doc_id] for doc_id in ids if doc_id in self._id_positions}
+            if not remove:
+                return
+            keep = [i for i in range(len(self.ids)) if i not in remove]
+            matrix = self._build_snapshot()[0]
+            self._rows = [matrix[keep]] if keep else []
+            self.ids = [self.ids[i] for i in keep]
+            self.docs = [self.docs[i] for i in keep]
+            self._id_positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+            self._snapshot = None
+
+    def _build_snapshot(self):
+        """调用方持有 self._lock；在局部变量中算好全部统计量后一次性发布"""
+        if self._snapshot is None:
+            matrix = sparse.vstack(self._rows).tocsc() if self._rows else None
+            if matrix is None:
+                snapshot = (None, None, 0.0, None, [], {})
+            else:
+                lengths = np.asarray(matrix.sum(axis=1)).ravel()
+                snapshot = (
+                    matrix, lengths, lengths.mean() if len(lengths) else 0.0, np.diff(matrix.indptr),
+                    list(self.docs), dict(self._id_positions),
+                )
+            self._snapshot = snapshot
+        return self._snapshot
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._build_snapshot()
+        return snapshot
+
+    def search_with_scores(self, query, k=4, ids=None):
+        """返回 [(文档, BM25得分)]，只包含至少命中一个 n-gram 的文档
+
+        ids 为允许的文档ID时只对这些文档打分（词频和文档频率仍按整个索引统计）。
+        """
+        matrix, lengths, avg_length, doc_freq, docs, id_positions = self._get_snapshot()
+        if matrix is None:
+            return []
+        terms = self.vectorizer.transform([query]).indices
+        if len(terms) == 0:
+            return []
+
+        n = matrix.shape[0]
+        idf = np.log(1 + (n - doc_freq[terms] + 0.5) / (doc_freq[terms] + 0.5))
+        if ids is None:
+            rows = np.arange(n)
+            tf = matrix[:, terms].toarray()
+        else:
+            rows = np.array([id_positions[doc_id] for doc_id in ids if doc_id in id_positions], dtype=int)
+            if len(rows) == 0:
+                return []
+            tf = matrix[:, terms].tocsr()[rows].toarray()
+        norm = self.k1 * (1 - self.b + self.b * lengths[rows] / (avg_length or 1.0))
+        scores = (tf * (self.k1 + 1) / (tf + norm[:, None])) @ idf
+
+        top = np.argsort(-scores)[:k]
+        return [(docs[rows[i]], float(scores[i])) for i in top if scores[i] > 0]
+
+    def search(self, query, k=4, ids=None):
+        return [doc for doc, _ in self.search_with_scores(query, k, ids)]
+
+    @classmethod
+    def from_vectorstore(cls, store, **kwargs):
+        """从 FAISS 向量库的文档库构建稀疏索引（例如磁盘上加载的内置语料）"""
+        index = cls(**kwargs)
+        ids = [store.index_to_docstore_id[i] for i in range(len(store.index_to_docstore_id))]
+        docs = [store.docstore.search(doc_id) for doc_id in ids]
+        index.add_documents(docs, ids)
+        return index
@@ -0,0 +1,38 @@
+"""token 计数：优先使用 tiktoken，不可用时按字符数估算（中文约一字一 token）"""
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken 随 langchain-openai 一起安装
+    tiktoken = None
+
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding, tiktoken
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # 编码文件无法下载（离线环境）时退回到按字符估算
+            tiktoken = None
+    return _encoding
+
+
+def count_tokens(text):
+    """估算文本的 token 数"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """把文本截断到不超过 max_tokens 个 token"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
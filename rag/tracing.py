@@ -0,0 +1,239 @@
+"""分阶段追踪：记录一次请求中各阶段的耗时，按阶段汇总延迟分布，导出为 JSONL 和 Prometheus 文本
+
+用法：
+    trace = tracer.start("answer")
+    with activate(trace):               # 在当前上下文中启用追踪
+        with span("vector_search"):     # 任意深度的代码都可以记录阶段
+            ...
+    trace.finish()
+
+没有启用追踪时 span() 什么也不做，因此知识库等模块可以单独使用。
+"""
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+_current_trace = contextvars.ContextVar("rag_current_trace", default=None)
+
+# 延迟直方图的分桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Trace:
+    """一次请求的追踪：按发生顺序记录各阶段的开始偏移和耗时"""
+
+    def __init__(self, tracer, name, **attributes):
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+        # 时间点标记（相对开始的毫秒数），例如提示词组装完成、首个 token 到达
+        self.marks = {}
+        self.duration_ms = None
+        self._lock = threading.Lock()
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+    def mark(self, name):
+        self.marks[name] = self.elapsed_ms()
+        return self.marks[name]
+
+    def add_span(self, name, duration_ms, start_ms=None, **attributes):
+        if start_ms is None:
+            start_ms = self.elapsed_ms() - duration_ms
+        with self._lock:
+            self.spans.append({"name": name, "start_ms": start_ms, "duration_ms": duration_ms, **attributes})
+        self.tracer.metrics.observe(name, duration_ms / 1000)
+
+    def finish(self, **attributes):
+        """结束追踪：记录总耗时并交给 tracer 导出；重复调用无效"""
+        if self.duration_ms is not None:
+            return
+        self.attributes.update(attributes)
+        self.duration_ms = self.elapsed_ms()
+        self.tracer.metrics.observe(self.name, self.duration_ms / 1000)
+        self.tracer.export(self)
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "attributes": dict(self.attributes),
+            "spans": spans,
+        }
+
+
+@contextmanager
+def span(name, **attributes):
+    """在当前追踪中记录一个阶段；yield 出的字典可以在阶段内补充属性（如命中数）"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield attributes
+        return
+    start_ms = trace.elapsed_ms()
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        trace.add_span(name, (time.perf_counter() - start) * 1000, start_ms, **attributes)
+
+
+@contextmanager
+def activate(trace):
+    """在当前上下文中启用追踪，使 span() 记录到该追踪中；trace 为 None 时不做任何事"""
+    if trace is None:
+        yield None
+        return
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+class Distribution:
+    """单个指标的累计直方图，以及用于计算分位数的最近样本窗口"""
+
+    def __init__(self, buckets, window):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+
+    def quantile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class MetricsRegistry:
+    """按阶段汇总的延迟分布，以及回答输出速度（tokens/s）的分布"""
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.stages = {}
+        self.tokens_per_second = Distribution((), window)
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            distribution = self.stages.get(stage)
+            if distribution is None:
+                distribution = self.stages[stage] = Distribution(LATENCY_BUCKETS, self.window)
+            distribution.observe(seconds)
+
+    def observe_throughput(self, tokens_per_second):
+        with self._lock:
+            self.tokens_per_second.observe(tokens_per_second)
+
+    def summary(self):
+        """{阶段: {count, mean_ms, p50_ms, p95_ms, p99_ms}}，以及输出速度的分位数"""
+        with self._lock:
+            result = {
+                stage: {
+                    "count": d.count,
+                    "mean_ms": d.total / d.count * 1000,
+                    **{f"p{int(q * 100)}_ms": d.quantile(q) * 1000 for q in QUANTILES},
+                }
+                for stage, d in sorted(self.stages.items())
+            }
+            if self.tokens_per_second.count:
+                result["tokens_per_second"] = {
+                    "count": self.tokens_per_second.count,
+                    **{f"p{int(q * 100)}": self.tokens_per_second.quantile(q) for q in QUANTILES},
+                }
+            return result
+
+    def prometheus(self, counters=None):
+        """Prometheus 文本格式：各阶段的延迟直方图和最近窗口内的分位数
+
+        counters 为额外的 {指标名: {标签值: 数值}}，例如各缓存的命中次数。
+        """
+        lines = [
+            "# HELP rag_stage_duration_seconds 各阶段耗时",
+            "# TYPE rag_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted(self.stages.items())
+            for stage, d in stages:
+                cumulative = 0
+                for bound, count in zip(d.buckets, d.bucket_counts):
+                    cumulative += count
+                    lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {d.count}')
+                lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {d.total}')
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {d.count}')
+
+            lines += [
+                "# HELP rag_stage_latency_seconds 各阶段最近请求的耗时分位数",
+                "# TYPE rag_stage_latency_seconds summary",
+            ]
+            for stage, d in stages:
+                for q in QUANTILES:
+                    lines.append(f'rag_stage_latency_seconds{{stage="{stage}",quantile="{q}"}} {d.quantile(q)}')
+                lines.append(f'rag_stage_latency_seconds_sum{{stage="{stage}"}} {d.total}')
+                lines.append(f'rag_stage_latency_seconds_count{{stage="{stage}"}} {d.count}')
+
+            throughput = self.tokens_per_second
+            lines += [
+                "# HELP rag_generation_tokens_per_second 回答的输出速度",
+                "# TYPE rag_generation_tokens_per_second summary",
+            ]
+            for q in QUANTILES:
+                lines.append(f'rag_generation_tokens_per_second{{quantile="{q}"}} {throughput.quantile(q)}')
+            lines.append(f"rag_generation_tokens_per_second_sum {throughput.total}")
+            lines.append(f"rag_generation_tokens_per_second_count {throughput.count}")
+
+        for name, values in (counters or {}).items():
+            lines.append(f"# TYPE {name} counter")
+            for label, value in values.items():
+                lines.append(f'{name}{{cache="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """创建追踪并汇总指标；log_path 不为空时每条结束的追踪追加一行 JSON"""
+
+    def __init__(self, log_path=None, window=1024):
+        self.log_path = log_path
+        self.metrics = MetricsRegistry(window)
+        self._write_lock = threading.Lock()
+
+    def start(self, name, **attributes):
+        return Trace(self, name, **attributes)
+
+    def export(self, trace):
+        if not self.log_path:
+            return
+        line = json.dumps(trace.to_dict(), ensure_ascii=False)
+        with self._write_lock:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as file:
+                file.write(line + "\n")
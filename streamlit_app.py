@@ -1,19 +1,11 @@
 import streamlit as st
 import os
-import tempfile
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnablePassthrough
-from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.messages import HumanMessage, AIMessage
-import docx2txt
-import PyPDF2
-import io
 import time
 import json
+import html
+import uuid
+from rag.client import RemoteEngine
+from rag.engine import EngineConfig, QAEngine
 
 # 页面配置
 st.set_page_config(
@@ -214,8 +206,8 @@ def initialize_session_state():
     if "messages" not in st.session_state:
         st.session_state.messages = []
         
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+    # 对话历史和上传文档的索引保存在问答引擎中，这里只保存会话ID
+    get_session_id()
         
     # 用于存储重新生成的请求
     if "regenerate_question" not in st.session_state:
@@ -223,81 +215,30 @@ def initialize_session_state():
         
     if "regenerate_index" not in st.session_state:
         st.session_state.regenerate_index = None
+        
+    # AI 回答的出处：消息下标 -> [{file, page, section}]
+    if "citations" not in st.session_state:
+        st.session_state.citations = {}
+        
+    # 聊天区显示的消息条数
+    if "history_limit" not in st.session_state:
+        st.session_state.history_limit = HISTORY_PAGE_SIZE
+
+# ---------- 复制到剪贴板 ----------
+# 整个页面只注入一次的复制脚本：脚本挂到主页面上，通过事件委托处理所有带 data-copy-text 的按钮，
+# 每条消息只需输出一个普通的 HTML 按钮，不再为每条消息创建 iframe
+COPY_HANDLER_SCRIPT = """
+(function () {
+    function showResult(button, ok) {
+        button.classList.toggle('copied', ok);
+        button.textContent = ok ? '✅' : '❌';
+        setTimeout(function () {
+            button.classList.remove('copied');
+            button.textContent = '📋';
+        }, 2000);
+    }
 
-# ---------- 重新生成功能的Streamlit组件 ----------
-# 修改后的 create_message_actions 函数
-def create_message_actions(message_index, message_text, question=None):
-    """创建消息操作按钮组"""
-    col1, col2 = st.columns([1, 1])  # 创建两列，每列宽度相等
-
-    with col1:  # 复制按钮
-        if st.button("📋", key=f"copy_{message_index}", help="复制消息到剪贴板"):
-            # 使用JavaScript复制功能
-            copy_js = f"""
-            <script>
-            navigator.clipboard.writeText(`{message_text.replace('`', '\\`').replace('\\', '\\\\')}`).then(function() {{
-                console.log('复制成功');
-            }}).catch(function(err) {{
-                console.error('复制失败:', err);
-            }});
-            </script>
-            """
-            st.components.v1.html(copy_js, height=0)
-            st.success("已复制到剪贴板！", icon="✅")
-
-    with col2:  # 重新生成按钮（仅对AI回答显示）
-        if question is not None:
-            if st.button("🔄", key=f"regen_{message_index}", help="重新生成回答"):
-                # 设置重新生成的请求
-                st.session_state.regenerate_question = question
-                st.session_state.regenerate_index = message_index
-                st.rerun()
-
-# 修改后的 create_copy_button_html 函数 - 添加白色边框样式并修复显示问题
-def create_copy_button_html(message_index, message_text):
-    """创建带白色边框的复制按钮HTML"""
-    # 转义文本中的特殊字符
-    escaped_text = message_text.replace('\\', '\\\\').replace('`', '\\`').replace("'", "\\'").replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
-
-    copy_html = f'''
-    <div style="display: flex; align-items: center; gap: 10px; margin: 5px 0; height: 40px;">
-        <button onclick="copyToClipboard{message_index}()"
-                class="copy-button"
-                style="background: white; border: 1px solid #ddd; border-radius: 6px; padding: 6px; cursor: pointer; font-size: 18px; color: #666; transition: all 0.2s ease; display: inline-flex; align-items: center; justify-content: center; width: 36px; height: 36px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); flex-shrink: 0;"
-                onmouseover="this.style.background='#f8f9fa'; this.style.borderColor='#adb5bd'; this.style.color='#333'; this.style.transform='translateY(-1px)'; this.style.boxShadow='0 2px 6px rgba(0,0,0,0.15)';"
-                onmouseout="this.style.background='white'; this.style.borderColor='#ddd'; this.style.color='#666'; this.style.transform='translateY(0px)'; this.style.boxShadow='0 1px 3px rgba(0,0,0,0.1)';">
-            📋
-        </button>
-        <span id="copy-status-{message_index}" style="color: #28a745; font-size: 12px; line-height: 1;"></span>
-    </div>
-
-    <script>
-    function copyToClipboard{message_index}() {{
-        const text = `{escaped_text}`;
-        const statusElement = document.getElementById('copy-status-{message_index}');
-        const button = event.target;
-
-        if (navigator.clipboard && window.isSecureContext) {{
-            navigator.clipboard.writeText(text).then(function() {{
-                statusElement.textContent = '✅ 已复制';
-                button.style.color = '#28a745';
-                button.style.background = '#f0f8f0';
-                button.style.borderColor = '#28a745';
-                setTimeout(() => {{
-                    statusElement.textContent = '';
-                    button.style.color = '#666';
-                    button.style.background = 'white';
-                    button.style.borderColor = '#ddd';
-                }}, 2000);
-            }}).catch(function(err) {{
-                fallbackCopy{message_index}(text, statusElement, button);
-            }});
-        }} else {{
-            fallbackCopy{message_index}(text, statusElement, button);
-        }}
-    }}
-
-    function fallbackCopy{message_index}(text, statusElement, button) {{
+    function fallbackCopy(text, button) {
         const textArea = document.createElement('textarea');
         textArea.value = text;
         textArea.style.position = 'fixed';
@@ -306,35 +247,78 @@ def create_copy_button_html(message_index, message_text):
         document.body.appendChild(textArea);
         textArea.focus();
         textArea.select();
+        let ok = false;
+        try {
+            ok = document.execCommand('copy');
+        } catch (err) {
+            ok = false;
+        }
+        document.body.removeChild(textArea);
+        showResult(button, ok);
+    }
 
-        try {{
-            const successful = document.execCommand('copy');
-            if (successful) {{
-                statusElement.textContent = '✅ 已复制';
-                button.style.color = '#28a745';
-                button.style.background = '#f0f8f0';
-                button.style.borderColor = '#28a745';
-            }} else {{
-                statusElement.textContent = '❌ 复制失败';
-            }}
-        }} catch (err) {{
-            statusElement.textContent = '❌ 复制失败';
-        }}
+    document.addEventListener('click', function (event) {
+        const button = event.target.closest('[data-copy-text]');
+        if (!button) {
+            return;
+        }
+        const text = button.getAttribute('data-copy-text');
+        if (navigator.clipboard && window.isSecureContext) {
+            navigator.clipboard.writeText(text).then(function () {
+                showResult(button, true);
+            }).catch(function () {
+                fallbackCopy(text, button);
+            });
+        } else {
+            fallbackCopy(text, button);
+        }
+    });
+})();
+"""
 
-        document.body.removeChild(textArea);
-        setTimeout(() => {{
-            statusElement.textContent = '';
-            button.style.color = '#666';
-            button.style.background = 'white';
-            button.style.borderColor = '#ddd';
-        }}, 2000);
+def install_copy_handler():
+    """在主页面上注入一次复制脚本（参数不变时 Streamlit 不会重新创建这个 iframe）"""
+    st.components.v1.html(f"""
+    <script>
+    const doc = window.parent.document;
+    if (!doc.getElementById('copy-handler')) {{
+        const script = doc.createElement('script');
+        script.id = 'copy-handler';
+        script.textContent = {json.dumps(COPY_HANDLER_SCRIPT)};
+        doc.head.appendChild(script);
     }}
     </script>
-    '''
+    """, height=0)
+
+def copy_button_html(message_text):
+    """复制按钮：原文放在 data-copy-text 属性中，由共享的复制脚本处理点击"""
+    escaped_text = html.escape(message_text, quote=True).replace("\n", "&#10;").replace("\r", "&#13;")
+    return f'<button class="copy-button" data-copy-text="{escaped_text}" title="复制到剪贴板">📋</button>'
+
+# ---------- 问答引擎 ----------
+@st.cache_resource
+def get_engine():
+    """问答引擎：设置了 QA_ENGINE_URL 时连接独立部署的问答服务，否则在本进程内创建"""
+    engine_url = os.getenv("QA_ENGINE_URL")
+    if engine_url:
+        return RemoteEngine(engine_url)
+    if not os.getenv("OPENAI_API_KEY"):
+        st.error("请先设置环境变量 OPENAI_API_KEY")
+        st.stop()
+    return QAEngine(EngineConfig.from_env())
 
-    return copy_html
+def get_session_id():
+    """当前浏览器会话在引擎中的ID"""
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
 
 # ---------- 处理重新生成请求 ----------
+def request_regenerate(question, message_index):
+    """重新生成按钮的回调：在片段重新运行之前记录请求，点击一次只运行一遍"""
+    st.session_state.regenerate_question = question
+    st.session_state.regenerate_index = message_index
+
 def handle_regenerate_request():
     """处理重新生成回答的请求"""
     if st.session_state.regenerate_question is not None and st.session_state.regenerate_index is not None:
@@ -347,16 +331,18 @@ def handle_regenerate_request():
             if message_index > 0 and message_index < len(st.session_state.messages):
                 # 移除要重新生成的AI回答
                 st.session_state.messages = st.session_state.messages[:message_index]
+                st.session_state.citations = {
+                    i: citations for i, citations in st.session_state.citations.items() if i < message_index
+                }
                                 
-                # 同样调整对话历史
+                # 同样调整引擎中的对话历史（摘要同步回退到截断位置之前的检查点）
                 # 每个用户问题对应一个 HumanMessage 和一个 AIMessage
                 pairs_to_keep = message_index // 2
-                st.session_state.chat_history = st.session_state.chat_history[:pairs_to_keep * 2]
+                get_engine().truncate_history(get_session_id(), pairs_to_keep * 2)
                                 
                 # 添加问题（如果还没有）
                 if not st.session_state.messages or st.session_state.messages[-1][0] != "user":
                     st.session_state.messages.append(("user", question))
-                    st.session_state.chat_history.append(HumanMessage(content=question))
                                 
                 # 清除重新生成请求
                 st.session_state.regenerate_question = None
@@ -371,237 +357,237 @@ def handle_regenerate_request():
         
     return None
 
-# ---------- 从本地 Markdown 文件获取文档内容 ----------
-def fetch_document_from_file(file_path):
+# ---------- 处理上传文件 ----------
+JOB_STATUS_LABELS = {"queued": "排队中", "running": "处理中", "done": "已完成", "failed": "失败", "cancelled": "已取消"}
+
+def submit_uploaded_file(uploaded_file):
+    """把上传文件交给引擎的后台导入任务，立即返回任务ID；提取和向量化不阻塞页面"""
     try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            return file.read()
-    except FileNotFoundError:
-        st.error(f"文件未找到: {file_path}")
-        return ""
+        job = get_engine().submit_ingest(
+            get_session_id(), uploaded_file.name, uploaded_file.getvalue(), size=uploaded_file.size
+        )
+        st.session_state.ingest_jobs[job['job_id']] = uploaded_file.name
+        return job['job_id']
     except Exception as e:
-        st.error(f"无法读取文件: {e}")
-        return ""
+        st.error(f"提交文件 {uploaded_file.name} 时出错: {str(e)}")
+        return None
 
-# ---------- 处理上传文件 ----------
-def process_uploaded_file(uploaded_file):
-    """处理上传的文件并提取文本内容"""
-    try:
-        file_extension = uploaded_file.name.split('.')[-1].lower()
-                
-        if file_extension == 'txt':
-            content = str(uploaded_file.read(), "utf-8")
-        elif file_extension == 'md':
-            content = str(uploaded_file.read(), "utf-8")
-        elif file_extension == 'pdf':
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(uploaded_file.read()))
-            content = ""
-            for page_num, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
-                content += f"\n[第{page_num+1}页]\n{page_text}"
-        elif file_extension in ['docx', 'doc']:
-            # 保存临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}') as tmp_file:
-                tmp_file.write(uploaded_file.read())
-                tmp_file_path = tmp_file.name
-                        
-            content = docx2txt.process(tmp_file_path)
-            os.unlink(tmp_file_path)  # 删除临时文件
+def collect_finished_jobs(jobs):
+    """把已结束的任务从等待列表中移除：成功的加入文件列表，失败或取消的需要重新上传；返回是否有任务结束"""
+    pending = st.session_state.ingest_jobs
+    jobs_by_id = {job['job_id']: job for job in jobs}
+    finished = False
+    for job_id, filename in list(pending.items()):
+        job = jobs_by_id.get(job_id)
+        if job is not None and job['status'] in ("queued", "running"):
+            continue
+        del pending[job_id]
+        finished = True
+        if job is not None and job['status'] == "done":
+            st.session_state.uploaded_files_info = [
+                info for info in st.session_state.uploaded_files_info if info['name'] != filename
+            ] + [job['file_info']]
+            st.toast(f"✅ {filename} 处理成功！知识库已更新。")
         else:
-            st.error(f"不支持的文件格式: {file_extension}")
-            return ""
-                
-        # 验证内容是否成功提取
-        if not content or len(content.strip()) == 0:
-            st.error(f"文件 {uploaded_file.name} 内容为空或无法提取")
-            return ""
-                
-        st.success(f"成功提取 {uploaded_file.name}，内容长度: {len(content)} 字符")
-        return content
+            # 从上传器中移除后可以再次上传
+            st.session_state.dismissed_files.add(filename)
+    return finished
+
+def remove_uploaded_file(index):
+    """移除单个上传文件，并从引擎的索引中删除它的向量"""
+    file_info = st.session_state.uploaded_files_info.pop(index)
+    get_engine().remove_file(get_session_id(), file_info['name'])
+    st.session_state.dismissed_files.add(file_info['name'])
+
+# ---------- 调试面板 ----------
+def show_debug_panel(engine_stats):
+    """显示最近一次请求各阶段的耗时，以及各阶段的 p50/p95/p99 延迟"""
+    last_trace = engine_stats.get("last_trace")
+    if last_trace:
+        st.markdown(f"**最近一次回答** · 总耗时 {last_trace['duration_ms']:.0f} ms")
+        st.table([
+            {"阶段": item["name"], "开始 (ms)": round(item["start_ms"]), "耗时 (ms)": round(item["duration_ms"], 1)}
+            for item in last_trace["spans"]
+        ])
+        generation = next((item for item in last_trace["spans"] if item["name"] == "generation"), None)
+        if generation:
+            st.caption(f"输出速度：{generation['tokens_per_second']:.1f} tokens/s")
             
-    except Exception as e:
-        st.error(f"处理文件 {uploaded_file.name} 时出错: {str(e)}")
-        return ""
+    stages = dict(engine_stats.get("stages", {}))
+    throughput = stages.pop("tokens_per_second", None)
+    if stages:
+        st.markdown("**各阶段延迟 (ms)**")
+        st.table([
+            {"阶段": name, "次数": item["count"], "p50": round(item["p50_ms"], 1),
+             "p95": round(item["p95_ms"], 1), "p99": round(item["p99_ms"], 1)}
+            for name, item in stages.items()
+        ])
+    if throughput:
+        st.caption(f"输出速度 p50 {throughput['p50']:.1f} · p95 {throughput['p95']:.1f} tokens/s")
+    if not last_trace and not stages:
+        st.caption("暂无追踪数据")
 
-# ---------- 测试检索器功能 ----------
-def test_retriever(question="测试"):
-    """测试检索器是否正常工作"""
+# ---------- 侧边栏功能 ----------
+# 上传管理、文件列表和缓存状态各自是独立重新运行的片段（st.fragment）：
+# 片段内的操作只重新运行该片段，提问也不会重新运行这些片段
+@st.fragment
+def upload_manager():
+    """文件上传器：只处理新上传的文件"""
+    st.markdown("### 📁 文件上传")
+            
+    if 'uploader_key' not in st.session_state:
+        st.session_state.uploader_key = 0
+    if 'dismissed_files' not in st.session_state:
+        st.session_state.dismissed_files = set()
+    if 'uploaded_files_info' not in st.session_state:
+        st.session_state.uploaded_files_info = []
+    # 任务ID -> 文件名（尚未结束的后台导入任务）
+    if 'ingest_jobs' not in st.session_state:
+        st.session_state.ingest_jobs = {}
+            
+    # 文件上传器
+    uploaded_files = st.file_uploader(
+        "上传文档文件",
+        type=['txt', 'md', 'pdf', 'docx', 'doc'],
+        accept_multiple_files=True,
+        help="支持的格式：TXT, MD, PDF, DOCX, DOC",
+        key=f"uploader_{st.session_state.uploader_key}"
+    )
+            
+    # 已从上传器中移除的文件，允许再次上传
+    current_names = {f.name for f in uploaded_files or []}
+    st.session_state.dismissed_files &= current_names
+            
+    if uploaded_files:
+        # 提交新上传的文件：已处理完、正在处理或处理失败的文件不重复提交
+        skipped_files = (
+            {info['name'] for info in st.session_state.uploaded_files_info}
+            | set(st.session_state.ingest_jobs.values())
+            | st.session_state.dismissed_files
+        )
+        new_jobs = 0
+                    
+        for uploaded_file in uploaded_files:
+            if uploaded_file.name not in skipped_files and submit_uploaded_file(uploaded_file):
+                new_jobs += 1
+                    
+        if new_jobs > 0:
+            # 任务列表在另一个片段中，整页刷新一次使它开始轮询
+            st.rerun()
+
+def ingestion_jobs():
+    """后台导入任务的状态、进度和取消按钮；setup_sidebar 在有未结束的任务时让它每秒刷新一次"""
     try:
-        retriever = build_retriever()
-        if retriever:
-            docs = retriever.invoke(question)
-            return docs
-        return []
-    except Exception as e:
-        st.error(f"测试检索器时出错: {e}")
-        return []
+        jobs = get_engine().ingest_jobs(get_session_id())
+    except Exception:
+        jobs = []
+    if collect_finished_jobs(jobs):
+        # 文件列表需要更新；没有未结束的任务时也借此停止轮询
+        st.rerun()
+            
+    visible_jobs = [job for job in jobs if job['status'] != "done"]
+    if not visible_jobs:
+        return
+    st.markdown("### ⏳ 导入任务")
+    for job in visible_jobs:
+        label = f"{job['filename']} · {JOB_STATUS_LABELS.get(job['status'], job['status'])}"
+        if job['status'] in ("queued", "running"):
+            st.progress(job['progress'], text=f"{label} · 已向量化 {job['chunks']} 个片段")
+            # 回调在片段重新运行之前执行，重新运行时即显示取消后的状态
+            st.button("⏹️ 取消", key=f"cancel_job_{job['job_id']}", use_container_width=True,
+                      on_click=get_engine().cancel_ingest, args=(get_session_id(), job['job_id']))
+        elif job['status'] == "failed":
+            st.error(f"❌ {label}：{job['error']}")
+        else:
+            st.warning(f"⏹️ {label}")
+    if any(job['status'] in ("failed", "cancelled") for job in visible_jobs):
+        st.button("清除已结束的任务", key="clear_finished_jobs", use_container_width=True,
+                  on_click=get_engine().clear_ingest_jobs, args=(get_session_id(),))
 
-# ---------- 构建检索器 ----------
-def build_retriever():
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        st.error("请先设置环境变量 OPENAI_API_KEY")
-        st.stop()
-        
-    all_docs = []
-        
-    # 从本地文件获取文档内容
-    DOCUMENT_FILE_PATH = "测试.md"
-    if os.path.exists(DOCUMENT_FILE_PATH):
-        raw_docs = fetch_document_from_file(DOCUMENT_FILE_PATH)
-        if raw_docs:
-            all_docs.append(raw_docs)
-        
-    # 添加上传的文档内容
-    if 'uploaded_docs' in st.session_state and st.session_state.uploaded_docs:
-        all_docs.extend(st.session_state.uploaded_docs)
-        # 在侧边栏显示，不在主聊天区域显示
-        # st.info(f"已加载 {len(st.session_state.uploaded_docs)} 个上传文档到知识库")
-        
-    if not all_docs:
-        st.warning("没有找到任何文档内容，AI将仅使用自身知识回答问题")
-        return None
-        
-    # 切分长文档
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    docs = text_splitter.create_documents(all_docs)
-        
-    # 在侧边栏显示信息，不影响聊天格式
-    # st.info(f"知识库已构建，包含 {len(docs)} 个文档片段")
-        
-    embeddings = OpenAIEmbeddings(openai_api_key=api_key)
-    vectorstore = FAISS.from_documents(docs, embeddings)
-    return vectorstore.as_retriever(search_kwargs={"k": 4})
+def source_label(source_info):
+    return "📚 内置语料" if source_info['kind'] == "base" else f"📄 {source_info['file']}"
 
-# ---------- 构建问答链（带记忆功能） ----------
-def get_qa_chain_with_memory():
-    llm = ChatOpenAI(model_name="gpt-4o", temperature=0, openai_api_key=os.getenv("OPENAI_API_KEY"))
-        
-    # 改进的系统提示，允许模型在找不到相关信息时使用自身知识
-    system = (
-        "你是一个乐于助人的 AI 助手。\n"
-        "请首先基于下面提供的上下文信息回答问题。如果上下文中包含相关信息，请优先使用这些信息。"
-        "如果上下文中没有相关信息，请使用你的知识和经验来回答问题，并在回答开头说明'基于我的一般知识'。\n"
-        "请保持回答的准确性和有用性。\n\n"
-        "上下文信息:\n{context}\n\n"
-        "请结合对话历史和上下文信息来回答用户的问题。"
-    )
-        
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{question}")
-    ])
-        
-    def format_docs(docs):
-        if not docs:
-            return "没有找到相关的上下文信息。"
-        formatted = "\n\n".join(d.page_content for d in docs)
-        return formatted
-        
-    def get_context_and_question(inputs):
-        # 每次调用时重新构建检索器，确保使用最新的文档
-        retriever = build_retriever()
-        if retriever:
-            try:
-                context_docs = retriever.invoke(inputs["question"])
-                context = format_docs(context_docs)
-                # 不在这里显示信息，避免影响聊天格式
-                # if context != "没有找到相关的上下文信息。":
-                #     st.info(f"从知识库中找到 {len(context_docs)} 个相关文档片段")
-                # else:
-                #     st.info("未在知识库中找到相关信息，将使用AI一般知识回答")
-            except Exception as e:
-                # st.warning(f"检索时出错: {e}")
-                context = "检索出错，没有找到相关的上下文信息。"
-        else:
-            context = "没有找到相关的上下文信息。"
-            # st.info("知识库为空，将使用AI一般知识回答")
-                
-        return {
-            "context": context,
-            "question": inputs["question"],
-            "chat_history": inputs["chat_history"]
-        }
-        
-    chain = (
-        get_context_and_question
-        | prompt
-        | llm
-        | StrOutputParser()
+def retrieval_scope():
+    """检索范围：选中的文件（或内置语料）；不选择时检索全部文档"""
+    try:
+        sources = get_engine().sources(get_session_id())
+    except Exception:
+        return
+    labels = {info['source']: source_label(info) for info in sources}
+    # 已移除的文件不再作为选项
+    st.session_state.search_scope = [s for s in st.session_state.get("search_scope", []) if s in labels]
+    st.multiselect(
+        "🎯 检索范围",
+        options=list(labels),
+        format_func=labels.get,
+        key="search_scope",
+        placeholder="全部文档",
+        help="只在选中的文档中检索，不选择时检索全部文档",
     )
-        
-    return chain
 
-# ---------- 侧边栏功能 ----------
+def get_search_scope():
+    """当前的检索范围（来源列表），未限定时为 None"""
+    return st.session_state.get("search_scope") or None
+
+@st.fragment
+def uploaded_file_list():
+    """已上传文件的列表、预览和检索范围；移除文件只重新运行本片段"""
+    if 'uploaded_files_info' in st.session_state and st.session_state.uploaded_files_info:
+        retrieval_scope()
+        st.markdown("### 📋 已上传文件")
+        for i, file_info in enumerate(st.session_state.uploaded_files_info):
+            with st.expander(f"📄 {file_info['name']}", expanded=False):
+                st.write(f"**文件大小:** {file_info['size']} bytes")
+                st.write(f"**内容长度:** {file_info['content_length']} 字符")
+                                    
+                # 显示文档内容预览
+                st.text_area("内容预览:", file_info['preview'], height=100, disabled=True)
+                                    
+                if st.button("🗑️ 移除此文件", key=f"remove_file_{i}", use_container_width=True):
+                    remove_uploaded_file(i)
+                    st.rerun(scope="fragment")
+
+@st.fragment
+def engine_status():
+    """嵌入缓存和回答缓存的命中情况，以及可选的调试面板"""
+    try:
+        engine_stats = get_engine().stats(get_session_id())
+    except Exception:
+        engine_stats = {}
+    cache_stats = engine_stats.get("embedding_cache")
+    if cache_stats:
+        st.caption(
+            f"嵌入缓存：命中 {cache_stats['hits']} · 未命中 {cache_stats['misses']} · "
+            f"条目 {cache_stats['entries']}/{cache_stats['max_entries']}"
+        )
+    answer_stats = engine_stats.get("answer_cache")
+    if answer_stats:
+        st.caption(
+            f"回答缓存：命中 {answer_stats['hits']} · 未命中 {answer_stats['misses']} · "
+            f"条目 {answer_stats['entries']}"
+        )
+            
+    # 调试面板（可选）：各阶段耗时和延迟分布；回答完成后点击刷新查看最新数据
+    if st.checkbox("🛠️ 显示调试面板", key="show_debug_panel"):
+        show_debug_panel(engine_stats)
+        st.button("🔄 刷新", key="refresh_engine_status")
+
 def setup_sidebar():
     with st.sidebar:
-        st.markdown("### 📁 文件上传")
-                
-        # 文件上传器
-        uploaded_files = st.file_uploader(
-            "上传文档文件",
-            type=['txt', 'md', 'pdf', 'docx', 'doc'],
-            accept_multiple_files=True,
-            help="支持的格式：TXT, MD, PDF, DOCX, DOC"
-        )
-                
-        if uploaded_files:
-            # 初始化会话状态
-            if 'uploaded_docs' not in st.session_state:
-                st.session_state.uploaded_docs = []
-            if 'uploaded_files_info' not in st.session_state:
-                st.session_state.uploaded_files_info = []
-                        
-            # 处理新上传的文件
-            existing_files = [info['name'] for info in st.session_state.uploaded_files_info]
-            new_files_processed = 0
-                        
-            for uploaded_file in uploaded_files:
-                if uploaded_file.name not in existing_files:
-                    with st.spinner(f"正在处理文件: {uploaded_file.name}"):
-                        content = process_uploaded_file(uploaded_file)
-                        if content:
-                            # 添加文档内容
-                            st.session_state.uploaded_docs.append(content)
-                                                        
-                            # 保存文件信息
-                            st.session_state.uploaded_files_info.append({
-                                'name': uploaded_file.name,
-                                'size': uploaded_file.size,
-                                'content_length': len(content)
-                            })
-                                                        
-                            new_files_processed += 1
-                            st.success(f"✅ {uploaded_file.name} 处理成功！")
-                        else:
-                            st.error(f"❌ {uploaded_file.name} 处理失败！")
-                        
-            if new_files_processed > 0:
-                # 重新构建chain（每次都会重新构建检索器）
-                st.session_state.chain = get_qa_chain_with_memory()
-                st.success(f"🎉 成功处理 {new_files_processed} 个新文件！知识库已更新。")
-                st.rerun()
-                
-        # 显示已上传的文件
-        if 'uploaded_files_info' in st.session_state and st.session_state.uploaded_files_info:
-            st.markdown("### 📋 已上传文件")
-            for i, file_info in enumerate(st.session_state.uploaded_files_info):
-                with st.expander(f"📄 {file_info['name']}", expanded=False):
-                    st.write(f"**文件大小:** {file_info['size']} bytes")
-                    st.write(f"**内容长度:** {file_info['content_length']} 字符")
-                                        
-                    # 显示文档内容预览
-                    if 'uploaded_docs' in st.session_state and i < len(st.session_state.uploaded_docs):
-                        preview = st.session_state.uploaded_docs[i][:200] + "..." if len(st.session_state.uploaded_docs[i]) > 200 else st.session_state.uploaded_docs[i]
-                        st.text_area("内容预览:", preview, height=100, disabled=True)
+        upload_manager()
+        # 有未结束的导入任务时任务列表每秒自动刷新，否则不轮询
+        st.fragment(ingestion_jobs, run_every=1 if st.session_state.ingest_jobs else None)()
+        uploaded_file_list()
+        engine_status()
                 
         st.markdown("---")
                 
         # 清除对话历史按钮
         if st.button("🗑️ 清除对话历史", use_container_width=True):
             st.session_state.messages = []
-            st.session_state.chat_history = []
+            st.session_state.citations = {}
+            st.session_state.history_limit = HISTORY_PAGE_SIZE
+            get_engine().clear_history(get_session_id())
             st.session_state.regenerate_question = None
             st.session_state.regenerate_index = None
             st.success("对话历史已清除！")
@@ -609,11 +595,15 @@ def setup_sidebar():
                 
         # 清除上传文件按钮
         if st.button("📁 清除上传文件", use_container_width=True):
-            if 'uploaded_docs' in st.session_state:
-                del st.session_state.uploaded_docs
-            if 'uploaded_files_info' in st.session_state:
-                del st.session_state.uploaded_files_info
-            st.session_state.chain = get_qa_chain_with_memory()
+            # 只删除上传文件对应的向量
+            get_engine().clear_files(get_session_id())
+            get_engine().clear_ingest_jobs(get_session_id())
+            st.session_state.uploaded_files_info = []
+            st.session_state.ingest_jobs = {}
+            st.session_state.search_scope = []
+            # 重置上传器
+            st.session_state.uploader_key += 1
+            st.session_state.dismissed_files = set()
             st.success("所有上传文件已清除！")
             st.rerun()
                 
@@ -638,42 +628,39 @@ def setup_sidebar():
                         
             **注意事项：**
             - 文件上传后会自动构建知识库
-            - 大文件处理可能需要几秒钟时间
+            - 文件在后台处理，处理期间可以继续提问，也可以取消
             - 支持同时上传多个文件
             - 复制功能支持现代浏览器的一键复制
             - 重新回答会基于相同问题生成新答案
             """)
 
 # ---------- 生成AI回答的函数 ----------
-def generate_ai_response(prompt, msgs):
-    """生成AI回答"""
+def generate_ai_response(prompt, msgs, use_cache=True, reuse_context=False):
+    """生成AI回答；重新生成时 use_cache=False 跳过语义缓存的查找，reuse_context=True 复用原来的检索结果"""
     try:
-        # 准备输入数据，包含对话历史
-        chain_input = {
-            "question": prompt,
-            "chat_history": st.session_state.chat_history
-        }
-                
-        # 显示处理状态
+        # 问答引擎负责缓存查找、检索、生成、记录对话历史和后台摘要；
+        # 远程引擎要等到回答开始（首个 token）才返回，等待期间同样显示处理状态
         with st.spinner("正在思考中..."):
-            # 流式输出回答
-            response = st.write_stream(st.session_state.chain.stream(chain_input))
+            stream = get_engine().stream_answer(
+                get_session_id(), prompt, use_cache=use_cache, reuse_context=reuse_context, sources=get_search_scope()
+            )
+        if stream.cached:
+            # 命中缓存或由规则表直接回答：立即输出
+            response = st.write_stream(stream)
+        else:
+            # 显示处理状态
+            with st.spinner("正在思考中..."):
+                # 流式输出回答
+                response = st.write_stream(stream)
                 
         # 保存消息到历史记录
         st.session_state.messages.append(("assistant", response))
                 
-        # 更新对话历史（用于记忆功能）
-        st.session_state.chat_history.extend([
-            HumanMessage(content=prompt),
-            AIMessage(content=response)
-        ])
-                
-        # 限制对话历史长度，避免token过多
-        if len(st.session_state.chat_history) > 20:
-            st.session_state.chat_history = st.session_state.chat_history[-20:]
-                
         # 添加复制按钮和重新生成按钮
         message_index = len(st.session_state.messages) - 1
+        if stream.citations:
+            st.session_state.citations[message_index] = stream.citations
+            st.caption(format_citations(stream.citations))
                 
         # 使用HTML按钮组（水平排列）
         st.markdown("---")  # 添加分隔线
@@ -682,15 +669,12 @@ def generate_ai_response(prompt, msgs):
         button_col1, button_col2, button_col3 = st.columns([1, 1, 8])
         
         with button_col1:
-            copy_html = create_copy_button_html(message_index, response)
-            st.components.v1.html(copy_html, height=50)
+            st.markdown(copy_button_html(response), unsafe_allow_html=True)
                 
         with button_col2:
             # 重新生成按钮
-            if st.button("🔄", key=f"regen_new_{message_index}", help="重新生成回答"):
-                st.session_state.regenerate_question = prompt
-                st.session_state.regenerate_index = message_index
-                st.rerun()
+            st.button("🔄", key=f"regen_new_{message_index}", help="重新生成回答",
+                      on_click=request_regenerate, args=(prompt, message_index))
                     
     except Exception as e:
         error_msg = f"生成回答时出错: {str(e)}"
@@ -700,23 +684,80 @@ def generate_ai_response(prompt, msgs):
         with st.expander("错误详情"):
             st.code(str(e))
 
-# ---------- Streamlit 主界面 ----------
-def main():
-    # 初始化会话状态
-    initialize_session_state()
-    
-    # 页面标题（紧凑版）
-    st.markdown("""
-    <div class="custom-title">🌐 重庆科技大学 · 智能问答系统</div>
-    """, unsafe_allow_html=True)
-
-    # 设置侧边栏
-    setup_sidebar()
-
-    # 初始化问答链
-    if "chain" not in st.session_state:
-        st.session_state.chain = get_qa_chain_with_memory()
-
+# ---------- 聊天记录 ----------
+HISTORY_PAGE_SIZE = 20
+
+def format_citations(citations):
+    """出处列表：文件名、页码和章节"""
+    parts = []
+    for citation in citations:
+        text = citation['file']
+        if citation.get('page'):
+            text += f" 第{citation['page']}页"
+        if citation.get('section'):
+            text += f" · {citation['section']}"
+        parts.append(text)
+    return "📎 来源：" + "；".join(parts)
+
+def render_message(index, role, text):
+    """显示一条消息（紧凑版气泡）；AI 回答下方带复制和重新生成按钮"""
+    avatar = "🧑‍💻" if role == "user" else "🚀"
+    bubble_color = "#f0f2f6" if role == "user" else "#e6f0ff"
+
+    with st.chat_message(role, avatar=avatar):
+        st.markdown(f"""
+        <div style="
+            background-color: {bubble_color};
+            padding: 0.8rem;
+            border-radius: 8px;
+            max-width: 90%;
+            display: inline-block;
+            box-shadow: 0 1px 3px rgba(0,0,0,0.1);
+            margin: 3px 0;
+            text-align: left;
+            font-size: 14px;
+            line-height: 1.4;
+        ">
+        {text}
+        </div>
+        """, unsafe_allow_html=True)
+
+        # 添加出处和按钮（仅 assistant 有）- 紧凑版
+        if role == "assistant":
+            citations = st.session_state.citations.get(index)
+            if citations:
+                st.caption(format_citations(citations))
+            messages = st.session_state.messages
+            question = messages[index-1][1] if index > 0 and messages[index-1][0] == "user" else None
+            button_col1, button_col2, _ = st.columns([1, 1, 8])
+            with button_col1:
+                st.markdown(copy_button_html(text), unsafe_allow_html=True)
+            with button_col2:
+                if question:
+                    st.button("🔄", key=f"regen_history_{index}", help="重新生成回答",
+                              on_click=request_regenerate, args=(question, index))
+
+def load_older_messages():
+    st.session_state.history_limit += HISTORY_PAGE_SIZE
+
+def render_history(msgs):
+    """显示最近 history_limit 条消息，更早的消息点击按钮后按页加载"""
+    messages = st.session_state.messages
+    # 从一问一答的开头处截断
+    start = max(0, len(messages) - st.session_state.history_limit)
+    start -= start % 2
+    with msgs:
+        if start > 0:
+            st.button(f"⬆️ 加载更早的消息（还有 {start} 条）", key="load_older_messages",
+                      use_container_width=True, on_click=load_older_messages)
+        for i in range(start, len(messages)):
+            role, text = messages[i]
+            render_message(i, role, text)
+
+# ---------- 聊天区域 ----------
+@st.fragment
+def chat_area():
+    """聊天区域是独立重新运行的片段：提问、重新生成、加载更早的消息都不会重新运行侧边栏"""
     # 处理重新生成请求
     regenerate_question = handle_regenerate_request()
 
@@ -726,51 +767,16 @@ def main():
     # 聊天消息容器 - 调整高度适应新标题
     msgs = st.container(height=480)
 
-    # 显示聊天历史（紧凑版气泡）
-    for i, (role, text) in enumerate(st.session_state.messages):
-        avatar = "🧑‍💻" if role == "user" else "🚀"
-        bubble_color = "#f0f2f6" if role == "user" else "#e6f0ff"
-
-        with msgs.chat_message(role, avatar=avatar):
-            st.markdown(f"""
-            <div style="
-                background-color: {bubble_color};
-                padding: 0.8rem;
-                border-radius: 8px;
-                max-width: 90%;
-                display: inline-block;
-                box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-                margin: 3px 0;
-                text-align: left;
-                font-size: 14px;
-                line-height: 1.4;
-            ">
-            {text}
-            </div>
-            """, unsafe_allow_html=True)
-
-            # 添加按钮（仅 assistant 有）- 紧凑版
-            if role == "assistant":
-                question = st.session_state.messages[i-1][1] if i > 0 and st.session_state.messages[i-1][0] == "user" else None
-                st.markdown("<div style='margin-top: 5px;'>", unsafe_allow_html=True)
-                button_col1, button_col2, _ = st.columns([1, 1, 8])
-                with button_col1:
-                    copy_html = create_copy_button_html(i, text)
-                    st.components.v1.html(copy_html, height=40)
-                with button_col2:
-                    if question:
-                        if st.button("🔄", key=f"regen_history_{i}", help="重新生成回答"):
-                            st.session_state.regenerate_question = question
-                            st.session_state.regenerate_index = i
-                            st.rerun()
-                st.markdown("</div>", unsafe_allow_html=True)
-
-    # 如果有重新生成请求
+    # 只显示最近的若干条消息，更早的消息按需加载，重新运行的开销不随对话长度增长
+    render_history(msgs)
+
+    # 如果有重新生成请求：被重新生成的回答及之后的消息已经移除，新回答直接接在末尾，不需要再刷新一次
     if regenerate_question:
         with msgs.chat_message("assistant", avatar="🚀"):
-            st.info("🔄 正在重新生成回答...")
-            generate_ai_response(regenerate_question, msgs)
-        st.rerun()
+            notice = st.empty()
+            notice.info("🔄 正在重新生成回答...")
+            generate_ai_response(regenerate_question, msgs, use_cache=False, reuse_context=True)
+            notice.empty()
 
     # 用户输入框 - 固定在底部
     if prompt := st.chat_input("请输入你的问题..."):
@@ -780,6 +786,25 @@ def main():
         with msgs.chat_message("assistant", avatar="🚀"):
             generate_ai_response(prompt, msgs)
 
+# ---------- Streamlit 主界面 ----------
+def main():
+    # 初始化会话状态
+    initialize_session_state()
+    
+    # 复制按钮共用的脚本
+    install_copy_handler()
+    
+    # 页面标题（紧凑版）
+    st.markdown("""
+    <div class="custom-title">🌐 重庆科技大学 · 智能问答系统</div>
+    """, unsafe_allow_html=True)
+
+    # 设置侧边栏
+    setup_sidebar()
+
+    # 主聊天区域
+    chat_area()
+
 
 # 程序入口
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+"""回答缓存（rag.answer_cache）的测试"""
+import os
+
+import pytest
+
+from benchmarks.fakes import FakeStreamingChatModel, HashingEmbeddings
+from rag.answer_cache import SemanticAnswerCache
+
+DOCUMENT = os.path.join(os.path.dirname(__file__), os.pardir, "测试.md")
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """记录问题向量化次数"""
+
+    def __init__(self, dimensions=64):
+        super().__init__(dimensions)
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+def test_exact_match_needs_no_embedding():
+    embeddings = CountingEmbeddings()
+    cache = SemanticAnswerCache(embeddings)
+    cache.store("旷课", "扣5分/次", "v1", [], semantic=False)
+
+    assert cache.lookup(" 旷课？", "v1", [], semantic=False) == "扣5分/次"
+    assert cache.lookup("旷课", "v1", [], semantic=True) == "扣5分/次"
+    assert cache.lookup("迟到", "v1", [], semantic=False) is None
+    assert cache.lookup("旷课", "v2", [], semantic=False) is None
+    assert embeddings.queries == []
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_semantic_match_after_exact_miss():
+    embeddings = CountingEmbeddings()
+    cache = SemanticAnswerCache(embeddings, threshold=0.9)
+    cache.store("旷课一次扣多少分", "扣5分", "v1", [])
+
+    assert cache.lookup("旷课一次扣多少分呀", "v1", []) == "扣5分"
+    assert embeddings.queries == ["旷课一次扣多少分", "旷课一次扣多少分呀"]
+
+
+def test_keyword_query_makes_no_embedding_calls(tmp_path):
+    pytest.importorskip("faiss")
+    from rag.engine import EngineConfig, QAEngine
+
+    embeddings = CountingEmbeddings()
+    config = EngineConfig(
+        document_file_path=DOCUMENT, base_index_dir=str(tmp_path / "base_index"), embedding_cache_path="",
+        rule_answers=False, query_routing=False, coalesce_requests=False,
+    )
+    engine = QAEngine(config, embeddings=embeddings, llm=FakeStreamingChatModel(answer="扣5分/次"),
+                      summary_llm=FakeStreamingChatModel(answer="摘要"))
+    embeddings.queries.clear()
+
+    for session_id in ("s1", "s2"):
+        stream = engine.stream_answer(session_id, "旷课")
+        assert "".join(stream) == "扣5分/次"
+    # 另一个会话的首个问题由精确匹配命中回答缓存
+    assert stream.cached
+    assert embeddings.queries == []
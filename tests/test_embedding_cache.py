@@ -0,0 +1,29 @@
+"""持久化嵌入缓存（rag.embedding_cache）的测试"""
+import threading
+
+from benchmarks.fakes import HashingEmbeddings
+from rag.embedding_cache import CachedEmbeddings
+
+
+def test_concurrent_sessions_keep_exact_counts(tmp_path):
+    cache = CachedEmbeddings(HashingEmbeddings(), path=str(tmp_path / "embeddings.sqlite3"))
+    cache.embed_documents(["旷课", "迟到"])
+    num_threads, rounds = 8, 200
+    barrier = threading.Barrier(num_threads)
+
+    def worker():
+        barrier.wait()
+        for _ in range(rounds):
+            cache.embed_query("旷课扣几分")
+            cache.embed_documents(["旷课", "迟到"])
+
+    threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+    # 每轮 1 次问题查询和 2 个文档，全部计入，不因并发丢失
+    assert stats["hits"] + stats["misses"] == 2 + num_threads * rounds * 3
+    assert stats["misses"] <= 2 + num_threads
@@ -0,0 +1,83 @@
+"""EmbeddingScheduler 对接本地假嵌入服务（benchmarks.fake_openai_server）的测试"""
+import numpy as np
+import pytest
+
+from benchmarks.fake_openai_server import hash_vector, start_server
+from rag.embedding_scheduler import EmbeddingScheduler, make_batches
+
+langchain_openai = pytest.importorskip("langchain_openai")
+
+DIMENSIONS = 8
+
+
+class RecordingScheduler(EmbeddingScheduler):
+    """记录收到限流后降到的最低并发上限"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lowest_concurrency = self.concurrency
+
+    def _on_rate_limit(self, error, attempt):
+        delay = super()._on_rate_limit(error, attempt)
+        self.lowest_concurrency = min(self.lowest_concurrency, self.concurrency)
+        return delay
+
+
+@pytest.fixture
+def fake_server():
+    servers = []
+
+    def start(**options):
+        server, stats = start_server(dimensions=DIMENSIONS, latency=0.01, **options)
+        servers.append(server)
+        embeddings = langchain_openai.OpenAIEmbeddings(
+            openai_api_key="fake", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1",
+            max_retries=0, check_embedding_ctx_length=False,
+        )
+        return embeddings, stats
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_batches_and_preserves_order(fake_server):
+    embeddings, stats = fake_server()
+    scheduler = EmbeddingScheduler(embeddings, max_workers=4, max_batch_size=5)
+    texts = [f"第{i}条规定" for i in range(40)]
+
+    vectors = scheduler.embed_documents(texts)
+
+    assert stats["requests"] == len(make_batches(texts, max_batch_size=5)) == 8
+    assert stats["inputs"] == len(texts)
+    assert scheduler.stats["batches"] == 8
+    for text, vector in zip(texts, vectors):
+        np.testing.assert_allclose(vector, hash_vector(text, DIMENSIONS), rtol=1e-6)
+
+
+def test_rate_limit_halves_concurrency_and_recovers(fake_server):
+    embeddings, stats = fake_server(inject_429=2, retry_after=0.05)
+    scheduler = RecordingScheduler(embeddings, max_workers=4, max_batch_size=5)
+    texts = [f"片段{i}" for i in range(100)]
+
+    vectors = scheduler.embed_documents(texts)
+
+    assert stats["rate_limited"] == 2
+    assert scheduler.stats["rate_limited"] == 2
+    # 每次 429 并发上限减半：4 → 2 → 1
+    assert scheduler.lowest_concurrency == 1
+    # 之后连续成功，加性恢复到上限
+    assert scheduler.concurrency == 4
+    # 被限流的批次重试后仍在原来的位置
+    assert stats["inputs"] == len(texts)
+    for text, vector in zip(texts, vectors):
+        np.testing.assert_allclose(vector, hash_vector(text, DIMENSIONS), rtol=1e-6)
+
+
+def test_gives_up_after_max_retries(fake_server):
+    embeddings, _ = fake_server(inject_429=10, retry_after=0.01)
+    scheduler = EmbeddingScheduler(embeddings, max_workers=1, max_retries=2)
+
+    with pytest.raises(Exception) as error:
+        scheduler.embed_query("旷课扣几分")
+    assert getattr(error.value, "status_code", None) == 429
@@ -0,0 +1,66 @@
+"""流式文档提取的测试"""
+import io
+import subprocess
+import sys
+import types
+
+from PyPDF2 import PdfWriter
+
+from rag import extraction
+from rag.extraction import PDF_PARALLEL_MIN_PAGES, can_use_process_pool, iter_document_segments, iter_pdf_pages
+
+
+def make_pdf(num_pages):
+    writer = PdfWriter()
+    for _ in range(num_pages):
+        writer.add_blank_page(200, 200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def test_parallel_pdf_extraction_keeps_page_order():
+    num_pages = PDF_PARALLEL_MIN_PAGES + 9
+    pages = list(iter_pdf_pages(make_pdf(num_pages), workers=2))
+    assert [page.split("\n")[1] for page in pages] == [f"[第{i + 1}页]" for i in range(num_pages)]
+
+
+def test_text_blocks_decode_across_block_boundaries():
+    text = "操行考评" * 30000
+    segments = list(iter_document_segments("规定.md", io.BytesIO(text.encode("utf-8"))))
+    assert len(segments) > 1
+    assert "".join(segments) == text
+
+
+def test_pdf_pages_report_progress():
+    num_pages = PDF_PARALLEL_MIN_PAGES + 9
+    progress = []
+    pages = iter_document_segments("规定.pdf", io.BytesIO(make_pdf(num_pages)),
+                                   on_page=lambda done, total: progress.append((done, total)))
+    for i, _ in enumerate(pages):
+        # 每一页产出之前已报告进度
+        assert progress[-1] == (i + 1, num_pages)
+    assert len(progress) == num_pages
+
+
+def test_worker_module_does_not_load_retrieval_dependencies():
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, rag.pdf_worker; print(sorted({'numpy', 'faiss', 'langchain_core'} & set(sys.modules)))"],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    assert loaded == "[]"
+
+
+def test_script_main_extracts_in_process(monkeypatch):
+    # streamlit run 时 __main__ 是页面脚本，工作进程会重新执行它
+    page = types.ModuleType("__main__")
+    page.__file__ = "streamlit_app.py"
+    monkeypatch.setitem(sys.modules, "__main__", page)
+    assert not can_use_process_pool()
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("不应启动进程池")
+
+    monkeypatch.setattr(extraction, "ProcessPoolExecutor", no_pool)
+    num_pages = PDF_PARALLEL_MIN_PAGES + 1
+    assert len(list(iter_pdf_pages(make_pdf(num_pages), workers=2))) == num_pages
@@ -0,0 +1,67 @@
+"""后台导入任务（rag.ingestion）与清空上传文件的测试"""
+import io
+import os
+
+import pytest
+
+from benchmarks.fakes import FakeStreamingChatModel, HashingEmbeddings
+from rag.ingestion import IngestCancelled, IngestJob, IngestQueue
+
+DOCUMENT = os.path.join(os.path.dirname(__file__), os.pardir, "测试.md")
+
+
+def make_engine(tmp_path):
+    pytest.importorskip("faiss")
+    from rag.engine import EngineConfig, QAEngine
+
+    config = EngineConfig(
+        document_file_path=DOCUMENT, base_index_dir=str(tmp_path / "base_index"), embedding_cache_path="",
+        rule_answers=False, query_routing=False, coalesce_requests=False,
+    )
+    return QAEngine(config, embeddings=HashingEmbeddings(), llm=FakeStreamingChatModel(answer="好"),
+                    summary_llm=FakeStreamingChatModel(answer="摘要"))
+
+
+def test_get_only_returns_jobs_of_the_session():
+    queue = IngestQueue()
+    job = IngestJob("s1", "a.txt")
+    job.cancel_event.set()
+    queue.submit(job, lambda job: None)
+    assert queue.get("s1", job.job_id) is job
+    assert queue.get("s2", job.job_id) is None
+
+
+def test_cancel_before_commit_leaves_index_unchanged(tmp_path):
+    engine = make_engine(tmp_path)
+    knowledge_base = engine.get_session("s1").knowledge_base
+    num_chunks = knowledge_base.num_chunks
+    job = IngestJob("s1", "a.txt")
+
+    def progress(num_chunks):
+        # 向量化已全部完成，写入索引前被取消
+        job.cancel_event.set()
+
+    with pytest.raises(IngestCancelled):
+        engine.ingest("s1", "a.txt", io.BytesIO("旷课扣5分/次。".encode("utf-8")), on_progress=progress, job=job)
+    assert knowledge_base.num_chunks == num_chunks
+    assert "upload:a.txt" not in knowledge_base.sources
+
+
+def test_clear_files_wins_over_a_job_that_already_committed(tmp_path):
+    engine = make_engine(tmp_path)
+    knowledge_base = engine.get_session("s1").knowledge_base
+    add_document_stream = knowledge_base.add_document_stream
+    job = IngestJob("s1", "a.txt")
+
+    def committed_then_cleared(*args, **kwargs):
+        result = add_document_stream(*args, **kwargs)
+        # 片段已写入索引、文件尚未登记时，另一个线程清空了上传文件（cancel_all 会取消这个任务）
+        job.cancel_event.set()
+        engine.clear_files("s1")
+        return result
+
+    knowledge_base.add_document_stream = committed_then_cleared
+    with pytest.raises(IngestCancelled):
+        engine.ingest("s1", "a.txt", io.BytesIO("旷课扣5分/次。".encode("utf-8")), job=job)
+    assert "upload:a.txt" not in knowledge_base.sources
+    assert engine.files("s1") == []
@@ -0,0 +1,49 @@
+"""片段元数据（rag.knowledge_base.split_document）的测试"""
+import os
+
+from rag.knowledge_base import make_text_splitter, split_document
+
+DOCUMENT = os.path.join(os.path.dirname(__file__), os.pardir, "测试.md")
+
+
+def sections_of(text, source="base:规定.md", chunk_size=300):
+    docs, _ = split_document(make_text_splitter(chunk_size, 0), source, text)
+    return docs
+
+
+def section_containing(docs, text):
+    return next(doc.metadata["section"] for doc in docs if text in doc.page_content)
+
+
+def test_markdown_headings():
+    docs = sections_of("# 总则\n" + "说明。" * 80 + "\n## 附则\n" + "补充。" * 80)
+    assert docs[0].metadata["section"] == "总则"
+    assert docs[-1].metadata["section"] == "附则"
+
+
+def test_plain_text_regulation_headings():
+    text = "\n".join([
+        "重庆科技学院校长奖学金评定办法",
+        "第一条 为激励广大学生，设立校长奖学金。",
+        "第一章 总 则",
+        "第二条 本办法适用于全日制本科学生。",
+        "学习情况",
+        "1.上课迟到或早退扣1分/次，旷课扣5分/次。",
+    ])
+    docs = sections_of(text, chunk_size=30)
+    assert section_containing(docs, "设立校长奖学金") == "重庆科技学院校长奖学金评定办法"
+    assert section_containing(docs, "全日制本科学生") == "第一章 总 则"
+    assert section_containing(docs, "旷课扣5分/次") == "学习情况"
+
+
+def test_builtin_corpus_chunks_cite_sections():
+    with open(DOCUMENT, encoding="utf-8") as file:
+        docs = sections_of(file.read(), source="base:测试.md", chunk_size=100)
+    sections = [doc.metadata["section"] for doc in docs]
+    # 第一个标题之前的导言没有章节，之后的片段都有
+    first = next(i for i, section in enumerate(sections) if section is not None)
+    assert first <= 2 and None not in sections[first:]
+    assert section_containing(docs, "在课堂上睡觉、玩手机") == "学习情况"
+    assert "第五章 学业奖学金" in sections
+    # 句子和编号条目不是标题
+    assert not any(section.startswith(("1.", "第一条")) for section in sections if section)
@@ -0,0 +1,87 @@
+"""查询路由（rag.router）的测试"""
+import sys
+
+import numpy as np
+import pytest
+
+from rag.router import CHITCHAT, COMPLEX, LOOKUP, QueryRouter
+
+
+class FixedClassifier:
+    """返回固定概率的分类模型，用于检查置信度门槛"""
+
+    classes_ = np.array([CHITCHAT, COMPLEX, LOOKUP])
+
+    def __init__(self, **probabilities):
+        self.probabilities = [probabilities.get(route, 0.0) for route in self.classes_]
+
+    def predict_proba(self, questions):
+        return np.array([self.probabilities for _ in questions])
+
+
+def with_classifier(classifier, **options):
+    router = QueryRouter(**options)
+    router._model, router._model_ready = classifier, True
+    return router
+
+
+@pytest.fixture(scope="module")
+def router():
+    pytest.importorskip("sklearn")
+    return QueryRouter().warm_up()
+
+
+@pytest.mark.parametrize("question", ["你好", "您好！", "谢谢你", "hello", "再见~"])
+def test_greetings_get_canned_replies(router, question):
+    decision = router.route(question)
+    assert (decision.route, decision.reason) == (CHITCHAT, "rule")
+    assert decision.reply
+
+
+@pytest.mark.parametrize("question", ["那研究生呢", "旷课扣几分", "迟到一次扣多少分"])
+def test_short_factual_questions_are_lookups(router, question):
+    decision = router.route(question)
+    assert (decision.route, decision.reason) == (LOOKUP, "model")
+    assert decision.reply is None
+
+
+@pytest.mark.parametrize("question", [
+    "迟到扣分和旷课扣分有什么区别",
+    "比较一下校长奖学金和学业奖学金",
+    "为什么要实行操行考评制度",
+    "旷课扣几分？迟到呢？",
+])
+def test_comparisons_and_multi_part_questions_are_complex(router, question):
+    decision = router.route(question)
+    assert (decision.route, decision.reason) == (COMPLEX, "rule")
+
+
+def test_chitchat_needs_higher_confidence():
+    # 0.7 超过 min_confidence（0.5），但低于闲聊的 0.75
+    decision = with_classifier(FixedClassifier(chitchat=0.7, lookup=0.3)).route("你是谁")
+    assert (decision.route, decision.reason) == (COMPLEX, "fallback")
+    assert decision.confidence == pytest.approx(0.7)
+
+    decision = with_classifier(FixedClassifier(chitchat=0.8, lookup=0.2)).route("你是谁")
+    assert (decision.route, decision.reason) == (CHITCHAT, "model")
+    assert decision.reply is None
+
+
+def test_low_confidence_falls_back_to_complex():
+    decision = with_classifier(FixedClassifier(lookup=0.45, complex=0.3, chitchat=0.25)).route("宿舍几点熄灯")
+    assert (decision.route, decision.reason) == (COMPLEX, "fallback")
+
+    decision = with_classifier(FixedClassifier(lookup=0.55, complex=0.3, chitchat=0.15)).route("宿舍几点熄灯")
+    assert (decision.route, decision.reason) == (LOOKUP, "model")
+
+
+def test_rules_only_without_sklearn(monkeypatch):
+    for name in [name for name in sys.modules if name == "sklearn" or name.startswith("sklearn.")]:
+        monkeypatch.setitem(sys.modules, name, None)
+    monkeypatch.setitem(sys.modules, "sklearn", None)
+    router = QueryRouter()
+
+    assert router.route("你好").reply
+    assert router.route("旷课和迟到有什么区别").reason == "rule"
+    decision = router.route("旷课扣几分")
+    assert (decision.route, decision.confidence, decision.reason) == (COMPLEX, 0.0, "fallback")
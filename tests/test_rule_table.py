@@ -0,0 +1,73 @@
+"""操行考评规则表（rag.rule_table）的测试，使用内置语料 测试.md"""
+import os
+
+import pytest
+
+from rag.rule_table import RuleTable
+
+DOCUMENT = os.path.join(os.path.dirname(__file__), os.pardir, "测试.md")
+
+
+@pytest.fixture(scope="module")
+def table():
+    return RuleTable.from_file(DOCUMENT)
+
+
+def test_single_rule(table):
+    text, citations = table.answer("旷课扣几分")
+    assert "旷课：扣5分/次" in text
+    assert [citation["section"] for citation in citations] == ["学习情况"]
+
+
+def test_tally_from_base_score(table):
+    text, citations = table.answer("旷课2次、迟到3次，获校级学习类荣誉1项，操行成绩是多少")
+    assert "旷课 ×2：扣10分" in text
+    assert "上课迟到或早退 ×3：扣3分" in text
+    assert "获校级学习类荣誉表彰 ×1：加3分" in text
+    assert "操行成绩为 50 分" in text
+    assert citations
+
+
+def test_separate_lookups_do_not_invent_a_total(table):
+    text, _ = table.answer("迟到扣几分，旷课扣几分")
+    assert "上课迟到或早退：扣1分/次" in text and "旷课：扣5分/次" in text
+    assert "操行成绩为" not in text
+
+
+def test_lead_in_row_is_split_from_its_description(table):
+    behaviors = [rule.behavior for rule in table.rules if rule.category == "集体活动"]
+    assert behaviors == ["参加学院组织的集体活动", "参加学校组织的集体活动"]
+    text, _ = table.answer("参加学院组织的集体活动加几分")
+    assert "参加学院组织的集体活动：加1分/次" in text
+
+
+def test_threshold(table):
+    text, _ = table.answer("操行成绩多少分才能竞聘学生干部")
+    assert "竞聘学生干部：操行成绩85分及以上" in text
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("一等学业奖学金需要绩点多少", "一等奖学金（学业奖学金）：平均绩点3.0及以上"),
+    ("三等学业奖学金绩点要达到多少", "三等奖学金（学业奖学金）：平均绩点2.0及以上"),
+    ("一等学业奖学金绩点要求", "一等奖学金（学业奖学金）：平均绩点3.0及以上"),
+    ("学业奖学金操行要求", "学业奖学金：操行考评成绩90分及以上"),
+])
+def test_threshold_matches_subject_and_most_specific_purpose(table, question, expected):
+    text, _ = table.answer(question)
+    assert expected in text
+    assert len(text.splitlines()) == 2
+
+
+@pytest.mark.parametrize("question", [
+    "迟到扣分和旷课扣分有什么区别",
+    "旷课和迟到哪个扣分更多",
+    "我旷课3次了，还能评奖学金吗",
+    # 后半句匹配不到条款
+    "旷课扣几分，会影响评奖学金吗",
+    # 次数对应不到条款
+    "旷课2次、打篮球3次，操行成绩是多少",
+    # 操行门槛和各等级的绩点门槛都可能是答案
+    "学业奖学金的条件",
+])
+def test_declines_questions_beyond_the_table(table, question):
+    assert table.answer(question) is None
@@ -0,0 +1,132 @@
+"""请求合并（rag.singleflight）的测试"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rag.singleflight import StreamCoalescer, normalize_question
+
+TIMEOUT = 5
+
+
+class GatedSource:
+    """可控的底层 token 流：每放行一次产出一个 token，记录被调用的次数"""
+
+    def __init__(self, tokens, error=None):
+        self.tokens = tokens
+        self.error = error
+        self.calls = 0
+        self.emitted = threading.Semaphore(0)
+        self._gate = threading.Semaphore(0)
+
+    def __call__(self):
+        self.calls += 1
+        return self._stream()
+
+    def _stream(self):
+        for token in self.tokens:
+            assert self._gate.acquire(timeout=TIMEOUT)
+            yield token
+            self.emitted.release()
+        assert self._gate.acquire(timeout=TIMEOUT)
+        if self.error is not None:
+            raise self.error
+
+    def release(self, count=1):
+        for _ in range(count):
+            self._gate.release()
+
+    def wait_emitted(self, count):
+        for _ in range(count):
+            assert self.emitted.acquire(timeout=TIMEOUT)
+
+
+def test_normalize_question_ignores_spaces_and_trailing_punctuation():
+    assert normalize_question(" 旷课 扣几分？ ") == normalize_question("旷课扣几分") == "旷课扣几分"
+    assert normalize_question("What is GPA?") == "whatisgpa"
+
+
+def test_concurrent_duplicates_share_one_source_call():
+    coalescer = StreamCoalescer()
+    source = GatedSource(["操行", "基本分", "60分"])
+    joined = [coalescer.join("q", source) for _ in range(5)]
+
+    assert source.calls == 1
+    assert [leader for _, leader in joined] == [True, False, False, False, False]
+    assert len({id(shared) for shared, _ in joined}) == 1
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = [pool.submit(lambda shared=shared: "".join(shared.subscribe())) for shared, _ in joined]
+        source.release(4)
+        assert [result.result(timeout=TIMEOUT) for result in results] == ["操行基本分60分"] * 5
+    assert coalescer.stats() == {"in_flight": 0, "leaders": 1, "followers": 4}
+
+
+def test_late_joiner_replays_emitted_tokens():
+    coalescer = StreamCoalescer()
+    source = GatedSource(["旷课", "扣5分", "/次"])
+    shared, _ = coalescer.join("q", source)
+    source.release(2)
+    source.wait_emitted(2)
+
+    late, leader = coalescer.join("q", source)
+    assert late is shared and not leader
+    tokens = late.subscribe()
+    # 已产出的 token 不必等待底层流，立即回放
+    assert [next(tokens), next(tokens)] == ["旷课", "扣5分"]
+    source.release(2)
+    assert list(tokens) == ["/次"]
+    assert source.calls == 1
+
+
+def test_leader_error_reaches_every_follower():
+    coalescer = StreamCoalescer()
+    source = GatedSource(["部分回答"], error=RuntimeError("模型服务不可用"))
+    streams = [coalescer.join("q", source)[0] for _ in range(3)]
+
+    def consume(shared):
+        received = []
+        with pytest.raises(RuntimeError, match="模型服务不可用"):
+            for token in shared.subscribe():
+                received.append(token)
+        return received
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        results = [pool.submit(consume, shared) for shared in streams]
+        source.release(2)
+        assert [result.result(timeout=TIMEOUT) for result in results] == [["部分回答"]] * 3
+
+
+def test_async_subscriber_receives_error():
+    coalescer = StreamCoalescer()
+    source = GatedSource(["部分回答"], error=RuntimeError("模型服务不可用"))
+    shared, _ = coalescer.join("q", source)
+
+    async def consume():
+        received = []
+        with pytest.raises(RuntimeError, match="模型服务不可用"):
+            async for token in shared.asubscribe():
+                received.append(token)
+        return received
+
+    source.release(2)
+    assert asyncio.run(asyncio.wait_for(consume(), TIMEOUT)) == ["部分回答"]
+
+
+def test_finished_stream_leaves_the_table():
+    coalescer = StreamCoalescer()
+    first = GatedSource(["回答"])
+    shared, _ = coalescer.join("q", first)
+    assert coalescer.stats()["in_flight"] == 1
+    first.release(2)
+    assert list(shared.subscribe()) == ["回答"]
+    shared._thread.join(TIMEOUT)
+    assert coalescer.stats()["in_flight"] == 0
+
+    # 之后的相同问题重新发起，不再拿到已结束的流
+    second = GatedSource(["新的回答"])
+    again, leader = coalescer.join("q", second)
+    assert leader and again is not shared and second.calls == 1
+    second.release(2)
+    assert list(again.subscribe()) == ["新的回答"]
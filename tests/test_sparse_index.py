@@ -0,0 +1,46 @@
+"""稀疏检索索引（rag.sparse_index）的测试"""
+import threading
+
+from langchain_core.documents import Document
+
+from rag.sparse_index import SparseIndex
+
+
+def make_index(num_docs=200):
+    index = SparseIndex()
+    texts = [f"第{i}条 旷课扣{i % 7}分/次，迟到扣{i % 3}分/次。" for i in range(num_docs)]
+    index.add_documents([Document(page_content=text) for text in texts], [f"doc-{i}" for i in range(num_docs)])
+    return index
+
+
+def test_concurrent_first_searches_see_a_complete_index():
+    expected = [doc.page_content for doc in make_index().search("旷课扣3分", k=5)]
+    for _ in range(5):
+        # 共享的索引刚加载完：多个会话的第一次检索同时触发统计量的构建
+        index = make_index()
+        barrier = threading.Barrier(8)
+        results, errors = [], []
+
+        def search():
+            barrier.wait()
+            try:
+                results.append([doc.page_content for doc in index.search("旷课扣3分", k=5)])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=search) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert results == [expected] * 8
+
+
+def test_delete_and_scoped_search():
+    index = make_index(10)
+    index.delete(["doc-3"])
+    assert len(index) == 9
+    assert not any(doc.page_content.startswith("第3条") for doc in index.search("第3条", k=10))
+    scoped = index.search("旷课", k=10, ids=["doc-1", "doc-2"])
+    assert sorted(doc.page_content[:3] for doc in scoped) == ["第1条", "第2条"]